@@ -11,31 +11,48 @@ point defined in the configuration must be accessible to and writable by this
 package.
 
 Modules:
+    api: JSON interface to queries and subjects for programmatic clients.
+    backend: In-process stores that answer queries without an endpoint.
+    changelog: Append-only log of the triples written to the triplestore.
     conf_def: List of configuration defaults for Flask framework.
     conf_test: List of test configuration defaults for Flask framework.
+    events: Server-sent changes in the results of saved queries.
     forms: WTForms definitions for use in Flask views.
     i18n.en_US: Symbols to represent strings written in US English prose.
+    jobs: Background queue that runs bulk edits in throttled batches.
     sparqler: Handle forming and executing SPARQL queries.
+    stats: Background statistics about the contents of the triplestore.
     test.test_skmf: Unit tests for the Flask and SPARQL interfaces.
     views: Web page views for the Flask framework to render.
 
 Functions:
+    after_request: Remember recent writes of a session in its cookie.
     before_request: Perform standard setup before executing a Flask request.
+    connect_async_sparql: Establish asynchronous connection to SPARQL endpoint.
     connect_sparql: Establish connection to SPARQL endpoint.
+    stale_results: Return whether this request was served stale results.
+    template_globals: Provide values that every template may use.
     teardown_request: Perform standard cleanup after Flask request closes.
 """
 
-from flask import Flask, g
+from time import time
+
+from flask import Flask, g, session
 
 app = Flask(__name__)
 """Web framework application for handling views and sessions."""
 app.config.from_object('skmf.conf_def')
 app.config.from_envvar('FLASK_SETTINGS', silent=True)
 
-from skmf import views
-from skmf.sparqler import SPARQLER
+from skmf import api, events, jobs, stats, views
+from skmf.backend import get_backend
+from skmf.sparqler import SPARQLER, AsyncSPARQLER, aiohttp
 
 # Suppress warnings about unused circular import
+assert api
+assert events
+assert jobs
+assert stats
 assert views
 
 
@@ -57,10 +74,39 @@ def connect_sparql():
         KeyError: if a connection component was not defined in the config.
     """
     try:
-        return SPARQLER(endpoint = app.config['SPARQL_ENDPOINT']
-                                 + app.config['SPARQL_QUERY'],
-                        updateEndpoint = app.config['SPARQL_ENDPOINT']
-                                       + app.config['SPARQL_UPDATE'])
+        sparql = SPARQLER(endpoint = app.config['SPARQL_ENDPOINT']
+                                   + app.config['SPARQL_QUERY'],
+                          updateEndpoint = app.config['SPARQL_ENDPOINT']
+                                         + app.config['SPARQL_UPDATE'])
+    except KeyError as e:
+        raise KeyError(__name__, str(e))
+    sparql.backend = get_backend()
+    return sparql
+
+
+def connect_async_sparql():
+    """Return an asynchronous connection to a SPARQL endpoint, if enabled.
+    
+    The connection is formed from the same configuration as connect_sparql(),
+    but its requests are sent as coroutines over a pool of connections that is
+    shared by the whole process.
+    
+    Returns:
+        AsyncSPARQLER, or None if SPARQL_ASYNC is not set, the optional
+        aiohttp package is not installed, or queries are answered by a
+        backend instead of the endpoint.
+    
+    Raises:
+        KeyError: if a connection component was not defined in the config.
+    """
+    if (aiohttp is None or not app.config['SPARQL_ASYNC'] or
+            get_backend() is not None):
+        return None
+    try:
+        return AsyncSPARQLER(endpoint = app.config['SPARQL_ENDPOINT']
+                                      + app.config['SPARQL_QUERY'],
+                             updateEndpoint = app.config['SPARQL_ENDPOINT']
+                                            + app.config['SPARQL_UPDATE'])
     except KeyError as e:
         raise KeyError(__name__, str(e))
 
@@ -72,9 +118,63 @@ def before_request():
     A connection to a SPARQL endpoint is established and placed in the global
     context, g. This makes the triplestore available for any request that may
     require it. Since SPARQL requests are made with HTTP GET and POST commands,
-    there is no subsequent teardown needed for a SPARQL connection.
+    there is no subsequent teardown needed for a SPARQL connection. Views that
+    send several independent queries use the asynchronous connection in
+    'async_sparql', when one is available, to send them all at once. A session
+    that wrote recently reads from the primary endpoint, as it did in the
+    request that wrote, until its stickiness runs out. Every read of the
+    request shares the time budget of SPARQL_REQUEST_BUDGET seconds.
     """
     g.sparql = connect_sparql()
+    g.async_sparql = connect_async_sparql()
+    sticky_until = session.get('sparql_sticky', 0)
+    deadline = None
+    if app.config['SPARQL_REQUEST_BUDGET']:
+        deadline = time() + app.config['SPARQL_REQUEST_BUDGET']
+    for sparql in (g.sparql, g.async_sparql):
+        if sparql is not None:
+            sparql.sticky_until = sticky_until
+            sparql.deadline = deadline
+
+
+@app.after_request
+def after_request(response):
+    """Keep the time until which reads go to the primary in the session.
+    
+    Args:
+        response (Response): The response that is about to be sent.
+    
+    Returns:
+        The same response, unchanged.
+    """
+    sparql = getattr(g, 'sparql', None)
+    if sparql is not None:
+        sticky_until = sparql.sticky_until
+        if g.async_sparql is not None:
+            sticky_until = max(sticky_until, g.async_sparql.sticky_until)
+        if sticky_until > session.get('sparql_sticky', 0):
+            session['sparql_sticky'] = sticky_until
+    return response
+
+
+def stale_results():
+    """Return whether any read of this request returned a stale result.
+    
+    A stale result is the last good result of a read that could not be sent
+    to the endpoint, because the endpoint failed or its breaker was open.
+    
+    Returns:
+        True if a connection of this request served a stale result.
+    """
+    return any(sparql is not None and sparql.stale
+               for sparql in (getattr(g, 'sparql', None),
+                              getattr(g, 'async_sparql', None)))
+
+
+@app.context_processor
+def template_globals():
+    """Tell every template whether the page holds stale results."""
+    return {'stale': stale_results()}
 
 
 @app.teardown_request
@@ -0,0 +1,419 @@
+"""skmf.api by Brendan Sweeney, CSS 593, 2015.
+
+Define a machine interface to the datastore that is served by Flask alongside
+the Web page views. Requests and responses are plain JSON, so programmatic
+clients never trigger template rendering or the population of WTForms choice
+lists. Responses are streamed one result at a time and are split into pages
+with the 'limit' and 'offset' arguments. Each page carries an ETag so that a
+client may repeat a request with 'If-None-Match' and receive '304 Not Modified'
+when nothing has changed. Any values provided by a client are checked before
+they are passed to an object that interacts with the SPARQL endpoint. Queries
+are sent over the shared asynchronous connection pool when one is available,
+so a worker waiting on the endpoint holds no connection of its own. A query
+may also be saved, after which its changing results are streamed to any number
+of clients as server-sent events. Bulk edits are queued as background jobs,
+whose progress a client may follow while they are written in batches. A
+whole graph may be exported in N-Triples by the administrator.
+
+Functions:
+    api_graph: Stream every triple of one graph in N-Triples.
+    api_job: Report the status and progress of one background job.
+    api_job_submit: Queue a bulk edit described by posted triples.
+    api_query: Run a query described by posted triples and stream the results.
+    api_query_events: Stream changes in the results of a saved query.
+    api_query_save: Save a query described by posted triples for streaming.
+    api_subject: Stream all predicates and objects of a single subject.
+"""
+
+import hashlib
+import json
+import re
+from queue import Empty
+
+from flask import Response, abort, g, request, stream_with_context, url_for
+from flask.ext.login import current_user, login_required
+
+from skmf import app
+from skmf.events import get_hub, save_query
+from skmf.jobs import get_queue
+from skmf.resource import Query
+from skmf.sparqler import NTRIPLES, format_path, gather
+
+TERM_PATTERNS = {'uri': re.compile(r'^[^<>"{}|^`\\\s]+$'),
+                 'pfx': re.compile(r'^(a|[A-Za-z][\w.-]*:[\w.-]*)$'),
+                 'label': re.compile(r'^\w+$'),
+                 'path': re.compile(r'^[\w.:#/|^*+?()!<>-]+$'),
+                 'literal': re.compile(r'^[^"\\\r\n]*$')}
+"""dict: Patterns that a term value must match, keyed by the term type."""
+
+
+def _page_args():
+    """Return the page size and offset requested by the client.
+    
+    The page size defaults to API_PAGE_SIZE and may not exceed the value of
+    API_MAX_PAGE_SIZE from the configuration. A malformed or negative value
+    aborts the request.
+    
+    Returns:
+        Tuple of the limit and offset for one page of results.
+    """
+    try:
+        limit = int(request.args.get('limit', app.config['API_PAGE_SIZE']))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        abort(400)
+    if limit < 1 or offset < 0:
+        abort(400)
+    return min(limit, app.config['API_MAX_PAGE_SIZE']), offset
+
+
+def _graph_args(default = set()):
+    """Return the graphs named by repeated 'graph' arguments.
+    
+    Each name must be a plain label, so that it cannot break out of the graph
+    URI when a query or update is formed, and only the administrator may name
+    the 'users' graph, since it holds password hashes. A malformed name
+    aborts the request, as does naming 'users' without being the admin.
+    
+    Args:
+        default (set): Graphs to use if the client names none.
+    
+    Returns:
+        set of graph names.
+    """
+    graphlist = set(request.args.getlist('graph')) or set(default)
+    for name in graphlist:
+        if name and not TERM_PATTERNS['label'].match(name):
+            abort(400)
+    if 'users' in graphlist and current_user.get_id() != 'admin':
+        abort(403)
+    return graphlist
+
+
+def _check_entries(entrylist):
+    """Return True if a list of posted triples is safe to pass to a Query.
+    
+    Each entry must hold 'subject', 'predicate', and 'object' dicts in the
+    format accepted by the 'get_entries' method of Query. Every term must have
+    a known 'type' and a string 'value' that matches the pattern for its type,
+    so that a client cannot break out of the term when the query is formed.
+    Literals are only accepted in the object position and property paths only
+    in the predicate position, where they must also pass format_path().
+    
+    Args:
+        entrylist (list): RDF triples that combine to form a SPARQL query.
+    
+    Returns:
+        True if every entry is well-formed, False otherwise.
+    """
+    if not isinstance(entrylist, list) or not entrylist:
+        return False
+    for entry in entrylist:
+        if not isinstance(entry, dict):
+            return False
+        for part in ('subject', 'predicate', 'object'):
+            term = entry.get(part)
+            if not isinstance(term, dict):
+                return False
+            term_type = term.get('type')
+            value = term.get('value')
+            if term_type not in TERM_PATTERNS or not isinstance(value, str):
+                return False
+            if term_type == 'literal' and part != 'object':
+                return False
+            if term_type == 'path' and part != 'predicate':
+                return False
+            if not TERM_PATTERNS[term_type].match(value):
+                return False
+            if term_type == 'path' and format_path(value) is None:
+                return False
+    return True
+
+
+def _check_triples(entrylist):
+    """Return True if a list of posted triples is safe to write.
+    
+    Each entry must pass _check_entries(), and no term may be a placeholder
+    label or a property path, since only concrete triples can be written.
+    
+    Args:
+        entrylist (list): RDF triples to insert or delete.
+    
+    Returns:
+        True if every entry is well-formed, False otherwise.
+    """
+    if not _check_entries(entrylist):
+        return False
+    return all(entry[part]['type'] not in ('label', 'path')
+               for entry in entrylist
+               for part in ('subject', 'predicate', 'object'))
+
+
+def _stream_page(head, bindings, limit, offset, endpoint, **kwargs):
+    """Return a streamed JSON response holding one page of query results.
+    
+    The bindings are expected to hold at most one result more than the page
+    size, which signals that a following page exists. The ETag is computed
+    from the page content before streaming begins, and a request whose
+    'If-None-Match' header already holds that ETag receives an empty '304 Not
+    Modified' response instead.
+    
+    Args:
+        bindings (list): Results of a SPARQL query, in JSON format.
+        endpoint (str): Name of the view that serves the following page.
+        head (list): Placeholder labels that may appear in each result.
+        kwargs (dict): Extra arguments for the URL of the following page.
+        limit (int): Maximum number of results in one page.
+        offset (int): Number of results skipped before this page.
+    
+    Returns:
+        Flask Response that streams the page as a JSON document.
+    """
+    rows = bindings[:limit]
+    next_url = None
+    if len(bindings) > limit:
+        next_url = url_for(endpoint, limit=limit, offset=offset + limit,
+                           **kwargs)
+    digest = hashlib.sha1()
+    digest.update(json.dumps([head, rows], sort_keys=True).encode('utf-8'))
+    etag = digest.hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    def generate():
+        yield '{{"head": {{"vars": {}}}, "limit": {:d}, "offset": {:d}, ' \
+              '"next": {}, "results": ['.format(json.dumps(head), limit,
+                                                offset, json.dumps(next_url))
+        for index, row in enumerate(rows):
+            if index:
+                yield ', '
+            yield json.dumps(row)
+        yield ']}'
+
+    response = Response(stream_with_context(generate()),
+                        mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+
+@app.route('/api/query', methods=['POST'])
+def api_query():
+    """Run a query posted as JSON and stream one page of its results.
+    
+    The request body must be a list of triples in the format accepted by the
+    'get_entries' method of Query. Any 'label' term becomes a placeholder in
+    the results, along with its rdfs:label when one is available. Graphs to
+    include in the query may be named with repeated 'graph' arguments. A
+    query that the endpoint fails to answer is refused with 502.
+    
+    Returns:
+        Streamed JSON document with one page of query results.
+    """
+    entrylist = request.get_json(silent=True)
+    if not _check_entries(entrylist):
+        abort(400)
+    limit, offset = _page_args()
+    graphlist = _graph_args({''})
+    # Failure to set explicit parameters leads to broken garbage collection
+    query = Query(graphlist = graphlist, labellist = set(),
+                  subjectlist = {}, optlist = [])
+    sparql = g.async_sparql or g.sparql
+    bindings, = gather(query.get_entries(entrylist, limit=limit + 1,
+                                         offset=offset, sparql=sparql))
+    if bindings is None:
+        abort(502)
+    return _stream_page(sorted(query.labels), bindings, limit, offset,
+                        'api_query', graph=sorted(graphlist))
+
+
+@app.route('/api/subject')
+def api_subject():
+    """Stream one page of the predicates and objects of a single subject.
+    
+    The subject is identified by its full URI in the 'iri' argument. Graphs to
+    include in the query may be named with repeated 'graph' arguments, other-
+    wise the default scope of the endpoint is used, as it is for a Subject.
+    Results are sorted by predicate and object, so that pages never overlap.
+    
+    Returns:
+        Streamed JSON document with one page of predicates and objects.
+    """
+    iri = request.args.get('iri', '')
+    if not TERM_PATTERNS['uri'].match(iri):
+        abort(400)
+    limit, offset = _page_args()
+    graphlist = _graph_args()
+    orderlist = [{'type': 'label', 'value': 'p'},
+                 {'type': 'label', 'value': 'o'}]
+    sparql = g.async_sparql or g.sparql
+    results, = gather(sparql.query_subject(iri, 'uri', graphlist,
+                                           limit=limit + 1, offset=offset,
+                                           orderlist=orderlist))
+    if results is None:
+        abort(502)
+    bindings = results['results']['bindings']
+    return _stream_page(['p', 'o'], bindings, limit, offset, 'api_subject',
+                        iri=iri, graph=sorted(graphlist))
+
+
+@app.route('/api/query/saved', methods=['POST'])
+@login_required
+def api_query_save():
+    """Save a query posted as JSON so that its changes may be streamed.
+    
+    The request body and 'graph' arguments are the same as for api_query().
+    Saving the same query again returns the same id.
+    
+    Returns:
+        JSON document with the 'id' of the saved query and the URL of its
+        'events' stream.
+    """
+    entrylist = request.get_json(silent=True)
+    if not _check_entries(entrylist):
+        abort(400)
+    graphlist = _graph_args({''})
+    query_id = save_query(entrylist, graphlist, current_user.get_id())
+    events = url_for('api_query_events', query_id=query_id)
+    return Response(json.dumps({'id': query_id, 'events': events}),
+                    mimetype='application/json')
+
+
+@app.route('/api/query/<query_id>/events')
+@login_required
+def api_query_events(query_id):
+    """Stream the results of a saved query and every later change to them.
+    
+    The stream opens with a 'snapshot' event that holds every current result.
+    Each 'change' event that follows holds the change log number in 'seq' and
+    the results that were 'added' and 'removed'. A comment is sent whenever
+    the stream has been idle for EVENTS_KEEPALIVE seconds, so that proxies do
+    not close it. Results are pushed by a shared EventHub, so the endpoint is
+    never queried on behalf of a single client. Every open stream holds a
+    worker of the web server, so no more than EVENTS_MAX_STREAMS are served
+    at once and a client beyond them is asked to retry later. A client that
+    falls more than EVENTS_BACKLOG events behind has its stream closed, and
+    receives a new snapshot when it reconnects.
+    
+    Args:
+        query_id (str): Id returned when the query was saved.
+    
+    Returns:
+        Streamed 'text/event-stream' response.
+    """
+    hub = get_hub()
+    subscription = hub.subscribe(('saved', query_id), g.sparql)
+    if subscription is None:
+        abort(404)
+    if subscription is False:
+        abort(503)
+    queue, snapshot = subscription
+    keepalive = app.config['EVENTS_KEEPALIVE']
+    name = ('saved', query_id)
+
+    def generate():
+        try:
+            yield 'event: snapshot\ndata: {}\n\n'.format(
+                json.dumps({'seq': hub.seq, 'results': snapshot}))
+            while True:
+                try:
+                    event = queue.get(timeout=keepalive)
+                except Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if event is None:
+                    break
+                yield 'event: change\nid: {:d}\ndata: {}\n\n'.format(
+                    event['seq'], json.dumps(event))
+        finally:
+            hub.unsubscribe(name, queue)
+
+    # The request context is not kept, since the stream may stay open for hours
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/api/jobs', methods=['POST'])
+@login_required
+def api_job_submit():
+    """Queue a bulk edit posted as JSON to be written in the background.
+    
+    The request body must be a JSON document with an 'action' of 'INSERT' or
+    'DELETE' and a list of 'triples' in the format accepted by api_query(),
+    though without any 'label' or 'path' terms. Graphs to write may be named
+    with repeated 'graph' arguments. Only the administrator may queue a job,
+    and no job may write the 'users' graph, since it holds the credentials
+    of every account.
+    
+    Returns:
+        '202 Accepted' JSON document with the 'id' of the job and the URL of
+        its 'status'.
+    """
+    if current_user.get_id() != 'admin':
+        abort(403)
+    job = request.get_json(silent=True)
+    if not isinstance(job, dict):
+        abort(400)
+    entrylist = job.get('triples')
+    if job.get('action') not in ('INSERT', 'DELETE'):
+        abort(400)
+    if not _check_triples(entrylist):
+        abort(400)
+    graphlist = _graph_args({''})
+    if 'users' in graphlist:
+        abort(403)
+    job_id = get_queue().submit(job['action'], graphlist, entrylist)
+    status = url_for('api_job', job_id=job_id)
+    response = Response(json.dumps({'id': job_id, 'status': status}),
+                        status=202, mimetype='application/json')
+    response.headers['Location'] = status
+    return response
+
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def api_job(job_id):
+    """Report the status and progress of one background job.
+    
+    Args:
+        job_id (int): Id returned when the job was queued.
+    
+    Returns:
+        JSON document with the 'status' of the job, which is 'queued',
+        'running', 'done', or 'failed', the 'total' number of triples, the
+        number 'done', and the 'progress' as a fraction.
+    """
+    job = get_queue().status(job_id)
+    if job is None:
+        abort(404)
+    response = Response(json.dumps(job), mimetype='application/json')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/api/graph')
+@login_required
+def api_graph():
+    """Stream every triple of one graph in N-Triples.
+    
+    The graph is named by the 'graph' argument, or is the default graph of
+    the local namespace if none is given. Only the administrator may export a
+    graph, since a graph such as 'users' holds password hashes. The graph is
+    streamed from the endpoint with the Graph Store Protocol when it is
+    served.
+    
+    Returns:
+        Streamed 'application/n-triples' response.
+    """
+    if current_user.get_id() != 'admin':
+        abort(403)
+    name = request.args.get('graph', '')
+    if name and not TERM_PATTERNS['label'].match(name):
+        abort(400)
+    lines = g.sparql.export_graph(name)
+    if lines is None:
+        abort(502)
+    return Response(stream_with_context(lines), mimetype=NTRIPLES)
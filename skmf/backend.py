@@ -0,0 +1,1249 @@
+"""skmf.backend by Brendan Sweeney, CSS 593, 2015.
+
+Answer the structured queries and updates of a SPARQLER without a SPARQL
+endpoint. A Backend receives the same subject, optional, value, filter, order,
+expression, and group lists that query_general() and the UPDATE methods of a
+SPARQLER receive, and answers in the JSON format of SPARQL query results, so
+that nothing above the SPARQLER can tell the difference. No SPARQL text is
+formed at all. The MemoryBackend keeps every named graph in a GraphIndex that
+is held by this process, which suits small deployments and tests, and gives a
+fast reference against which the endpoint may be measured. It is selected by
+setting SPARQL_BACKEND to 'memory' and starts out empty.
+
+For read-mostly deployments, write_snapshot() saves named graphs to a
+directory in which every term is replaced by an integer ID, and the triples
+of each graph are kept as sorted NumPy arrays. The SnapshotBackend maps those
+files into memory instead of reading them, so it is ready at once however
+large the graphs are, and every worker process that serves the same snapshot
+shares the same pages. It is selected by setting SPARQL_BACKEND to
+'snapshot', and needs the optional numpy package.
+
+Classes:
+    Backend: Interface through which a SPARQLER answers without an endpoint.
+    GraphIndex: Triples of one graph, indexed by subject, predicate, object.
+    MemoryBackend: Backend that keeps every graph in memory.
+    SnapshotBackend: Read-only backend that answers from a mapped snapshot.
+
+Functions:
+    export_snapshot: Save graphs of a SPARQLER as a snapshot.
+    get_backend: Return the Backend shared by this process, if configured.
+    write_snapshot: Save triples of named graphs as a snapshot.
+"""
+
+import json
+import mmap
+import os
+import re
+from abc import ABC, abstractmethod
+from threading import Lock
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from skmf import app
+from skmf.sparqler import expand, parse_ntriples
+
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+"""str: Namespace of the XML Schema datatypes."""
+
+NUMERIC_TYPES = {XSD + name for name in (
+    'integer', 'decimal', 'float', 'double', 'int', 'long', 'short', 'byte',
+    'nonNegativeInteger', 'positiveInteger', 'negativeInteger',
+    'nonPositiveInteger', 'unsignedInt', 'unsignedLong', 'unsignedShort',
+    'unsignedByte')}
+"""set: Datatypes whose literals are compared as numbers."""
+
+AGGREGATES = {'COUNT', 'SUM', 'AVG', 'MIN', 'MAX', 'SAMPLE'}
+"""set: Names of the aggregate functions that a Backend evaluates."""
+
+TRUE = ('literal', 'true', '', XSD + 'boolean')
+"""tuple: Key of the boolean literal 'true'."""
+
+FALSE = ('literal', 'false', '', XSD + 'boolean')
+"""tuple: Key of the boolean literal 'false'."""
+
+ORDERS = (('spo', (0, 1, 2)), ('pos', (1, 2, 0)), ('osp', (2, 0, 1)))
+"""tuple: Name of each order in which snapshot triples are sorted, and the
+positions of subject, predicate, and object in the order."""
+
+MISSING = 0xFFFFFFFF
+"""int: Term ID that no snapshot assigns, used for terms it does not hold."""
+
+_backend = []
+_backend_lock = Lock()
+
+
+class _Unsupported(Exception):
+    """A query uses a feature that the backend cannot evaluate."""
+
+
+def _key(term):
+    """Return a hashable key for an RDF term in the JSON format of SPARQL.
+    
+    A prefixed name is expanded to its full URI, and the language tag of a
+    literal is kept in lowercase, as it is written by a SPARQLER.
+    
+    Args:
+        term (dict): RDF term with a 'type' of 'uri', 'pfx', 'bnode', or
+            'literal', and its 'value'.
+    
+    Returns:
+        Tuple of the kind of term, its value, and for a literal, its language
+        and datatype.
+    """
+    kind = term['type']
+    if kind == 'uri':
+        return ('uri', term['value'])
+    if kind == 'pfx':
+        return ('uri', expand(term['value']))
+    if kind == 'bnode':
+        return ('bnode', term['value'])
+    if kind in ('literal', 'typed-literal'):
+        datatype = term.get('datatype', '')
+        return ('literal', term['value'], term.get('xml:lang', '').lower(),
+                expand(datatype) if datatype else '')
+    raise _Unsupported('term type {}'.format(kind))
+
+
+def _term(key):
+    """Return the RDF term of a key, in the JSON format of SPARQL results."""
+    if key[0] != 'literal':
+        return {'type': key[0], 'value': key[1]}
+    term = {'type': 'literal', 'value': key[1]}
+    if key[2]:
+        term['xml:lang'] = key[2]
+    elif key[3]:
+        term['datatype'] = key[3]
+    return term
+
+
+def _literal(value, lang = '', datatype = ''):
+    """Return the key of a literal."""
+    return ('literal', value, lang, datatype)
+
+
+def _patterns(subjectlist):
+    """Return every triple pattern held by structured query data.
+    
+    Args:
+        subjectlist (dict): Structured data, as given to query_general().
+    
+    Returns:
+        list of (subject, predicate, object) tuples of RDF terms, where a
+        placeholder keeps the 'label' type.
+    
+    Raises:
+        _Unsupported: if a predicate is a property path.
+    """
+    patterns = []
+    for subject, predlist in subjectlist.items():
+        subject_term = {'type': predlist['type'], 'value': subject}
+        for predicate, objectlist in predlist['value'].items():
+            if objectlist['type'] == 'path':
+                raise _Unsupported('property path {}'.format(predicate))
+            predicate_term = {'type': objectlist['type'], 'value': predicate}
+            for rdfobject in objectlist['value']:
+                patterns.append((subject_term, predicate_term, rdfobject))
+    return patterns
+
+
+def _number(key):
+    """Return the numeric value of a literal, or None if it is not one."""
+    if key is None or key[0] != 'literal' or key[3] not in NUMERIC_TYPES:
+        return None
+    try:
+        return float(key[1])
+    except ValueError:
+        return None
+
+
+def _truth(key):
+    """Return the effective boolean value of a term, False on error."""
+    if key is None or key[0] != 'literal':
+        return False
+    if key[3] == XSD + 'boolean':
+        return key[1] in ('true', '1')
+    number = _number(key)
+    if number is not None:
+        return number != 0
+    return key[1] != ''
+
+
+def _compare(left, right):
+    """Return -1, 0, or 1 as one term sorts before, with, or after another.
+    
+    Numbers are compared by value and literals by their text. Any other pair
+    of terms cannot be compared.
+    
+    Returns:
+        int result of the comparison, or None if the terms are incomparable.
+    """
+    if left is None or right is None:
+        return None
+    left_number = _number(left)
+    right_number = _number(right)
+    if left_number is not None and right_number is not None:
+        return (left_number > right_number) - (left_number < right_number)
+    if left[0] == 'literal' and right[0] == 'literal':
+        return (left[1] > right[1]) - (left[1] < right[1])
+    return None
+
+
+def _sort_key(key):
+    """Return a value by which terms sort in the order of 'ORDER BY'."""
+    if key is None:
+        return (0,)
+    if key[0] == 'bnode':
+        return (1, 0, key[1])
+    if key[0] == 'uri':
+        return (2, 0, key[1])
+    number = _number(key)
+    if number is not None:
+        return (3, 0, number)
+    return (3, 1, key[1])
+
+
+class Backend(ABC):
+    """Interface through which a SPARQLER answers without an endpoint.
+    
+    Every method receives the same structured data as the SPARQLER method of
+    the same purpose, and answers in the same format. A backend must provide
+    select(), update(), load(), and drop(), or it cannot be created at all;
+    counts, existence checks, 'CONSTRUCT' queries, and the links of subjects
+    are formed from select(). A read answers None and a write answers False
+    on error.
+    """
+
+    @abstractmethod
+    def select(self, graphlist = {''}, labellist = set(), subjectlist = {},
+               optlist = [], limit = None, offset = None, valuelist = {},
+               filterlist = [], orderlist = [], exprlist = {},
+               grouplist = []):
+        """Return the results of a 'SELECT', as query_general() does."""
+
+    @abstractmethod
+    def update(self, action, name, subjectlist = {}):
+        """Insert or delete the triples of structured data in one graph.
+        
+        Args:
+            action (str): The update action, either 'INSERT' or 'DELETE'.
+            name (str): Name of the graph, as accepted by _set_graphs().
+            subjectlist (dict): Structured data that define the update.
+        
+        Returns:
+            True if the update was applied, False otherwise.
+        """
+
+    @abstractmethod
+    def load(self, name, triples, replace = False):
+        """Add triples to one graph, as SPARQLER.load_graph() does."""
+
+    @abstractmethod
+    def drop(self, name):
+        """Remove one graph, as SPARQLER.delete_graph() does."""
+
+    def count(self, graphlist = {''}, labellist = set(), subjectlist = {},
+              optlist = [], valuelist = {}, filterlist = []):
+        """Return the number of results, as query_count() does."""
+        result = self.select(graphlist, labellist, subjectlist, optlist,
+                             valuelist=valuelist, filterlist=filterlist)
+        if result is None:
+            return None
+        return len(result['results']['bindings'])
+
+    def ask(self, graphlist = {''}, subjectlist = {}, valuelist = {}):
+        """Return whether any result exists, as ask() does."""
+        result = self.select(graphlist, set(), subjectlist, limit=1,
+                             valuelist=valuelist)
+        if result is None:
+            return None
+        return bool(result['results']['bindings'])
+
+    def construct(self, graphlist = {''}, templatelist = {}, subjectlist = {},
+                  valuelist = {}, limit = None, offset = None):
+        """Return the triples formed from each result, as construct() does.
+        
+        A triple of the template whose placeholder is not bound by a result
+        is left out, and every triple is returned only once.
+        """
+        result = self.select(graphlist, set(), subjectlist, limit=limit,
+                             offset=offset, valuelist=valuelist)
+        if result is None:
+            return None
+        try:
+            template = _patterns(templatelist or subjectlist)
+        except _Unsupported as e:
+            print(__name__, str(e))
+            return None
+        triples = []
+        seen = set()
+        for row in result['results']['bindings']:
+            for pattern in template:
+                triple = []
+                for term in pattern:
+                    if term['type'] == 'label':
+                        term = row.get(term['value'])
+                        if term is None:
+                            break
+                    triple.append(_term(_key(term)))
+                else:
+                    key = tuple(_key(term) for term in triple)
+                    if key not in seen:
+                        seen.add(key)
+                        triples.append(tuple(triple))
+        return triples
+
+    def edges(self, idlist, graphlist = {''}, direction = 'both',
+              predlist = [], limit = None):
+        """Return the links of several subjects, as query_edges() does."""
+        node = {'type': 'label', 'value': 'n'}
+        neighbor = {'type': 'label', 'value': 'm'}
+        valuelist = {'n': [{'type': 'uri', 'value': id} for id in idlist]}
+        if predlist:
+            valuelist['p'] = [{'type': 'uri', 'value': id}
+                              for id in predlist]
+        is_iri = {'type': 'function', 'value': 'isIRI', 'args': [neighbor]}
+        branches = []
+        if direction in ('out', 'both'):
+            predicate = {'p': {'type': 'label', 'value': [neighbor]}}
+            branches.append(('out', {'n': {'type': 'label',
+                                           'value': predicate}}))
+        if direction in ('in', 'both'):
+            predicate = {'p': {'type': 'label', 'value': [node]}}
+            branches.append(('in', {'m': {'type': 'label',
+                                          'value': predicate}}))
+        bindings = []
+        for way, subjectlist in branches:
+            result = self.select(graphlist, {'n', 'p', 'm'}, subjectlist,
+                                 valuelist=valuelist, filterlist=[is_iri])
+            if result is None:
+                return None
+            for row in result['results']['bindings']:
+                row['dir'] = {'type': 'literal', 'value': way}
+                bindings.append(row)
+        if limit is not None:
+            bindings = bindings[:limit]
+        return {'head': {'vars': ['n', 'p', 'm', 'dir']},
+                'results': {'bindings': bindings}}
+
+
+class GraphIndex(object):
+    """Triples of one graph, indexed by subject, predicate, and object.
+    
+    Each triple is kept in three nested dicts, ordered subject-predicate-
+    object, predicate-object-subject, and object-subject-predicate, so that a
+    triple pattern with any of its positions bound is answered by lookups
+    alone. Terms are kept as the keys returned by _key().
+    """
+
+    def __init__(self):
+        """Start with no triples."""
+        self.spo = {}
+        self.pos = {}
+        self.osp = {}
+        self.size = 0
+
+    def __len__(self):
+        """Return the number of triples in the graph."""
+        return self.size
+
+    def add(self, subject, predicate, rdfobject):
+        """Add one triple, unless the graph already holds it."""
+        objects = self.spo.setdefault(subject, {}).setdefault(predicate,
+                                                               set())
+        if rdfobject in objects:
+            return
+        objects.add(rdfobject)
+        self.pos.setdefault(predicate, {}).setdefault(rdfobject,
+                                                      set()).add(subject)
+        self.osp.setdefault(rdfobject, {}).setdefault(subject,
+                                                      set()).add(predicate)
+        self.size += 1
+
+    def remove(self, subject, predicate, rdfobject):
+        """Remove one triple, if the graph holds it."""
+        objects = self.spo.get(subject, {}).get(predicate)
+        if not objects or rdfobject not in objects:
+            return
+        for index, first, second, third in (
+                (self.spo, subject, predicate, rdfobject),
+                (self.pos, predicate, rdfobject, subject),
+                (self.osp, rdfobject, subject, predicate)):
+            inner = index[first]
+            inner[second].discard(third)
+            if not inner[second]:
+                del inner[second]
+                if not inner:
+                    del index[first]
+        self.size -= 1
+
+    def match(self, subject, predicate, rdfobject):
+        """Yield every triple that matches a pattern.
+        
+        Args:
+            predicate (tuple): Key of the predicate, or None for any.
+            rdfobject (tuple): Key of the object, or None for any.
+            subject (tuple): Key of the subject, or None for any.
+        
+        Returns:
+            Generator of (subject, predicate, object) tuples of keys.
+        """
+        if subject is not None:
+            predicates = self.spo.get(subject, {})
+            if predicate is not None:
+                objects = predicates.get(predicate, ())
+                if rdfobject is not None:
+                    if rdfobject in objects:
+                        yield subject, predicate, rdfobject
+                    return
+                for found in objects:
+                    yield subject, predicate, found
+            elif rdfobject is not None:
+                for found in self.osp.get(rdfobject, {}).get(subject, ()):
+                    yield subject, found, rdfobject
+            else:
+                for found, objects in predicates.items():
+                    for other in objects:
+                        yield subject, found, other
+        elif predicate is not None:
+            objects = self.pos.get(predicate, {})
+            if rdfobject is not None:
+                for found in objects.get(rdfobject, ()):
+                    yield found, predicate, rdfobject
+            else:
+                for other, subjects in objects.items():
+                    for found in subjects:
+                        yield found, predicate, other
+        elif rdfobject is not None:
+            for found, predicates in self.osp.get(rdfobject, {}).items():
+                for other in predicates:
+                    yield found, other, rdfobject
+        else:
+            for found, predicates in self.spo.items():
+                for other, objects in predicates.items():
+                    for third in objects:
+                        yield found, other, third
+
+
+class MemoryBackend(Backend):
+    """Backend that keeps every graph in a GraphIndex held by this process.
+    
+    A query is answered by joining its triple patterns one at a time, always
+    choosing next the pattern with the most positions already bound, then
+    extending each result with its 'OPTIONAL' bodies, applying its filters,
+    groups, and computed labels, and finally sorting and paging the results.
+    Every query and update holds a lock, so each sees a consistent state.
+    A query whose graph list is empty reads the union of every graph.
+    
+    Attributes:
+        graphs (dict): GraphIndex of each graph, keyed by graph name.
+    """
+
+    def __init__(self):
+        """Start with no graphs."""
+        self.graphs = {}
+        self._lock = Lock()
+
+    def _dataset(self, graphlist):
+        """Return the indexes of the graphs that a query reads."""
+        if not graphlist:
+            return list(self.graphs.values())
+        return [self.graphs[name] for name in sorted(graphlist)
+                if name in self.graphs]
+
+    def _match(self, dataset, pattern, row):
+        """Return each extension of one result that matches a pattern.
+        
+        Args:
+            dataset (list): Indexes of the graphs that the query reads.
+            pattern (tuple): Three keys, where a placeholder is ('label',
+                name).
+            row (dict): Keys bound so far, by placeholder label.
+        
+        Returns:
+            list of results, each a new dict.
+        """
+        bound = [row.get(term[1]) if term[0] == 'label' else term
+                 for term in pattern]
+        found = []
+        seen = set() if len(dataset) > 1 else None
+        for index in dataset:
+            for triple in index.match(*bound):
+                if seen is not None:
+                    if triple in seen:
+                        continue
+                    seen.add(triple)
+                result = dict(row)
+                for term, value in zip(pattern, triple):
+                    if term[0] == 'label':
+                        if result.setdefault(term[1], value) != value:
+                            break
+                else:
+                    found.append(result)
+        return found
+
+    def _join(self, dataset, subjectlist, rows):
+        """Return the results of a basic graph pattern, given earlier ones.
+        
+        Args:
+            dataset (list): Indexes of the graphs that the query reads.
+            rows (list): Results that the patterns extend.
+            subjectlist (dict): Structured data that define the patterns.
+        
+        Returns:
+            list of results, each a dict of keys by placeholder label.
+        """
+        patterns = [tuple(('label', term['value']) if term['type'] == 'label'
+                          else _key(term) for term in pattern)
+                    for pattern in _patterns(subjectlist)]
+        bound = set()
+        for row in rows[:1]:
+            bound.update(row)
+        while patterns and rows:
+            # join the pattern with the fewest open positions first
+            pattern = min(patterns, key=lambda pattern: sum(
+                term[0] == 'label' and term[1] not in bound
+                for term in pattern))
+            patterns.remove(pattern)
+            rows = [result for row in rows
+                    for result in self._match(dataset, pattern, row)]
+            bound.update(term[1] for term in pattern if term[0] == 'label')
+        return rows
+
+    def _optional(self, dataset, optional, rows):
+        """Return each result extended by an 'OPTIONAL' body, if it can be.
+        
+        Args:
+            dataset (list): Indexes of the graphs that the query reads.
+            optional (dict): Structured data that define the body.
+            rows (list): Results that the body extends.
+        
+        Returns:
+            list of results, keeping every result that the body cannot extend.
+        """
+        extended = []
+        for row in rows:
+            extended.extend(self._join(dataset, optional, [row]) or [row])
+        return extended
+
+    def _evaluate(self, expression, row):
+        """Return the value of an expression for one result.
+        
+        Args:
+            expression (dict): Expression, as accepted by _format_expression()
+                of SPARQLER.
+            row (dict): Keys bound by the result, by placeholder label.
+        
+        Returns:
+            Key of the value, or None if it is unbound or an error.
+        """
+        kind = expression['type']
+        if kind == 'label':
+            return row.get(expression['value'])
+        if kind == 'operator':
+            return self._operate(expression, row)
+        if kind != 'function':
+            return _key(expression)
+        name = expression['value'].upper()
+        args = expression.get('args', [])
+        if name == 'COALESCE':
+            for arg in args:
+                value = self._evaluate(arg, row)
+                if value is not None:
+                    return value
+            return None
+        if name == 'BOUND':
+            return TRUE if row.get(args[0]['value']) is not None else FALSE
+        if name in AGGREGATES:
+            raise _Unsupported('aggregate {} outside a group'.format(name))
+        values = [self._evaluate(arg, row) for arg in args]
+        if name in ('ISIRI', 'ISURI', 'ISLITERAL', 'ISBLANK'):
+            kinds = {'ISIRI': 'uri', 'ISURI': 'uri', 'ISLITERAL': 'literal',
+                     'ISBLANK': 'bnode'}
+            if values[0] is None:
+                return None
+            return TRUE if values[0][0] == kinds[name] else FALSE
+        if None in values:
+            return None
+        if name == 'STR':
+            if values[0][0] == 'bnode':
+                return None
+            return _literal(values[0][1])
+        if name == 'LANG':
+            return _literal(values[0][2]) if values[0][0] == 'literal' \
+                else None
+        if any(value[0] != 'literal' for value in values):
+            return None
+        texts = [value[1] for value in values]
+        if name == 'LANGMATCHES':
+            tag, tagrange = texts[0].lower(), texts[1].lower()
+            if tagrange == '*':
+                return TRUE if tag else FALSE
+            matched = tag == tagrange or tag.startswith(tagrange + '-')
+            return TRUE if matched else FALSE
+        if name == 'STRAFTER':
+            position = texts[0].find(texts[1])
+            if position < 0:
+                return _literal('')
+            return _literal(texts[0][position + len(texts[1]):],
+                            values[0][2], values[0][3])
+        if name == 'STRSTARTS':
+            return TRUE if texts[0].startswith(texts[1]) else FALSE
+        if name == 'CONTAINS':
+            return TRUE if texts[1] in texts[0] else FALSE
+        if name in ('LCASE', 'UCASE'):
+            text = texts[0].lower() if name == 'LCASE' else texts[0].upper()
+            return _literal(text, values[0][2], values[0][3])
+        if name == 'REGEX':
+            flags = re.IGNORECASE if len(texts) > 2 and 'i' in texts[2] \
+                else 0
+            try:
+                found = re.search(texts[1], texts[0], flags)
+            except re.error:
+                return None
+            return TRUE if found else FALSE
+        raise _Unsupported('function {}'.format(name))
+
+    def _operate(self, expression, row):
+        """Return the value of an operator expression for one result."""
+        operator = expression['value']
+        args = expression['args']
+        if operator == '!':
+            value = self._evaluate(args[0], row)
+            return None if value is None else (FALSE if _truth(value)
+                                               else TRUE)
+        if operator in ('&&', '||'):
+            truths = [_truth(self._evaluate(arg, row)) for arg in args]
+            result = all(truths) if operator == '&&' else any(truths)
+            return TRUE if result else FALSE
+        left, right = [self._evaluate(arg, row) for arg in args]
+        if operator in ('=', '!='):
+            if left is None or right is None:
+                return None
+            order = _compare(left, right)
+            equal = order == 0 if _number(left) is not None and \
+                _number(right) is not None else left == right
+            return TRUE if equal == (operator == '=') else FALSE
+        order = _compare(left, right)
+        if order is None:
+            return None
+        tests = {'<': order < 0, '>': order > 0, '<=': order <= 0,
+                 '>=': order >= 0}
+        if operator not in tests:
+            raise _Unsupported('operator {}'.format(operator))
+        return TRUE if tests[operator] else FALSE
+
+    def _aggregate(self, expression, rows):
+        """Return the value of an aggregate expression over a group."""
+        name = expression['value'].upper()
+        args = expression.get('args', [])
+        if name == 'COUNT' and not args:
+            return _literal(str(len(rows)), '', XSD + 'integer')
+        values = [self._evaluate(args[0], row) for row in rows]
+        values = [value for value in values if value is not None]
+        if expression.get('distinct'):
+            values = sorted(set(values), key=_sort_key)
+        if name == 'COUNT':
+            return _literal(str(len(values)), '', XSD + 'integer')
+        if name == 'SAMPLE':
+            return values[0] if values else None
+        if name in ('MIN', 'MAX'):
+            if not values:
+                return None
+            pick = min if name == 'MIN' else max
+            return pick(values, key=_sort_key)
+        numbers = [_number(value) for value in values]
+        if None in numbers:
+            return None
+        total = sum(numbers)
+        if name == 'AVG':
+            total = total / len(numbers) if numbers else 0
+        return _literal(repr(total), '', XSD + 'double')
+
+    def _group(self, rows, exprlist, grouplist):
+        """Return one result for each group of results, with aggregates.
+        
+        Args:
+            exprlist (dict): Expressions to compute, keyed by result label.
+            grouplist (list): Labels by which to group the results.
+            rows (list): Results to group.
+        
+        Returns:
+            list of results, one for each group.
+        """
+        groups = {}
+        for row in rows:
+            key = tuple(row.get(label) for label in grouplist)
+            groups.setdefault(key, []).append(row)
+        if not grouplist and not groups:
+            groups[()] = []
+        grouped = []
+        for key, members in groups.items():
+            result = {label: value
+                      for label, value in zip(grouplist, key)
+                      if value is not None}
+            for label, expression in exprlist.items():
+                if (expression['type'] == 'function' and
+                        expression['value'].upper() in AGGREGATES):
+                    value = self._aggregate(expression, members)
+                else:
+                    value = self._evaluate(expression, result)
+                if value is not None:
+                    result[label] = value
+            grouped.append(result)
+        return grouped
+
+    def select(self, graphlist = {''}, labellist = set(), subjectlist = {},
+               optlist = [], limit = None, offset = None, valuelist = {},
+               filterlist = [], orderlist = [], exprlist = {},
+               grouplist = []):
+        """Return the results of a 'SELECT', as query_general() does.
+        
+        Args:
+            exprlist (dict): Expressions to compute, keyed by result label.
+            filterlist (list): Expressions that restrict the query results.
+            graphlist (set): Named graphs in which to scope the query.
+            grouplist (list): Labels by which to group results for aggregates.
+            labellist (set): Header labels for the query results.
+            limit (int): Maximum number of results to return, if provided.
+            offset (int): Number of results to skip, if provided.
+            optlist (list): dicts forming full query bodies.
+            orderlist (list): Expressions by which to sort the results.
+            subjectlist (dict): Structured data that define the query.
+            valuelist (dict): RDF objects to bind to placeholder labels.
+        
+        Returns:
+            JSON object containing SPARQL query results, or None if the query
+            uses a feature that is not supported.
+        """
+        try:
+            rows = [{}]
+            for label, rdfobjects in valuelist.items():
+                keys = [_key(rdfobject) for rdfobject in rdfobjects]
+                rows = [dict(row, **{label: key})
+                        for row in rows for key in keys]
+            with self._lock:
+                dataset = self._dataset(graphlist)
+                rows = self._join(dataset, subjectlist, rows)
+                for optional in optlist:
+                    rows = self._optional(dataset, optional, rows)
+            rows = [row for row in rows
+                    if all(_truth(self._evaluate(expression, row))
+                           for expression in filterlist)]
+            aggregated = any(expression['type'] == 'function' and
+                             expression['value'].upper() in AGGREGATES
+                             for expression in exprlist.values())
+            if grouplist or aggregated:
+                rows = self._group(rows, exprlist, grouplist)
+            else:
+                for row in rows:
+                    for label, expression in exprlist.items():
+                        value = self._evaluate(expression, row)
+                        if value is not None:
+                            row[label] = value
+            for expression in reversed(orderlist):
+                rows.sort(key=lambda row: _sort_key(
+                              self._evaluate(expression, row)),
+                          reverse=expression.get('order') == 'DESC')
+        except (_Unsupported, KeyError, IndexError, ValueError) as e:
+            print(__name__, 'unsupported query', str(e))
+            return None
+        labels = set(labellist) | set(exprlist)
+        if not labellist:
+            labels.update(label for row in rows for label in row)
+        labels = sorted(labels)
+        bindings = []
+        seen = set()
+        for row in rows:
+            key = tuple(row.get(label) for label in labels)
+            if key in seen:
+                continue
+            seen.add(key)
+            bindings.append({label: _term(row[label]) for label in labels
+                             if row.get(label) is not None})
+        bindings = bindings[offset or 0:]
+        if limit is not None:
+            bindings = bindings[:limit]
+        return {'head': {'vars': labels}, 'results': {'bindings': bindings}}
+
+    def _data(self, subjectlist):
+        """Return the triples of structured data as tuples of keys.
+        
+        Raises:
+            _Unsupported: if the data hold a placeholder or a property path.
+        """
+        triples = []
+        for pattern in _patterns(subjectlist):
+            if any(term['type'] == 'label' for term in pattern):
+                raise _Unsupported('placeholder in data')
+            triples.append(tuple(_key(term) for term in pattern))
+        return triples
+
+    def update(self, action, name, subjectlist = {}):
+        """Insert or delete the triples of structured data in one graph.
+        
+        Args:
+            action (str): The update action, either 'INSERT' or 'DELETE'.
+            name (str): Name of the graph, as accepted by _set_graphs().
+            subjectlist (dict): Structured data that define the update.
+        
+        Returns:
+            True if the update was applied, False otherwise.
+        """
+        try:
+            triples = self._data(subjectlist)
+        except (_Unsupported, KeyError) as e:
+            print(__name__, 'unsupported update', str(e))
+            return False
+        with self._lock:
+            if action == 'INSERT':
+                index = self.graphs.setdefault(name, GraphIndex())
+                for triple in triples:
+                    index.add(*triple)
+            elif name in self.graphs:
+                index = self.graphs[name]
+                for triple in triples:
+                    index.remove(*triple)
+        return True
+
+    def load(self, name, triples, replace = False):
+        """Add many triples to one graph, or replace its content with them.
+        
+        Args:
+            name (str): Name of the graph, as accepted by _set_graphs().
+            replace (bool): Whether to remove every other triple of the graph.
+            triples (iterable): (subject, predicate, object) tuples of RDF
+                terms in the JSON format of SPARQL query results.
+        
+        Returns:
+            True if the triples were added, False otherwise.
+        """
+        index = GraphIndex()
+        try:
+            keys = [tuple(_key(term) for term in triple)
+                    for triple in triples]
+        except (_Unsupported, KeyError) as e:
+            print(__name__, 'unsupported triple', str(e))
+            return False
+        with self._lock:
+            if not replace:
+                index = self.graphs.setdefault(name, index)
+            for triple in keys:
+                index.add(*triple)
+            self.graphs[name] = index
+        return True
+
+    def drop(self, name):
+        """Remove one graph and every triple in it.
+        
+        Args:
+            name (str): Name of the graph, as accepted by _set_graphs().
+        
+        Returns:
+            True, since removing a missing graph is not an error.
+        """
+        with self._lock:
+            self.graphs.pop(name, None)
+        return True
+
+
+def _dump(key):
+    """Return the bytes under which a snapshot stores a term key."""
+    return json.dumps(key, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def _bisect(column, keys, lo, hi, right = False):
+    """Return where each key belongs within its own range of a column.
+    
+    Every key is searched for at once, halving all of the ranges in each
+    step, so only the entries at the midpoints are ever read.
+    
+    Args:
+        column (ndarray): Sorted IDs, usually mapped from a snapshot.
+        hi (ndarray): End of the range in which to search for each key.
+        keys (ndarray): IDs for which to search, as uint32.
+        lo (ndarray): Start of the range in which to search for each key.
+        right (bool): Whether to return the position after equal entries.
+    
+    Returns:
+        ndarray of positions, one for each key.
+    """
+    lo = lo.copy()
+    hi = hi.copy()
+    active = lo < hi
+    while active.any():
+        low = lo[active]
+        high = hi[active]
+        middle = (low + high) // 2
+        values = column[middle]
+        if right:
+            below = values <= keys[active]
+        else:
+            below = values < keys[active]
+        lo[active] = numpy.where(below, middle + 1, low)
+        hi[active] = numpy.where(below, high, middle)
+        active = lo < hi
+    return lo
+
+
+class SnapshotBackend(MemoryBackend):
+    """Read-only backend that answers from a snapshot mapped into memory.
+    
+    A snapshot directory holds the terms of every graph, sorted and encoded
+    as JSON, so that the ID of a term is its rank and is found by binary
+    search. For each graph, it holds three arrays of IDs, with the triples
+    sorted in subject-predicate-object, predicate-object-subject, and
+    object-subject-predicate order. A triple pattern is matched in the order
+    whose leading positions are bound, by binary search for every partial
+    result at once, and partial results are joined as columns of IDs. Terms
+    are decoded only for the results that remain.
+    
+    Attributes:
+        graphs (dict): Mapped arrays of each graph, keyed by graph name and
+            then by order.
+        path (str): Directory of the snapshot.
+        size (int): Number of distinct terms in the snapshot.
+    """
+
+    def __init__(self, path):
+        """Map the files of a snapshot into memory.
+        
+        Args:
+            path (str): Directory written by write_snapshot().
+        
+        Raises:
+            OSError: if a file of the snapshot cannot be opened.
+            ValueError: if the manifest of the snapshot is malformed.
+        """
+        super().__init__()
+        self.path = path
+        with open(os.path.join(path, 'manifest.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.size = manifest['terms']
+        self._offsets = numpy.load(os.path.join(path, 'terms.npy'),
+                                   mmap_mode='r')
+        self._terms = b''
+        if self.size:
+            with open(os.path.join(path, 'terms.dat'), 'rb') as terms_file:
+                self._terms = mmap.mmap(terms_file.fileno(), 0,
+                                        access=mmap.ACCESS_READ)
+        for name, graph in manifest['graphs'].items():
+            self.graphs[name] = {
+                order: numpy.load(os.path.join(path, '{}.{}.npy'.format(
+                    graph['file'], order)), mmap_mode='r')
+                for order, positions in ORDERS}
+
+    def _term_bytes(self, number):
+        """Return the stored bytes of the term with an ID."""
+        return self._terms[int(self._offsets[number]):
+                           int(self._offsets[number + 1])]
+
+    def _encode(self, key):
+        """Return the ID of a term key, or MISSING if no graph holds it."""
+        target = _dump(key)
+        lo = 0
+        hi = self.size
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if self._term_bytes(middle) < target:
+                lo = middle + 1
+            else:
+                hi = middle
+        if lo < self.size and self._term_bytes(lo) == target:
+            return lo
+        return MISSING
+
+    def _decode(self, column):
+        """Return the term key of each ID in a column."""
+        numbers, positions = numpy.unique(column, return_inverse=True)
+        starts = self._offsets[numbers].tolist()
+        ends = self._offsets[numbers + 1].tolist()
+        keys = [tuple(json.loads(self._terms[start:end].decode('utf-8')))
+                for start, end in zip(starts, ends)]
+        return [keys[position] for position in positions.ravel()]
+
+    def _scan(self, dataset, pattern, index, columns):
+        """Join partial results, as columns of IDs, with one triple pattern.
+        
+        Args:
+            columns (dict): IDs of each bound label, one for each result.
+            dataset (list): Mapped arrays of the graphs that the query reads.
+            index (ndarray): Position of each result in the original list.
+            pattern (tuple): Three positions, each an ID or ('label', name).
+        
+        Returns:
+            Tuple of the index and columns of the joined results.
+        """
+        count = len(index)
+        keys = {}
+        for position, term in enumerate(pattern):
+            if not isinstance(term, tuple):
+                keys[position] = numpy.uint32(term)
+            elif term[1] in columns:
+                keys[position] = columns[term[1]]
+        order, prefix = ORDERS[0], -1
+        for name, positions in ORDERS:
+            length = 0
+            while length < 3 and positions[length] in keys:
+                length += 1
+            if length > prefix:
+                order, prefix = (name, positions), length
+        name, positions = order
+        rows = []
+        found = {}
+        for graph in dataset:
+            table = graph[name]
+            lo = numpy.zeros(count, dtype=numpy.int64)
+            hi = numpy.full(count, table.shape[1], dtype=numpy.int64)
+            uniform = True
+            for level in range(prefix):
+                column = table[level]
+                key = keys[positions[level]]
+                if uniform:
+                    # every result shares one range, so search it directly
+                    start, stop = int(lo[0]), int(hi[0])
+                    window = column[start:stop]
+                    lo = start + numpy.broadcast_to(
+                        window.searchsorted(key, 'left'), (count,))
+                    hi = start + numpy.broadcast_to(
+                        window.searchsorted(key, 'right'), (count,))
+                    uniform = numpy.ndim(key) == 0
+                else:
+                    key = numpy.broadcast_to(key, (count,))
+                    lo, hi = (_bisect(column, key, lo, hi),
+                              _bisect(column, key, lo, hi, True))
+            counts = hi - lo
+            starts = numpy.cumsum(counts) - counts
+            matched = numpy.repeat(numpy.arange(count), counts)
+            triples = (numpy.arange(int(counts.sum())) +
+                       numpy.repeat(lo - starts, counts))
+            values = {}
+            keep = numpy.ones(len(triples), dtype=bool)
+            for position, term in enumerate(pattern):
+                if position in keys:
+                    continue
+                column = table[positions.index(position)][triples]
+                if term[1] in values:
+                    keep &= values[term[1]] == column
+                else:
+                    values[term[1]] = column
+            rows.append(matched[keep])
+            for label, column in values.items():
+                found.setdefault(label, []).append(column[keep])
+        matched = numpy.concatenate(rows)
+        found = {label: numpy.concatenate(parts)
+                 for label, parts in found.items()}
+        if len(dataset) > 1:
+            labels = sorted(found)
+            merged = numpy.unique(numpy.vstack(
+                [matched] + [found[label].astype(numpy.int64)
+                             for label in labels]), axis=1)
+            matched = merged[0]
+            found = {label: merged[number + 1].astype(numpy.uint32)
+                     for number, label in enumerate(labels)}
+        joined = {label: column[matched] for label, column in columns.items()}
+        joined.update(found)
+        return index[matched], joined
+
+    def _extend(self, dataset, subjectlist, rows):
+        """Return every way in which a basic graph pattern extends results.
+        
+        Args:
+            dataset (list): Mapped arrays of the graphs that the query reads.
+            rows (list): Results that the patterns extend.
+            subjectlist (dict): Structured data that define the patterns.
+        
+        Returns:
+            list of (position, bindings) tuples, where the position is that of
+            the extended result and the bindings hold keys of new labels.
+        """
+        patterns = []
+        for pattern in _patterns(subjectlist):
+            encoded = []
+            for term in pattern:
+                if term['type'] == 'label':
+                    encoded.append(('label', term['value']))
+                else:
+                    encoded.append(self._encode(_key(term)))
+            patterns.append(tuple(encoded))
+        if not patterns:
+            return [(position, {}) for position in range(len(rows))]
+        if not dataset or any(MISSING in pattern for pattern in patterns):
+            return []
+        labels = {term[1] for pattern in patterns for term in pattern
+                  if isinstance(term, tuple)}
+        groups = {}
+        for position, row in enumerate(rows):
+            bound = tuple(sorted(label for label in labels
+                                 if row.get(label) is not None))
+            groups.setdefault(bound, []).append(position)
+        extended = []
+        for bound, positions in groups.items():
+            index = numpy.array(positions, dtype=numpy.int64)
+            columns = {label: numpy.array(
+                           [self._encode(rows[position][label])
+                            for position in positions], dtype=numpy.uint32)
+                       for label in bound}
+            remaining = list(patterns)
+            known = set(bound)
+            while remaining and len(index):
+                pattern = min(remaining, key=lambda pattern: sum(
+                    isinstance(term, tuple) and term[1] not in known
+                    for term in pattern))
+                remaining.remove(pattern)
+                index, columns = self._scan(dataset, pattern, index, columns)
+                known.update(term[1] for term in pattern
+                             if isinstance(term, tuple))
+            if not len(index):
+                continue
+            new = sorted(labels - set(bound))
+            decoded = {label: self._decode(columns[label]) for label in new}
+            for number, position in enumerate(index.tolist()):
+                extended.append((position, {label: decoded[label][number]
+                                            for label in new}))
+        return extended
+
+    def _join(self, dataset, subjectlist, rows):
+        """Return the results of a basic graph pattern, given earlier ones."""
+        return [dict(rows[position], **bindings) for position, bindings
+                in self._extend(dataset, subjectlist, rows)]
+
+    def _optional(self, dataset, optional, rows):
+        """Return each result extended by an 'OPTIONAL' body, if it can be.
+        
+        Every result is extended by one search, rather than one for each.
+        """
+        extensions = {}
+        for position, bindings in self._extend(dataset, optional, rows):
+            extensions.setdefault(position, []).append(bindings)
+        return [dict(row, **bindings) for position, row in enumerate(rows)
+                for bindings in extensions.get(position, [{}])]
+
+    def update(self, action, name, subjectlist = {}):
+        """Refuse to change the snapshot, which is read-only."""
+        print(__name__, 'snapshot is read-only', self.path)
+        return False
+
+    def load(self, name, triples, replace = False):
+        """Refuse to change the snapshot, which is read-only."""
+        print(__name__, 'snapshot is read-only', self.path)
+        return False
+
+    def drop(self, name):
+        """Refuse to change the snapshot, which is read-only."""
+        print(__name__, 'snapshot is read-only', self.path)
+        return False
+
+
+def write_snapshot(path, graphs):
+    """Save the triples of named graphs as a snapshot.
+    
+    Every term is encoded as JSON, the terms are sorted, and each is replaced
+    by its rank. The triples of each graph are then sorted in the three
+    orders that a SnapshotBackend searches. The manifest is written last, so
+    a snapshot should be written to a new directory, and SNAPSHOT_PATH moved
+    to it once it is complete.
+    
+    Args:
+        graphs (dict): Triples of each graph, keyed by graph name, each an
+            iterable of (subject, predicate, object) tuples of RDF terms in
+            the JSON format of SPARQL query results.
+        path (str): Directory in which to write the snapshot.
+    
+    Returns:
+        True if the snapshot was written, False otherwise.
+    """
+    if numpy is None:
+        print(__name__, 'snapshots need the numpy package')
+        return False
+    try:
+        encoded = {name: [tuple(_key(term) for term in triple)
+                          for triple in triples]
+                   for name, triples in graphs.items()}
+    except (_Unsupported, KeyError) as e:
+        print(__name__, 'unsupported triple', str(e))
+        return False
+    terms = sorted((_dump(key), key) for key in {
+        key for triples in encoded.values()
+        for triple in triples for key in triple})
+    if len(terms) >= MISSING:
+        print(__name__, 'too many terms for a snapshot', len(terms))
+        return False
+    ids = {key: number for number, (term, key) in enumerate(terms)}
+    os.makedirs(path, exist_ok=True)
+    offsets = numpy.zeros(len(terms) + 1, dtype=numpy.uint64)
+    numpy.cumsum([len(term) for term, key in terms], out=offsets[1:])
+    numpy.save(os.path.join(path, 'terms.npy'), offsets)
+    with open(os.path.join(path, 'terms.dat'), 'wb') as terms_file:
+        terms_file.write(b''.join(term for term, key in terms))
+    manifest = {'terms': len(terms), 'graphs': {}}
+    for number, name in enumerate(sorted(encoded)):
+        table = numpy.array([[ids[key] for key in triple]
+                             for triple in encoded[name]],
+                            dtype=numpy.uint32).reshape(-1, 3)
+        table = numpy.unique(table, axis=0)
+        filename = 'graph{:d}'.format(number)
+        for order, positions in ORDERS:
+            sorted_table = table[:, positions]
+            sorted_table = sorted_table[numpy.lexsort(sorted_table.T[::-1])]
+            numpy.save(os.path.join(path, '{}.{}.npy'.format(filename,
+                                                             order)),
+                       numpy.ascontiguousarray(sorted_table.T))
+        manifest['graphs'][name] = {'file': filename, 'triples': len(table)}
+    with open(os.path.join(path, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    return True
+
+
+def export_snapshot(sparql, path, graphlist):
+    """Save whole graphs of a SPARQLER as a snapshot.
+    
+    Args:
+        graphlist (set): Named graphs to save.
+        path (str): Directory in which to write the snapshot.
+        sparql (SPARQLER): Connection from which to export the graphs.
+    
+    Returns:
+        True if the snapshot was written, False otherwise.
+    """
+    graphs = {}
+    for name in graphlist:
+        lines = sparql.export_graph(name)
+        triples = None if lines is None else parse_ntriples(''.join(lines))
+        if triples is None:
+            print(__name__, 'could not export graph', name)
+            return False
+        graphs[name] = triples
+    return write_snapshot(path, graphs)
+
+
+def get_backend():
+    """Return the Backend shared by this process, creating it once.
+    
+    A snapshot that cannot be opened is reported once, and queries are then
+    sent to the SPARQL endpoint instead.
+    
+    Returns:
+        MemoryBackend if SPARQL_BACKEND is 'memory', SnapshotBackend if it is
+        'snapshot', or None if queries are sent to the SPARQL endpoint.
+    """
+    kind = app.config['SPARQL_BACKEND']
+    if kind not in ('memory', 'snapshot'):
+        return None
+    with _backend_lock:
+        if not _backend:
+            backend = None
+            if kind == 'memory':
+                backend = MemoryBackend()
+            elif numpy is None:
+                print(__name__, 'snapshots need the numpy package')
+            else:
+                try:
+                    backend = SnapshotBackend(app.config['SNAPSHOT_PATH'])
+                except (OSError, KeyError, ValueError) as e:
+                    print(__name__, 'could not open snapshot', str(e))
+            _backend.append(backend)
+        return _backend[0]
@@ -0,0 +1,210 @@
+"""skmf.changelog by Brendan Sweeney, CSS 593, 2015.
+
+Keep an append-only log of every triple that is inserted into or deleted from
+the triplestore through a SPARQLER. Each accepted UPDATE appends one entry for
+each of its triples, in each graph it touched, so any cached result can learn
+exactly what changed since it was computed instead of being computed again
+from scratch. The log is kept in a small SQLite database, which may be shared
+by every process that writes to the same endpoint. Entries older than
+CHANGELOG_RETENTION seconds are deleted once no reader needs them.
+
+Classes:
+    ChangeLog: Append-only record of the triples written to the triplestore.
+
+Functions:
+    get_changelog: Return the ChangeLog shared by this process.
+"""
+
+import json
+import sqlite3
+from threading import Condition, Lock
+from time import time
+
+from skmf import app
+
+_changelog = []
+_changelog_lock = Lock()
+
+
+class ChangeLog(object):
+    """Append-only record of the triples written to the triplestore.
+    
+    Entries are numbered in the order they are appended. A reader remembers
+    the number of the last entry it has seen and asks only for the entries
+    that follow it, or waits for new entries to be appended. A single SQLite
+    connection is shared by every thread, so every use of it holds a lock.
+    
+    Each append also deletes the entries that are older than the retention
+    and that no reader in this process still needs, though the last entry of
+    each graph is always kept, so that numbering never starts over and the
+    last change to a graph is never forgotten. A reader that falls behind the
+    deleted entries is told so by since().
+    
+    Attributes:
+        readers (list): Functions shared by every ChangeLog, each returning
+            the number of the last entry seen by the least current of some
+            readers, or None if none of them will ask for entries.
+        retention (float): Seconds to keep entries, or 0 to keep them all.
+    """
+
+    readers = []
+
+    def __init__(self, database, retention = 0):
+        """Open the log database and create its table if needed.
+        
+        Args:
+            database (str): Path of the SQLite database, or ':memory:'.
+            retention (float): Seconds to keep entries, or 0 to keep them.
+        """
+        self.retention = retention
+        self._db = sqlite3.connect(database, check_same_thread=False)
+        self._lock = Lock()
+        self._appended = Condition()
+        with self._lock, self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    stamp REAL NOT NULL,
+                    action TEXT NOT NULL,
+                    graph TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    predicate TEXT NOT NULL,
+                    object TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS changes_graph
+                    ON changes (graph, seq);
+                """)
+
+    def append(self, action, graph, triples):
+        """Record that some triples were written to one graph.
+        
+        Args:
+            action (str): The update action, either 'INSERT' or 'DELETE'.
+            graph (str): Name of the graph, as accepted by _set_graphs().
+            triples (list): (subject, predicate, object) tuples, where the
+                subject and predicate are full URIs and the object is an RDF
+                object in the JSON format of SPARQL query results.
+        """
+        stamp = time()
+        rows = [(stamp, action, graph, subject, predicate,
+                 json.dumps(rdfobject, sort_keys=True))
+                for subject, predicate, rdfobject in triples]
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT INTO changes (stamp, action, graph, subject, '
+                'predicate, object) VALUES (?, ?, ?, ?, ?, ?)', rows)
+        with self._appended:
+            self._appended.notify_all()
+        self.prune()
+
+    def prune(self):
+        """Delete the entries that are old and that no reader still needs.
+        
+        Returns:
+            int number of entries deleted.
+        """
+        if not self.retention:
+            return 0
+        # a reader that has seen an entry needs only the entries after it
+        bounds = [floor + 1 for floor in
+                  (reader() for reader in ChangeLog.readers)
+                  if floor is not None]
+        with self._lock, self._db:
+            bounds.append(self._db.execute(
+                'SELECT MAX(seq) FROM changes').fetchone()[0] or 0)
+            cursor = self._db.execute(
+                'DELETE FROM changes WHERE seq < ? AND stamp < ? AND seq '
+                'NOT IN (SELECT MAX(seq) FROM changes GROUP BY graph)',
+                (min(bounds), time() - self.retention))
+        return cursor.rowcount
+
+    def last(self):
+        """Return the number of the last entry in the log, or 0 if empty."""
+        with self._lock:
+            row = self._db.execute('SELECT MAX(seq) FROM changes').fetchone()
+        return row[0] or 0
+
+    def latest(self, graphlist = None):
+        """Return the number and time of the last entry in the log.
+        
+        Every process that shares the database sees the same answer, so it
+        may be used to revalidate anything that any process has cached.
+        
+        Args:
+            graphlist (set): Names of the graphs whose entries to consider,
+                or None for every graph.
+        
+        Returns:
+            Tuple of the number and the time of the last entry, or (0, 0) if
+            there is none.
+        """
+        query = 'SELECT MAX(seq), stamp FROM changes'
+        args = []
+        if graphlist is not None:
+            args = sorted(graphlist)
+            query += ' WHERE graph IN ({})'.format(
+                ', '.join('?' * len(args)))
+        with self._lock:
+            row = self._db.execute(query, args).fetchone()
+        return tuple(row) if row[0] is not None else (0, 0)
+
+    def wait(self, seq, timeout = None):
+        """Wait until the log holds an entry that follows one entry.
+        
+        Entries that are appended by this process end the wait at once.
+        Entries appended by another process that shares the database are only
+        seen once the timeout has passed.
+        
+        Args:
+            seq (int): Number of the last entry that was already seen.
+            timeout (float): Most seconds to wait, or None to wait forever.
+        
+        Returns:
+            int number of the last entry in the log.
+        """
+        with self._appended:
+            self._appended.wait_for(lambda: self.last() > seq, timeout)
+        return self.last()
+
+    def since(self, seq, until = None):
+        """Return the entries that follow one entry of the log, in order.
+        
+        Args:
+            seq (int): Number of the last entry that was already seen.
+            until (int): Number of the last entry to return, if provided.
+        
+        Returns:
+            list of dicts holding the 'seq', 'stamp', 'action', 'graph',
+            'subject', 'predicate', and 'object' of each entry, or None if
+            some of the entries that follow have been deleted.
+        """
+        query = 'SELECT * FROM changes WHERE seq > ?'
+        args = [seq]
+        if until is not None:
+            query += ' AND seq <= ?'
+            args.append(until)
+        with self._lock:
+            rows = self._db.execute(query + ' ORDER BY seq', args).fetchall()
+        # entries are numbered without gaps until some are deleted
+        if rows and rows[-1][0] - seq != len(rows):
+            return None
+        keys = ('seq', 'stamp', 'action', 'graph', 'subject', 'predicate',
+                'object')
+        changes = []
+        for row in rows:
+            change = dict(zip(keys, row))
+            change['object'] = json.loads(change['object'])
+            changes.append(change)
+        return changes
+
+
+def get_changelog():
+    """Return the ChangeLog shared by this process, creating it once.
+    
+    Returns:
+        ChangeLog kept in the database named by CHANGELOG_DATABASE.
+    """
+    with _changelog_lock:
+        if not _changelog:
+            _changelog.append(ChangeLog(app.config['CHANGELOG_DATABASE'],
+                                        app.config['CHANGELOG_RETENTION']))
+        return _changelog[0]
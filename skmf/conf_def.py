@@ -37,6 +37,147 @@ SPARQL_UPDATE = '/update/'
 SPARQL_ENDPOINT = 'http://{}:{}'.format(SPARQL_HOST, SPARQL_PORT)
 """str: Full URL of the SPARQL endpoint."""
 
+SPARQL_PLANNER = False
+"""bool: Reorder query patterns by estimated selectivity before sending."""
+
+SPARQL_ASYNC = True
+"""bool: Send concurrent queries at once when aiohttp is installed."""
+
+SPARQL_ASYNC_CONNECTIONS = 100
+"""int: Most connections kept open to the endpoint for concurrent queries."""
+
+SPARQL_REPLICAS = []
+"""list: Query endpoint URLs of replicas that share the read load, if any."""
+
+SPARQL_HEALTH_INTERVAL = 10
+"""int: Seconds between health checks of a replica that failed to answer."""
+
+SPARQL_STICKY = 10
+"""int: Seconds after a write during which reads go to the primary."""
+
+SPARQL_QUERY_TIMEOUT = 10
+"""int: Most seconds that any single read may take to answer."""
+
+SPARQL_REQUEST_BUDGET = 30
+"""int: Most seconds that all reads of one Flask request may take, or 0."""
+
+SPARQL_HEDGE = True
+"""bool: Send a slow read to a second replica, once replicas are configured."""
+
+SPARQL_HEDGE_WORKERS = 32
+"""int: Number of threads that send hedged reads."""
+
+SPARQL_BREAKER_THRESHOLD = 0.5
+"""float: Share of failed or slow requests at which the breaker opens."""
+
+SPARQL_BREAKER_MIN_CALLS = 10
+"""int: Fewest recent requests from which the breaker may open."""
+
+SPARQL_BREAKER_SLOW = 5
+"""int: Seconds after which a request counts against the endpoint."""
+
+SPARQL_BREAKER_COOLDOWN = 30
+"""int: Seconds that the breaker stays open before sending a probe."""
+
+SPARQL_STALE_CACHE_SIZE = 500
+"""int: Number of recent read results kept to serve if the endpoint fails."""
+
+SPARQL_GROUP_COMMIT = False
+"""bool: Send the updates of concurrent requests together as one request."""
+
+SPARQL_GROUP_WINDOW = 0.005
+"""float: Most seconds that an update waits for others to join it."""
+
+SPARQL_GROUP_SIZE = 50
+"""int: Number of waiting updates that are sent without waiting further."""
+
+SPARQL_BACKEND = 'sparql'
+"""str: 'sparql' for the endpoint, or 'memory' or 'snapshot' to answer here."""
+
+SNAPSHOT_PATH = 'skmf_snapshot'
+"""str: Directory of the snapshot served when SPARQL_BACKEND is 'snapshot'."""
+
+SPARQL_GRAPH_STORE = '/data/'
+"""string: URL extension for the Graph Store Protocol, or '' if not served."""
+
+SPARQL_GRAPH_TIMEOUT = 300
+"""int: Most seconds for one whole graph to be sent or received."""
+
+API_PAGE_SIZE = 100
+"""int: Number of results in one page of a JSON API response by default."""
+
+API_MAX_PAGE_SIZE = 1000
+"""int: Largest number of results a client may request in one page."""
+
+SUBJECT_CACHE_SIZE = 256
+"""int: Number of rendered subject pages to keep for repeated requests."""
+
+EXISTS_CACHE_SIZE = 1024
+"""int: Number of subject existence answers to remember between requests."""
+
+EXISTS_CACHE_TTL = 60
+"""int: Seconds for which a remembered existence answer may be trusted."""
+
+NEIGHBORHOOD_MAX_NODES = 200
+"""int: Largest number of subjects to visit when exploring a neighborhood."""
+
+SUBJECT_PAGE_SIZE = 50
+"""int: Number of links to one subject that are listed on one page."""
+
+STATS_DATABASE = 'skmf_stats.db'
+"""str: Path of the SQLite database that holds triplestore statistics."""
+
+STATS_GRAPHS = ['']
+"""list: Graphs whose predicates and classes are counted for statistics."""
+
+STATS_INTERVAL = 300
+"""int: Seconds between checks for changed graphs, or 0 to never check."""
+
+STATS_MAX_AGE = 3600
+"""int: Seconds after which statistics are counted again regardless."""
+
+CHANGELOG_DATABASE = 'skmf_changes.db'
+"""str: Path of the SQLite database that logs every triple written."""
+
+CHANGELOG_RETENTION = 86400
+"""float: Seconds to keep logged changes no reader needs, or 0 for ever."""
+
+STANDING_MAX_KEYS = 100
+"""int: Most changed partitions of a standing query to refresh one by one."""
+
+STANDING_MAX_AGE = 300
+"""int: Seconds after which a standing query is computed again regardless."""
+
+STANDING_MAX_QUERIES = 1000
+"""int: Most standing queries kept without subscribers before the oldest go."""
+
+EVENTS_INTERVAL = 5
+"""int: Most seconds between checks for changes made by other processes."""
+
+EVENTS_KEEPALIVE = 15
+"""int: Seconds between comments that keep an idle event stream open."""
+
+EVENTS_MAX_STREAMS = 50
+"""int: Most event streams served at once, each holding a server worker."""
+
+EVENTS_BACKLOG = 100
+"""int: Most events held for a slow stream before it is closed."""
+
+JOBS_DATABASE = 'skmf_jobs.db'
+"""str: Path of the SQLite database that holds background bulk edits."""
+
+JOBS_INTERVAL = 5
+"""int: Most seconds between checks for new jobs, or 0 to never run them."""
+
+JOBS_BATCH_SIZE = 100
+"""int: Most triples that a background job writes in one update."""
+
+JOBS_THROTTLE = 0.5
+"""float: Seconds that a background job pauses between two updates."""
+
+JOBS_LEASE = 60
+"""float: Seconds a running job is held by its process without progress."""
+
 NAMESPACE = 'http://localhost/skmf'
 """str: Local namespace for subjects added to the datastore."""
 
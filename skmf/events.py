@@ -0,0 +1,241 @@
+"""skmf.events by Brendan Sweeney, CSS 593, 2015.
+
+Publish changes in the results of saved queries to any number of subscribers.
+A query is saved once and kept as a StandingQuery, so its results follow the
+change log instead of being run again for every reader. A single EventHub
+thread waits for new entries in the log, brings the results of every saved
+query that has subscribers up to date, and hands the rows that were added and
+removed to each subscriber. Subscribers never query the endpoint themselves,
+so any number of them costs no more than one.
+
+Classes:
+    EventHub: Single thread that publishes changes of saved query results.
+
+Functions:
+    get_hub: Return the EventHub shared by this process.
+    save_query: Save a query assembled by a user and return its id.
+"""
+
+import hashlib
+import hmac
+import json
+from collections import OrderedDict
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from time import sleep
+
+import skmf
+from skmf import app
+from skmf.changelog import get_changelog
+from skmf.resource import Query, StandingQuery
+
+_hub = []
+_hub_lock = Lock()
+
+
+def _row_key(row):
+    """Return a string that identifies one row of query results."""
+    return json.dumps(row, sort_keys=True)
+
+
+class EventHub(Thread):
+    """Single thread that publishes changes of saved query results.
+    
+    For every saved query with at least one subscriber, the hub remembers the
+    rows it last published. A new subscriber receives those rows as its
+    snapshot, and every later event holds the rows that were added to or
+    removed from them, so every subscriber sees the same sequence.
+    
+    Attributes:
+        interval (int): Most seconds to wait for the change log, after which
+            changes made by other processes are looked for.
+        limit (int): Most subscribers at once, each of which holds a worker
+            of the web server for as long as its stream is open.
+        seq (int): Number of the last log entry that was published.
+    """
+
+    def __init__(self, interval, limit, backlog):
+        """Prepare the hub without starting its thread.
+        
+        Args:
+            backlog (int): Most events held for one subscriber.
+            interval (int): Most seconds to wait for the change log.
+            limit (int): Most subscribers at once.
+        """
+        super().__init__(name='skmf-events', daemon=True)
+        self.interval = interval
+        self.limit = limit
+        self.backlog = backlog
+        self.seq = get_changelog().last()
+        self._lock = Lock()
+        self._published = {}
+        self._subscribers = {}
+
+    def subscribe(self, name, sparql):
+        """Add a subscriber to the changes of one saved query.
+        
+        Args:
+            name (hashable): Name under which the query was saved.
+            sparql (SPARQLER): Connection used if the query has no
+                published rows yet.
+        
+        Returns:
+            Tuple of the Queue that receives events and the list of current
+            rows, None if no query is kept under the name, or False if the
+            hub already has as many subscribers as it allows. A queue that
+            receives None has fallen too far behind and was dropped.
+        """
+        with self._lock:
+            if sum(map(len, self._subscribers.values())) >= self.limit:
+                return False
+        standing = StandingQuery.lookup(name, 1)
+        if standing is None:
+            return None
+        rows = None
+        # the endpoint is never queried while the hub is locked
+        if name not in self._published:
+            rows = standing.results(sparql)
+        with self._lock:
+            if sum(map(len, self._subscribers.values())) >= self.limit:
+                StandingQuery.lookup(name, -1)
+                return False
+            if name not in self._published:
+                if rows is None:
+                    rows = standing.rows
+                self._published[name] = OrderedDict(
+                    (_row_key(row), row) for row in rows or [])
+            queue = Queue(self.backlog)
+            self._subscribers.setdefault(name, []).append(queue)
+            snapshot = list(self._published[name].values())
+            if self.ident is None:
+                self.start()
+        return queue, snapshot
+
+    def unsubscribe(self, name, queue):
+        """Remove a subscriber, forgetting the query once it has none.
+        
+        Args:
+            name (hashable): Name under which the query was saved.
+            queue (Queue): Queue returned when the subscriber was added.
+        """
+        with self._lock:
+            queues = self._subscribers.get(name, [])
+            if queue in queues:
+                queues.remove(queue)
+                StandingQuery.lookup(name, -1)
+            if not queues:
+                self._subscribers.pop(name, None)
+                self._published.pop(name, None)
+
+    def run(self):
+        """Publish changes whenever the change log advances.
+        
+        A failure to publish is reported and tried again after the interval,
+        so that the thread keeps serving every subscriber.
+        """
+        changelog = get_changelog()
+        while True:
+            try:
+                last = changelog.wait(self.seq, self.interval)
+                if last != self.seq:
+                    self.publish(last)
+            except Exception as e:
+                print(__name__, 'publishing failed:', e)
+                sleep(self.interval)
+
+    def publish(self, last):
+        """Send the changed rows of every subscribed query to its queues.
+        
+        Args:
+            last (int): Number of the last log entry to publish.
+        """
+        sparql = skmf.connect_sparql()
+        with self._lock:
+            names = list(self._subscribers)
+        for name in names:
+            standing = StandingQuery.lookup(name)
+            rows = None if standing is None else standing.results(sparql)
+            if rows is None:
+                continue
+            current = OrderedDict((_row_key(row), row) for row in rows)
+            with self._lock:
+                if name not in self._published:
+                    continue
+                previous = self._published[name]
+                self._published[name] = current
+                event = {'seq': last,
+                         'added': [row for key, row in current.items()
+                                   if key not in previous],
+                         'removed': [row for key, row in previous.items()
+                                     if key not in current]}
+                if event['added'] or event['removed']:
+                    for queue in list(self._subscribers.get(name, [])):
+                        try:
+                            queue.put_nowait(event)
+                        except Full:
+                            self._drop(name, queue)
+        self.seq = last
+
+    def _drop(self, name, queue):
+        """Remove a subscriber that has fallen too far behind.
+        
+        Its waiting events are discarded and it receives None in their place.
+        The caller must hold the lock of the hub.
+        
+        Args:
+            name (hashable): Name under which the query was saved.
+            queue (Queue): Queue returned when the subscriber was added.
+        """
+        print(__name__, 'dropped a stalled subscriber of', name)
+        self._subscribers[name].remove(queue)
+        StandingQuery.lookup(name, -1)
+        if not self._subscribers[name]:
+            self._subscribers.pop(name)
+            self._published.pop(name, None)
+        try:
+            while True:
+                queue.get_nowait()
+        except Empty:
+            pass
+        queue.put_nowait(None)
+
+
+def get_hub():
+    """Return the EventHub shared by this process, creating it once.
+    
+    Returns:
+        EventHub that publishes the changes of every saved query.
+    """
+    with _hub_lock:
+        if not _hub:
+            _hub.append(EventHub(app.config['EVENTS_INTERVAL'],
+                                 app.config['EVENTS_MAX_STREAMS'],
+                                 app.config['EVENTS_BACKLOG']))
+        return _hub[0]
+
+
+def save_query(entrylist, graphlist = {''}, owner = ''):
+    """Save a query assembled by a user so that it can be subscribed to.
+    
+    The id is derived from the query and the user who saved it, keyed by the
+    SECRET_KEY of the application, so a user who saves the same query twice
+    receives the same id, but nobody can work out the id of a query that
+    another user saved.
+    
+    Args:
+        entrylist (list): RDF triples that combine to form a SPARQL query.
+        graphlist (set): Named graphs in which to scope the query.
+        owner (str): Id of the user who saved the query.
+    
+    Returns:
+        str id of the saved query.
+    """
+    message = json.dumps([owner, sorted(graphlist), entrylist],
+                         sort_keys=True)
+    query_id = hmac.new(app.config['SECRET_KEY'].encode('utf-8'),
+                        message.encode('utf-8'), hashlib.sha1).hexdigest()
+    # Failure to set explicit parameters leads to broken garbage collection
+    query = Query(graphlist = set(graphlist), labellist = set(),
+                  subjectlist = {}, optlist = [])
+    query.save_entries(('saved', query_id), entrylist)
+    return query_id
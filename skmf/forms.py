@@ -83,6 +83,7 @@ class FindEntryForm(Form):
         free_target_2: A text field to enter an optional label or value.
         resource: A dropdown list to select a resource.
         resource_2: A dropdown list to select an optional resource.
+        save: A button to save the query and stream its changing results.
         submit: A button to submit the rendered form.
         target: A dropdown list to select a value.
         target_2: A dropdown list to select an optional value.
@@ -138,6 +139,8 @@ class FindEntryForm(Form):
 
     submit = SubmitField(label=uiLabel.formEntrySubFindTitle)
 
+    save = SubmitField(label=uiLabel.formEntrySubSaveTitle)
+
 
 class AddEntryForm(Form):
     """Collect information to be stored through the SPARQL endpoint.
@@ -27,6 +27,7 @@ formEntrySelectResError   = 'Please select a valid Resource'
 formEntrySelectTgtError   = 'Please select a valid Target'
 formEntrySubAddTitle      = 'Insert'
 formEntrySubFindTitle     = 'Retrieve'
+formEntrySubSaveTitle     = 'Save'
 formEntrySubTitle         = 'Create'
 formEntryTgtFreeTitle     = 'Free-form target'
 formEntryTargetTitle      = 'Target'
@@ -39,6 +40,11 @@ viewLoginInvalid          = 'Invalid username or password'
 viewLoginTitle            = 'Login'
 viewLoginWelcome          = 'Welcome,'
 viewLogoutLoggedout       = 'You were logged out'
+viewNeighborhoodTitle     = 'Neighborhood of'
+viewQueryFailed           = 'The query could not be answered, try again'
+viewQueryInvalid          = 'Typed text must be a name or a property path'
+viewQuerySaved            = 'Changes to this query are streamed from'
+viewStatsTitle            = 'Statistics'
 viewTagTitle              = 'Manage Resources'
 viewUserTitle             = 'Manage Users'
 viewWelcomeTitle          = 'Welcome'
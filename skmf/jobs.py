@@ -0,0 +1,361 @@
+"""skmf.jobs by Brendan Sweeney, CSS 593, 2015.
+
+Run large edits of the triplestore in the background instead of within the
+Flask request that asked for them. A job is a list of triples to insert or to
+delete, which is kept in a small SQLite database along with its progress, so a
+job that was interrupted by a restart continues where it stopped. A background
+thread in each process writes the triples of each job in batches of
+JOBS_BATCH_SIZE and pauses JOBS_THROTTLE seconds between batches, so a bulk
+edit never holds the endpoint for long. Jobs run one at a time, oldest first,
+across every process that shares the database. 'INSERT DATA' and
+'DELETE DATA' may be repeated without changing the result, so a batch that was
+sent again after a restart is safe.
+
+Classes:
+    JobQueue: Background thread that runs bulk edits in throttled batches.
+
+Functions:
+    get_queue: Return the JobQueue shared by this process.
+    start_queue: Start running queued jobs in the background.
+"""
+
+import json
+import sqlite3
+from threading import Event, Lock, Thread
+from time import time
+from uuid import uuid4
+
+import skmf
+from skmf import app
+
+_queue = []
+_queue_lock = Lock()
+
+
+class JobQueue(Thread):
+    """Background thread that runs bulk edits of the triplestore in batches.
+    
+    A single SQLite connection is shared by the thread and by any request
+    that submits a job or reads its status, so every use of it holds a lock.
+    Jobs run one at a time, in the order they were submitted, even when the
+    queues of several processes share the database. A queue claims the oldest
+    unfinished job with a single conditional UPDATE, so only one queue can
+    claim it, and holds it by a lease of JOBS_LEASE seconds that it renews
+    after every batch. A job whose lease has expired, because its process
+    stopped, is claimed again by the next queue that looks for work. The
+    number of triples that were written is saved after every batch, which is
+    how a job reports its progress and how it is resumed.
+    
+    Attributes:
+        batch_size (int): Most triples written by one update.
+        interval (int): Most seconds to wait between checks for new jobs.
+        lease (float): Seconds for which a claimed job is held without being
+            renewed.
+        owner (str): Random token that identifies this queue in the leases.
+        throttle (float): Seconds to pause between two batches of a job.
+    """
+
+    def __init__(self, database, interval, batch_size, throttle,
+                 lease = 60):
+        """Open the job database and create its tables if needed.
+        
+        Args:
+            batch_size (int): Most triples written by one update.
+            database (str): Path of the SQLite database, or ':memory:'.
+            interval (int): Most seconds to wait between checks for new jobs.
+            lease (float): Seconds for which a claimed job is held without
+                being renewed.
+            throttle (float): Seconds to pause between two batches of a job.
+        """
+        super().__init__(name='skmf-jobs', daemon=True)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.throttle = throttle
+        self.lease = lease
+        self.owner = uuid4().hex
+        self._db = sqlite3.connect(database, check_same_thread=False)
+        self._db_lock = Lock()
+        self._work_lock = Lock()
+        self._submitted = Event()
+        self._halt = Event()
+        with self._db_lock, self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    action TEXT NOT NULL,
+                    graphs TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    done INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    message TEXT NOT NULL,
+                    owner TEXT NOT NULL DEFAULT '',
+                    lease REAL NOT NULL DEFAULT 0);
+                CREATE TABLE IF NOT EXISTS entries (
+                    job INTEGER NOT NULL,
+                    seq INTEGER NOT NULL,
+                    entry TEXT NOT NULL,
+                    PRIMARY KEY (job, seq));
+                """)
+            columns = {row[1] for row in
+                       self._db.execute('PRAGMA table_info(jobs)')}
+            # databases written before leases were kept lack their columns
+            if 'lease' not in columns:
+                self._db.executescript("""
+                    ALTER TABLE jobs ADD COLUMN owner TEXT NOT NULL
+                        DEFAULT '';
+                    ALTER TABLE jobs ADD COLUMN lease REAL NOT NULL
+                        DEFAULT 0;
+                    """)
+
+    def run(self):
+        """Run queued jobs until stopped, waking when one is submitted.
+        
+        A failure to run a job is reported and left for the next pass, once
+        the interval has passed, so that the thread keeps serving the queue.
+        A job that failed in the middle is claimed again when its lease ends.
+        """
+        while not self._halt.is_set():
+            try:
+                self.work()
+            except Exception as e:
+                print(__name__, 'work failed:', e)
+                if self._halt.wait(self.interval):
+                    break
+            self._submitted.wait(self.interval)
+            self._submitted.clear()
+
+    def stop(self):
+        """Ask the thread to stop after its current batch."""
+        self._halt.set()
+        self._submitted.set()
+
+    def submit(self, action, graphlist, entrylist):
+        """Queue a bulk edit to be written in the background.
+        
+        Args:
+            action (str): The update action, either 'INSERT' or 'DELETE'.
+            entrylist (list): Triples to write, each a dict of 'subject',
+                'predicate', and 'object' terms with a 'type' and 'value'.
+            graphlist (set): Named graphs in which to perform the update.
+        
+        Returns:
+            int id of the new job.
+        """
+        stamp = time()
+        with self._db_lock, self._db:
+            cursor = self._db.execute(
+                'INSERT INTO jobs (action, graphs, status, total, done, '
+                'created, updated, message) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (action, json.dumps(sorted(graphlist)), 'queued',
+                 len(entrylist), 0, stamp, stamp, ''))
+            job_id = cursor.lastrowid
+            self._db.executemany(
+                'INSERT INTO entries VALUES (?, ?, ?)',
+                [(job_id, seq, json.dumps(entry, sort_keys=True))
+                 for seq, entry in enumerate(entrylist)])
+        self._submitted.set()
+        return job_id
+
+    def status(self, job_id):
+        """Return the status and progress of one job.
+        
+        Args:
+            job_id (int): Id returned when the job was submitted.
+        
+        Returns:
+            dict holding the 'id', 'action', 'graphs', 'status', 'total',
+            'done', 'progress', 'created', 'updated', and 'message' of the
+            job, or None if no such job was submitted.
+        """
+        keys = ('id', 'action', 'graphs', 'status', 'total', 'done',
+                'created', 'updated', 'message')
+        with self._db_lock:
+            row = self._db.execute(
+                'SELECT {} FROM jobs WHERE id = ?'.format(', '.join(keys)),
+                (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(keys, row))
+        job['graphs'] = json.loads(job['graphs'])
+        job['progress'] = job['done'] / job['total'] if job['total'] else 1.0
+        return job
+
+    def _set(self, job_id, **values):
+        """Save new values for some columns of one job.
+        
+        Args:
+            job_id (int): Id of the job to change.
+            values (dict): New values, keyed by column name.
+        """
+        columns = sorted(values)
+        assignments = ', '.join('{} = ?'.format(key) for key in columns)
+        with self._db_lock, self._db:
+            self._db.execute(
+                'UPDATE jobs SET {}, updated = ? WHERE id = ?'.format(
+                    assignments),
+                [values[key] for key in columns] + [time(), job_id])
+
+    def _claim(self):
+        """Claim the oldest unfinished job, unless another queue holds it.
+        
+        Returns:
+            int id of the claimed job, or None if there is none to run.
+        """
+        now = time()
+        with self._db_lock, self._db:
+            row = self._db.execute(
+                "SELECT id, status, lease FROM jobs WHERE status IN "
+                "('queued', 'running') ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            job_id, status, lease = row
+            if status == 'running' and lease >= now:
+                return None
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'running', message = '', "
+                'owner = ?, lease = ?, updated = ? WHERE id = ? AND '
+                'status = ? AND lease = ?',
+                (self.owner, now + self.lease, now, job_id, status, lease))
+        return job_id if cursor.rowcount == 1 else None
+
+    def _renew(self, job_id, done):
+        """Save the progress of a claimed job and extend its lease.
+        
+        Args:
+            done (int): Number of triples of the job already written.
+            job_id (int): Id of the job.
+        
+        Returns:
+            True if this queue still holds the job, False otherwise.
+        """
+        now = time()
+        with self._db_lock, self._db:
+            cursor = self._db.execute(
+                "UPDATE jobs SET done = ?, lease = ?, updated = ? WHERE "
+                "id = ? AND owner = ? AND status = 'running'",
+                (done, now + self.lease, now, job_id, self.owner))
+        return cursor.rowcount == 1
+
+    def _batch(self, job_id, done):
+        """Return the next batch of triples of a job.
+        
+        Args:
+            done (int): Number of triples of the job already written.
+            job_id (int): Id of the job.
+        
+        Returns:
+            list of triples, in the format given to submit().
+        """
+        with self._db_lock:
+            rows = self._db.execute(
+                'SELECT entry FROM entries WHERE job = ? AND seq >= ? '
+                'ORDER BY seq LIMIT ?',
+                (job_id, done, self.batch_size)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _subjects(self, entrylist):
+        """Combine a batch of triples into the structure of a SPARQL update.
+        
+        Args:
+            entrylist (list): Triples, in the format given to submit().
+        
+        Returns:
+            dict of subjects, in the format accepted by SPARQLER.insert().
+        """
+        subjectlist = {}
+        for entry in entrylist:
+            subject = entry['subject']
+            predicate = entry['predicate']
+            preds = subjectlist.setdefault(
+                subject['value'],
+                {'type': subject['type'], 'value': {}})['value']
+            objects = preds.setdefault(
+                predicate['value'],
+                {'type': predicate['type'], 'value': []})['value']
+            if entry['object'] not in objects:
+                objects.append(entry['object'])
+        return subjectlist
+
+    def work(self):
+        """Run every queued job, oldest first, until none is left.
+        
+        Work stops early if the oldest unfinished job is held by another
+        queue, which keeps the jobs in order.
+        
+        Returns:
+            list of the ids of the jobs that were run.
+        """
+        ran = []
+        with self._work_lock:
+            while not self._halt.is_set():
+                job_id = self._claim()
+                if job_id is None:
+                    break
+                self._run(job_id)
+                ran.append(job_id)
+        return ran
+
+    def _run(self, job_id):
+        """Write the remaining triples of one claimed job, a batch at a time.
+        
+        A job that the endpoint refuses is marked as failed and keeps the
+        number of triples that were written before the refusal. A job whose
+        lease was lost to another queue is left to that queue.
+        
+        Args:
+            job_id (int): Id of the job to run.
+        """
+        job = self.status(job_id)
+        sparql = skmf.connect_sparql()
+        graphlist = set(job['graphs'])
+        if job['action'] == 'DELETE':
+            write = sparql.delete
+        else:
+            write = sparql.insert
+        done = job['done']
+        while True:
+            entrylist = self._batch(job_id, done)
+            if not entrylist:
+                break
+            if not write(graphlist, self._subjects(entrylist)):
+                print(__name__, 'job', job_id, 'refused at', done)
+                self._set(job_id, status='failed',
+                          message='update refused after {:d} triples'.format(
+                              done))
+                return
+            done += len(entrylist)
+            if not self._renew(job_id, done):
+                print(__name__, 'job', job_id, 'lost its lease at', done)
+                return
+            if self._halt.wait(self.throttle):
+                self._set(job_id, status='queued', lease=0)
+                return
+        self._set(job_id, status='done')
+        with self._db_lock, self._db:
+            self._db.execute('DELETE FROM entries WHERE job = ?', (job_id,))
+
+
+def get_queue():
+    """Return the JobQueue shared by this process, creating it once.
+    
+    Returns:
+        JobQueue that keeps its jobs in the configured database.
+    """
+    with _queue_lock:
+        if not _queue:
+            _queue.append(JobQueue(app.config['JOBS_DATABASE'],
+                                   app.config['JOBS_INTERVAL'],
+                                   app.config['JOBS_BATCH_SIZE'],
+                                   app.config['JOBS_THROTTLE'],
+                                   app.config['JOBS_LEASE']))
+        return _queue[0]
+
+
+@app.before_first_request
+def start_queue():
+    """Start running queued jobs if JOBS_INTERVAL is not zero."""
+    queue = get_queue()
+    if queue.interval and not queue.is_alive():
+        queue.start()
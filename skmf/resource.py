@@ -10,11 +10,24 @@ CONTROLS will be implemented using graphs as ACLs, but this is proving tricky.
 
 Classes:
     Query: Representation of a free-form SPARQL query or update request.
+    StandingQuery: Query results that are kept current from the change log.
     Subject: Representation of all triples that describe a single RDF subject.
+    SubjectLoader: Request-scoped identity map and batch loader for Subjects.
     User: Representation of SKMF user, made persistent in a SPARQL endpoint.
+
+Functions:
+    get_loader: Return the SubjectLoader of the current Flask request.
 """
 
+from collections import OrderedDict
+from copy import deepcopy
+from threading import Lock
+from time import time
+
 from skmf import app, g
+from skmf.changelog import ChangeLog, get_changelog
+from skmf.sparqler import expand, then
+from skmf.stats import get_collector
 
 
 class Query(object):
@@ -40,9 +53,11 @@ class Query(object):
     and 'value' keys are required at all three levels.
     
     Attributes:
+        filters (list): Expressions that restrict the results of a query.
         graphs (optional[list]): Graphs in which to scope queries SPARQL.
         labels (list): Header labels expected to be returned from a query.
         optionals (list): Triples that are optional to a SPARQL query.
+        order (list): Expressions by which the endpoint sorts the results.
         subjects (dict): Triples, with placeholders, to describe the query. The
             format should be:
             {<subject_uri>|<subject_label>:
@@ -68,7 +83,8 @@ class Query(object):
     # invocation. For instance, (graphlist = None)
     # if not graphlist: graphlist = {''}
     def __init__(self, graphlist = {''}, labellist = set(),
-                 subjectlist = {}, optlist = []):
+                 subjectlist = {}, optlist = [], filterlist = None,
+                 orderlist = None):
         """Setup the local lists and dictionary to hold the query elements.
         
         A Query may be set with empty values and still be valid. If no graphs
@@ -80,15 +96,23 @@ class Query(object):
         empty result set.
         
         Args:
+            filterlist (list): Expressions that restrict the query results.
             graphlist (set): Additional graphs to which to scope a query.
             labellist (set): Labels for the header of query results.
             optlist (list): dicts representing optional sub-statements.
+            orderlist (list): Expressions by which to sort query results.
             subjectlist (dict): Description of query element relationships.
         """
+        if filterlist is None:
+            filterlist = []
+        if orderlist is None:
+            orderlist = []
         self.graphs = graphlist
         self.labels = labellist
         self.subjects = subjectlist
         self.optionals = optlist
+        self.filters = filterlist
+        self.order = orderlist
 
     def _add_preds(self, subject, predlist):
         """Add some predicates to the specified subject of this Query.
@@ -265,6 +289,29 @@ class Query(object):
         """
         self.graphs.difference_update(graphlist)
 
+    def add_filters(self, filterlist):
+        """Append one or more expressions that results of a query must meet.
+        
+        Each expression is a dict in the format accepted by the 'sparqler'
+        module, and it is evaluated by the endpoint rather than locally. An
+        expression that is already present is ignored.
+        
+        Args:
+            filterlist (list): Expressions that restrict query results.
+        """
+        for expression in filterlist:
+            if expression not in self.filters:
+                self.filters.append(expression)
+
+    def set_order(self, orderlist):
+        """Replace the expressions by which the endpoint sorts query results.
+        
+        Args:
+            orderlist (list): Expressions, each with an optional 'order' key
+                of 'ASC' or 'DESC'.
+        """
+        self.order = orderlist
+
     def add_constraints(self, subject = None, type = None,
                        labellist = set(), subjectlist = {}):
         """Add placeholders and relationship constraints to refine a query.
@@ -369,22 +416,33 @@ class Query(object):
                             del self.subjects[subj]
         return old_labels, old_subjects
 
-    def submit_query(self):
+    def submit_query(self, limit = None, offset = None, sparql = None):
         """Query a SPARQL endpoint based on stored parameters.
         
         A general query is performed to request data from the SPARQL endpoint
         as described by the the 'labels' and 'subjects' attributes. Every named
         graph in the 'graphs' attribute is included in the query. If no
         exception is raised, then a JSON object containing the query results is
-        returned.
+        returned. A limit and offset may be provided to retrieve one page of
+        results at a time.
+        
+        Args:
+            limit (int): Maximum number of results to return, if provided.
+            offset (int): Number of results to skip, if provided.
+            sparql (SPARQLER): Connection to use in place of g.sparql. An
+                AsyncSPARQLER makes this return a coroutine.
         
         Returns:
             Unpacked JSON object containing the SPARQL query results, or None.
         """
-        return g.sparql.query_general(graphlist=self.graphs,
-                                      labellist=self.labels,
-                                      subjectlist=self.subjects,
-                                      optlist=self.optionals)
+        sparql = sparql or g.sparql
+        return sparql.query_general(graphlist=self.graphs,
+                                    labellist=self.labels,
+                                    subjectlist=self.subjects,
+                                    optlist=self.optionals,
+                                    limit=limit, offset=offset,
+                                    filterlist=self.filters,
+                                    orderlist=self.order)
 
     def submit_insert(self):
         """Insert stored parameters in a SPARQL endpoint.
@@ -464,7 +522,138 @@ class Query(object):
             return result['results']['bindings']
         return None
 
-    def get_entries(self, entrylist = []):
+    def get_choices(self, categorylist):
+        """Retrieve display choices for every instance of some categories.
+        
+        Each choice pairs the URI of a resource with its rdfs:label or, if it
+        has none, the fragment of its URI. Blank nodes are filtered out and the
+        choices are deduplicated and sorted by name, all by the endpoint, so
+        the result is ready for use in a dropdown list. The choices are kept
+        as a StandingQuery, so they are only retrieved again for resources
+        that have changed since they were last read.
+        
+        Args:
+            categorylist (list): Prefix forms of the categories to include.
+        
+        Returns:
+            List of (URI, name) tuples, sorted by name.
+        """
+        resource = {'type': 'label', 'value': 'resource'}
+        label = {'type': 'label', 'value': 'label'}
+        fragment = {'type': 'function', 'value': 'STRAFTER',
+                    'args': [{'type': 'function', 'value': 'STR',
+                              'args': [resource]},
+                             {'type': 'literal', 'value': '#'}]}
+        name = {'type': 'function', 'value': 'COALESCE',
+                'args': [label, fragment]}
+        name_order = {'type': 'function', 'value': 'STR',
+                      'args': [{'type': 'label', 'value': 'name'}]}
+        category = {'type': 'label', 'value': 'category'}
+        predicates = {'a': {'type': 'pfx', 'value': [category]}}
+        subject = {'resource': {'type': 'label', 'value': predicates}}
+        opt_preds = {'rdfs:label': {'type': 'pfx', 'value': [label]}}
+        opt_subject = {'resource': {'type': 'label', 'value': opt_preds}}
+        is_iri = {'type': 'function', 'value': 'isIRI', 'args': [resource]}
+        values = {'category': [{'type': 'pfx', 'value': category}
+                               for category in categorylist]}
+        standing = StandingQuery(graphlist=self.graphs,
+                                 labellist={'resource'},
+                                 subjectlist=subject, optlist=[opt_subject],
+                                 valuelist=values, filterlist=[is_iri],
+                                 orderlist=[name_order],
+                                 exprlist={'name': name},
+                                 sortkey=lambda row: row['name']['value'])
+        key = ('choices', frozenset(self.graphs), tuple(categorylist))
+        rows = StandingQuery.register(key, standing).results(g.sparql)
+        if not rows:
+            return []
+        return [(row['resource']['value'], row['name']['value'])
+                for row in rows]
+
+    def count(self, sparql = None):
+        """Return the number of results that submit_query() would return.
+        
+        Only the count is transferred from the endpoint, which makes this much
+        cheaper than retrieving every result to measure its size.
+        
+        Args:
+            sparql (SPARQLER): Connection to use in place of g.sparql. An
+                AsyncSPARQLER makes this return a coroutine.
+        
+        Returns:
+            int count of query results, or None if the query failed.
+        """
+        sparql = sparql or g.sparql
+        return sparql.query_count(graphlist=self.graphs,
+                                  labellist=self.labels,
+                                  subjectlist=self.subjects,
+                                  optlist=self.optionals,
+                                  filterlist=self.filters)
+
+    def count_categories(self, categorylist, sparql = None):
+        """Return the number of resources in each of some categories.
+        
+        Every category is counted by the same aggregate query, grouped by
+        category, so no resources are transferred from the endpoint. As with
+        get_choices(), blank nodes are not counted.
+        
+        Args:
+            categorylist (list): Prefix forms of the categories to count.
+            sparql (SPARQLER): Connection to use in place of g.sparql. An
+                AsyncSPARQLER makes this return a coroutine.
+        
+        Returns:
+            dict of resource counts, keyed by category in the given order.
+        """
+        resource = {'type': 'label', 'value': 'resource'}
+        category = {'type': 'label', 'value': 'category'}
+        predicates = {'a': {'type': 'pfx', 'value': [category]}}
+        subject = {'resource': {'type': 'label', 'value': predicates}}
+        count = {'type': 'function', 'value': 'COUNT', 'distinct': True,
+                 'args': [resource]}
+        is_iri = {'type': 'function', 'value': 'isIRI', 'args': [resource]}
+        values = {'category': [{'type': 'pfx', 'value': category}
+                               for category in categorylist]}
+        sparql = sparql or g.sparql
+        result = sparql.query_general(graphlist=self.graphs,
+                                      labellist={'category'},
+                                      subjectlist=subject,
+                                      valuelist=values,
+                                      filterlist=[is_iri],
+                                      exprlist={'count': count},
+                                      grouplist=['category'])
+
+        def read(result):
+            counts = {category: 0 for category in categorylist}
+            if result:
+                names = {expand(category): category
+                         for category in categorylist}
+                for row in result['results']['bindings']:
+                    name = names.get(row['category']['value'])
+                    if name:
+                        counts[name] = int(row['count']['value'])
+            return counts
+
+        return then(result, read)
+
+    def get_statistics(self):
+        """Return the counts of predicates and classes in the query graphs.
+        
+        The counts are read from the local statistics store rather than from
+        the endpoint, so they may lag behind recent changes until the store is
+        next refreshed. Graphs that are not in STATS_GRAPHS are not counted.
+        
+        Returns:
+            dict holding 'predicates', a dict of triple counts keyed by
+            predicate URI, and 'classes', a dict of instance counts keyed by
+            class URI.
+        """
+        collector = get_collector()
+        return {'predicates': collector.predicate_counts(set(self.graphs)),
+                'classes': collector.class_counts(set(self.graphs))}
+
+    def get_entries(self, entrylist = [], limit = None, offset = None,
+                    sparql = None):
         """Retrieve the results of a query that was assembled by a user.
         
         The UI is expected to present the query body to the user as the
@@ -473,13 +662,57 @@ class Query(object):
         store. Each entry must be checked for type so that the list of labels
         can be maintained. Before running the query, _set_label_constraints()
         is called to ensure that rdfs:label tags will be returned whenever they
-        are available.
+        are available. When only one page of results is requested and no sort
+        order was set, results are sorted by label so that pages are stable.
+        
+        Args:
+            entrylist (list): RDF triples that combine to form a SPARQL query.
+            limit (int): Maximum number of results to return, if provided.
+            offset (int): Number of results to skip, if provided.
+            sparql (SPARQLER): Connection to use in place of g.sparql. An
+                AsyncSPARQLER makes this return a coroutine.
+        
+        Returns:
+            List of results of a general query requested by the user, or None
+            if the query failed.
+        """
+        self._add_entries(entrylist)
+        if limit is not None and not self.order:
+            self.set_order([{'type': 'label', 'value': label}
+                            for label in sorted(self.labels)])
+        return then(self.submit_query(limit, offset, sparql),
+                    lambda result: None if result is None
+                    else result['results']['bindings'])
+
+    def save_entries(self, name, entrylist = []):
+        """Keep the results of a query assembled by a user as it changes.
+        
+        The query is formed as it is by get_entries(), but its results are
+        kept by a StandingQuery that is shared under the given name, so that
+        later readers receive current results without the whole query being
+        run again after every change.
         
         Args:
             entrylist (list): RDF triples that combine to form a SPARQL query.
+            name (hashable): Name by which the standing query is shared.
         
         Returns:
-            List of results of a general query requested by the user.
+            The StandingQuery that is shared under the name.
+        """
+        self._add_entries(entrylist)
+        standing = StandingQuery(graphlist=self.graphs,
+                                 labellist=self.labels,
+                                 subjectlist=self.subjects,
+                                 optlist=self.optionals,
+                                 filterlist=self.filters,
+                                 orderlist=self.order)
+        return StandingQuery.register(name, standing)
+
+    def _add_entries(self, entrylist):
+        """Add the triples of a query assembled by a user to this Query.
+        
+        Args:
+            entrylist (list): RDF triples that combine to form a SPARQL query.
         """
         label_list = set()
         for entry in entrylist:
@@ -515,7 +748,6 @@ class Query(object):
             self.add_constraints(subjectlist=subject)
         self.add_constraints(labellist=label_list)
         self._set_label_constraints()
-        return self.submit_query()['results']['bindings']
 
     def add_resource(self, category, label, desc, lang = ''):
         """INSERT entries with one skmf:Resource as the subject.
@@ -536,8 +768,8 @@ class Query(object):
         """
         new_id = ''.join(c for c in label if c.isalnum()).rstrip().lower()
         id_uri = '{}#{}'.format(app.config['NAMESPACE'], new_id)
-        subject = Subject(id_uri, type='uri')
-        if not subject.preds:
+        if not Subject.exists(id_uri):
+            subject = Subject(id_uri, type='uri')
             cat_objects = []
             cat_object = {}
             cat_object['type'] = 'pfx'
@@ -572,6 +804,503 @@ class Query(object):
             return subject.add_data(graphlist={''}, predlist=new_preds)
 
 
+class StandingQuery(object):
+    """Materialized results of a query that are kept current from the log.
+    
+    The results are computed by the endpoint once, along with the number of
+    the last entry in the change log. Each time the results are read, only
+    the entries that follow are examined. An entry is ignored if its graph is
+    outside the query or its triple cannot match any pattern of the query,
+    including the optional patterns. If the query is star-shaped around a
+    key label, such as '?resource a ?category' with an optional rdfs:label of
+    '?resource', then a matching triple can only change the results for the
+    subject that it binds to the key, so only those results are computed
+    again, with the key bound through 'VALUES'. Any other change leads to
+    the whole query being computed again, as do more than STANDING_MAX_KEYS
+    changed keys or results older than STANDING_MAX_AGE seconds.
+    
+    Attributes:
+        key (str): Label that partitions the results, or None if there is no
+            such label.
+        registry (OrderedDict): StandingQuery instances shared by every
+            request, keyed by a name chosen by the caller, from the least to
+            the most recently used. Beyond STANDING_MAX_QUERIES, the least
+            recently used queries without subscribers are forgotten.
+        rows (list): Current results, in the JSON format of SPARQL results,
+            or None before they are first computed.
+        seq (int): Number of the last log entry reflected in the results.
+        subscribers (int): Number of event streams that follow the results,
+            which keep the query from being forgotten.
+    """
+
+    registry = OrderedDict()
+    _registry_lock = Lock()
+
+    def __init__(self, graphlist = {''}, labellist = set(), subjectlist = {},
+                 optlist = [], valuelist = {}, filterlist = [],
+                 orderlist = [], exprlist = {}, key = None, sortkey = None):
+        """Store the parts of the query, as accepted by query_general().
+        
+        Args:
+            exprlist (dict): Expressions to compute, keyed by result label.
+            filterlist (list): Expressions that restrict the query results.
+            graphlist (set): Named graphs in which to scope the query.
+            key (str): Label that partitions the results, or None to use the
+                label of the only subject of the body, if there is one.
+            labellist (set): Header labels for the query results.
+            optlist (list): dicts forming full query bodies.
+            orderlist (list): Expressions by which to sort the results.
+            sortkey (function): Sorts the results after a partial refresh,
+                in place of the order that the endpoint would give them.
+            subjectlist (dict): Structured data that define the query.
+            valuelist (dict): RDF objects to bind to placeholder labels.
+        """
+        self.graphs = set(graphlist)
+        self.labels = set(labellist)
+        self.subjects = deepcopy(subjectlist)
+        self.optionals = deepcopy(optlist)
+        self.values = deepcopy(valuelist)
+        self.filters = filterlist
+        self.order = orderlist
+        self.exprs = exprlist
+        if key is None and len(subjectlist) == 1:
+            subject = next(iter(subjectlist))
+            if subjectlist[subject]['type'] == 'label':
+                key = subject
+        self.key = key
+        self.sortkey = sortkey
+        self.rows = None
+        self.seq = 0
+        self.subscribers = 0
+        self._stamp = 0
+        self._lock = Lock()
+
+    @classmethod
+    def register(cls, name, standing):
+        """Share a standing query under a name, unless one is already there.
+        
+        Args:
+            name (hashable): Name by which the query is shared.
+            standing (StandingQuery): Query to share.
+        
+        Returns:
+            The StandingQuery that is shared under the name.
+        """
+        with cls._registry_lock:
+            standing = cls.registry.setdefault(name, standing)
+            cls.registry.move_to_end(name)
+            excess = len(cls.registry) - app.config['STANDING_MAX_QUERIES']
+            if excess > 0:
+                unused = [key for key, query in cls.registry.items()
+                          if not query.subscribers]
+                for key in unused[:excess]:
+                    del cls.registry[key]
+            return standing
+
+    @classmethod
+    def floor(cls):
+        """Return the last log entry seen by the least current shared query.
+        
+        Queries that are computed again in full when next read, because they
+        were never computed or are older than STANDING_MAX_AGE, do not need
+        the log and are left out.
+        
+        Returns:
+            int number of the log entry, or None if no query needs the log.
+        """
+        now = time()
+        with cls._registry_lock:
+            seqs = [standing.seq for standing in cls.registry.values()
+                    if standing.rows is not None and
+                    now - standing._stamp <= app.config['STANDING_MAX_AGE']]
+        return min(seqs) if seqs else None
+
+    @classmethod
+    def lookup(cls, name, subscribers = 0):
+        """Return the standing query shared under a name, if it is still kept.
+        
+        Args:
+            name (hashable): Name by which the query is shared.
+            subscribers (int): Change in the number of its subscribers.
+        
+        Returns:
+            The StandingQuery that is shared under the name, or None.
+        """
+        with cls._registry_lock:
+            standing = cls.registry.get(name)
+            if standing is not None:
+                cls.registry.move_to_end(name)
+                standing.subscribers += subscribers
+            return standing
+
+    def _patterns(self):
+        """Return every triple pattern of the body and the optional bodies.
+        
+        Returns:
+            list of (subject, predicate, object) term dicts.
+        """
+        patterns = []
+        for body in [self.subjects] + list(self.optionals):
+            for subject in body:
+                subject_term = {'type': body[subject]['type'],
+                                'value': subject}
+                predlist = body[subject]['value']
+                for predicate in predlist:
+                    pred_term = {'type': predlist[predicate]['type'],
+                                 'value': predicate}
+                    for rdfobject in predlist[predicate]['value']:
+                        patterns.append((subject_term, pred_term, rdfobject))
+        return patterns
+
+    def _matches(self, term, value):
+        """Return True if a term of a pattern can match a value of a triple.
+        
+        Args:
+            term (dict): Term of a triple pattern, of any type.
+            value (dict): URI or literal of a triple, as an RDF object.
+        
+        Returns:
+            True if the term is a label that may hold the value or a constant
+            equal to it, False otherwise.
+        """
+        if term['type'] == 'label':
+            allowed = self.values.get(term['value'])
+            if allowed is None:
+                return True
+            return any(self._matches(option, value) for option in allowed)
+        if term['type'] in ('uri', 'pfx'):
+            return (value['type'] == 'uri' and
+                    expand(term['value']) == value['value'])
+        if term['type'] == 'literal':
+            return value['type'] != 'uri' and term['value'] == value['value']
+        # property paths may match any predicate
+        return True
+
+    def _affected(self, change):
+        """Return the keys whose results a logged change may alter.
+        
+        Args:
+            change (dict): One entry of the change log.
+        
+        Returns:
+            set of key values, which is empty if the change cannot alter the
+            results, or None if the whole query must be computed again.
+        """
+        if self.graphs and change['graph'] not in self.graphs:
+            return set()
+        if change['action'] not in ('INSERT', 'DELETE'):
+            return None
+        triple = ({'type': 'uri', 'value': change['subject']},
+                  {'type': 'uri', 'value': change['predicate']},
+                  change['object'])
+        keys = set()
+        for pattern in self._patterns():
+            if not all(self._matches(term, value)
+                       for term, value in zip(pattern, triple)):
+                continue
+            if pattern[1]['type'] == 'path' or self.key is None:
+                return None
+            bound = [value for term, value in zip(pattern, triple)
+                     if term['type'] == 'label' and term['value'] == self.key]
+            if not bound or bound[0]['type'] != 'uri':
+                return None
+            keys.add(bound[0]['value'])
+        return keys
+
+    def _compute(self, sparql, keys = None):
+        """Return the results of the query, or of some of its partitions.
+        
+        Args:
+            keys (set): Values of the key for which to compute results, or
+                None to compute every result.
+            sparql (SPARQLER): Connection to the SPARQL endpoint.
+        
+        Returns:
+            list of results in the JSON format of SPARQL, or None on error.
+        """
+        values = dict(self.values)
+        if keys is not None:
+            values[self.key] = [{'type': 'uri', 'value': key}
+                                for key in sorted(keys)
+                                if self._matches({'type': 'label',
+                                                  'value': self.key},
+                                                 {'type': 'uri',
+                                                  'value': key})]
+            if not values[self.key]:
+                return []
+        result = sparql.query_general(graphlist=self.graphs,
+                                      labellist=self.labels,
+                                      subjectlist=self.subjects,
+                                      optlist=self.optionals,
+                                      valuelist=values,
+                                      filterlist=self.filters,
+                                      orderlist=self.order,
+                                      exprlist=self.exprs)
+        if not result:
+            return None
+        return result['results']['bindings']
+
+    def results(self, sparql):
+        """Return the current results, bringing them up to date first.
+        
+        Args:
+            sparql (SPARQLER): Connection to the SPARQL endpoint.
+        
+        Returns:
+            list of results in the JSON format of SPARQL, or None if they
+            could not be computed.
+        """
+        changelog = get_changelog()
+        with self._lock:
+            last = changelog.last()
+            keys = set()
+            if (self.rows is None or
+                    time() - self._stamp > app.config['STANDING_MAX_AGE']):
+                keys = None
+            else:
+                changes = changelog.since(self.seq, last)
+                # entries deleted from the log cannot be examined
+                if changes is None:
+                    keys = None
+                    changes = []
+                for change in changes:
+                    affected = self._affected(change)
+                    if affected is None:
+                        keys = None
+                        break
+                    keys.update(affected)
+                if keys and len(keys) > app.config['STANDING_MAX_KEYS']:
+                    keys = None
+                # partial results cannot be merged in the endpoint's order
+                if keys and self.order and self.sortkey is None:
+                    keys = None
+            if keys is None:
+                rows = self._compute(sparql)
+                if rows is not None:
+                    self.rows = rows
+                    self._stamp = time()
+                    self.seq = last
+            elif keys:
+                rows = self._compute(sparql, keys)
+                if rows is not None:
+                    kept = [row for row in self.rows
+                            if row.get(self.key, {}).get('value') not in keys]
+                    self.rows = kept + rows
+                    if self.sortkey is not None:
+                        self.rows.sort(key=self.sortkey)
+                    self.seq = last
+            else:
+                self.seq = last
+            return self.rows
+
+
+ChangeLog.readers.append(StandingQuery.floor)
+
+
+def _preds_from_bindings(bindings):
+    """Return the predicates and objects held by some SPARQL query results.
+    
+    Each binding must contain 'p' and 'o' labels, representing a predicate and
+    an object of the same subject. Objects are grouped under their predicate
+    in the format of the 'preds' attribute of a Subject, and duplicates are
+    dropped.
+    
+    Args:
+        bindings (list): Results of a SPARQL query, in JSON format.
+    
+    Returns:
+        dict of predicates and objects, or None if a label was missing.
+    """
+    predlist = {}
+    try:
+        for binding in bindings:
+            predicate = binding['p']['value']
+            rdfobject = binding['o']
+            type = binding['p']['type']
+            value = {'type': type, 'value': [rdfobject]}
+            if predicate not in predlist:
+                predlist[predicate] = value
+            elif rdfobject not in predlist[predicate]['value']:
+                predlist[predicate]['value'].append(rdfobject)
+    except KeyError as e:
+        print(__name__, str(e))
+        return None
+    return predlist
+
+
+def _preds_from_triples(triples):
+    """Return the predicates and objects of each subject of some triples.
+    
+    Objects are grouped under their predicate in the format of the 'preds'
+    attribute of a Subject, and duplicates are dropped, as they are by
+    _preds_from_bindings().
+    
+    Args:
+        triples (list): (subject, predicate, object) tuples of RDF terms, as
+            returned by the 'construct' method of SPARQLER.
+    
+    Returns:
+        dict of predicates and objects, keyed by subject URI.
+    """
+    found = {}
+    for subject, predicate, rdfobject in triples:
+        predlist = found.setdefault(subject['value'], {})
+        value = predlist.setdefault(predicate['value'],
+                                    {'type': predicate['type'], 'value': []})
+        if rdfobject not in value['value']:
+            value['value'].append(rdfobject)
+    return found
+
+
+def get_loader():
+    """Return the SubjectLoader of the current request, creating it if needed.
+    
+    The loader is kept in the global context, g, so it lives exactly as long
+    as the request that uses it.
+    
+    Returns:
+        SubjectLoader shared by every Subject in the current request.
+    """
+    loader = getattr(g, 'subject_loader', None)
+    if loader is None:
+        loader = SubjectLoader()
+        g.subject_loader = loader
+    return loader
+
+
+class SubjectLoader(object):
+    """Request-scoped identity map and batch loader for Subjects.
+    
+    A Subject that needs data from the triplestore registers its id and graph
+    list with the loader when it is constructed, but nothing is retrieved until
+    the data of some Subject is first needed. At that point, every pending URI
+    with the same graph list is retrieved with one 'CONSTRUCT' query, whose
+    answer in N-Triples is parsed straight into predicates. Retrieved
+    predicates are kept by id and graph list, so that every Subject for the
+    same resource in one request shares the same 'preds' dict. Changes made
+    through one such Subject are therefore seen by all of them, but changes
+    sent to the triplestore by other means are not seen until the next request.
+    
+    Attributes:
+        loaded (dict): Retrieved 'preds' dicts, keyed by id and graph list.
+        pending (dict): Sets of URIs waiting to be retrieved, by graph list.
+    """
+
+    def __init__(self):
+        """Setup an empty identity map and pending list."""
+        self.loaded = {}
+        self.pending = {}
+
+    def register(self, id, type, graphlist):
+        """Queue one subject to be retrieved with the next batch.
+        
+        Only URIs are batched, since a prefixed name cannot be matched to the
+        full URI that the endpoint returns for it. Subjects that were already
+        retrieved are not queued again.
+        
+        Args:
+            graphlist (frozenset): Named graphs in which to scope the query.
+            id (str): URI or prefixed name that identifies the subject.
+            type (str): Should be 'uri' or 'pfx' for prefixed name.
+        """
+        if type == 'uri' and (id, graphlist) not in self.loaded:
+            self.pending.setdefault(graphlist, set()).add(id)
+
+    def get(self, id, type, graphlist):
+        """Return the predicates and objects of one subject.
+        
+        If the subject has not been retrieved in this request, then it is
+        retrieved along with every other pending subject with the same graph
+        list.
+        
+        Args:
+            graphlist (frozenset): Named graphs in which to scope the query.
+            id (str): URI or prefixed name that identifies the subject.
+            type (str): Should be 'uri' or 'pfx' for prefixed name.
+        
+        Returns:
+            dict of predicates and objects, shared by Subjects with this id.
+        """
+        key = (id, graphlist)
+        if key not in self.loaded:
+            if type == 'uri':
+                self.register(id, type, graphlist)
+                self.load(graphlist)
+            else:
+                results = g.sparql.query_subject(id, type, set(graphlist))
+                self.loaded[key] = self._extract(results, id).get(id, {})
+        return self.loaded.get(key, {})
+
+    def remember(self, id, graphlist, predlist):
+        """Record the predicates of a subject that are already known.
+        
+        This allows a caller that has learned about a subject by other means,
+        such as an existence check, to spare the loader a query.
+        
+        Args:
+            graphlist (frozenset): Named graphs in which to scope the query.
+            id (str): URI that identifies the subject.
+            predlist (dict): Predicates and objects of the subject.
+        """
+        self.loaded[(id, graphlist)] = predlist
+        if graphlist in self.pending:
+            self.pending[graphlist].discard(id)
+
+    def load(self, graphlist):
+        """Retrieve every pending subject for one graph list in one query.
+        
+        Subjects for which the triplestore returns nothing are recorded with
+        an empty dict, so they are not retrieved again in this request. If
+        the 'CONSTRUCT' for several subjects fails, they are selected instead,
+        and if a query fails, nothing is recorded.
+        
+        Args:
+            graphlist (frozenset): Named graphs in which to scope the query.
+        """
+        idlist = sorted(self.pending.pop(graphlist, set()))
+        if not idlist:
+            return
+        if len(idlist) == 1:
+            results = g.sparql.query_subject(idlist[0], 'uri', set(graphlist))
+            if results is None:
+                return
+            found = self._extract(results, idlist[0])
+        else:
+            triples = g.sparql.construct_subjects(idlist, set(graphlist))
+            if triples is not None:
+                found = _preds_from_triples(triples)
+            else:
+                results = g.sparql.query_subjects(idlist, set(graphlist))
+                if results is None:
+                    return
+                found = self._extract(results)
+        for id in idlist:
+            self.loaded[(id, graphlist)] = found.get(id, {})
+
+    def _extract(self, results, id = None):
+        """Return the predicates and objects in query results by subject.
+        
+        If an id is provided, then every result is taken to describe that one
+        subject. Otherwise, the 's' label of each result names its subject.
+        
+        Args:
+            id (str): URI or prefixed name of the only subject in the results.
+            results (dict): JSON format results of a SPARQL query.
+        
+        Returns:
+            dict of 'preds' dicts, keyed by subject.
+        """
+        if not results or 'results' not in results:
+            return {}
+        bindings = results['results']['bindings']
+        if id is not None:
+            return {id: _preds_from_bindings(bindings) or {}}
+        grouped = {}
+        for binding in bindings:
+            grouped.setdefault(binding['s']['value'], []).append(binding)
+        return {id: _preds_from_bindings(grouped[id]) or {} for id in grouped}
+
+
 class Subject(object):
     """JSON/TTL-like serialization of a subject described in RDF.
     
@@ -602,6 +1331,9 @@ class Subject(object):
         type (str): How to interpret the id, one of 'uri', 'pfx', or 'label'.
     """
 
+    _known = OrderedDict()
+    _known_lock = Lock()
+
     def __init__(self, id, type = 'uri', graphlist = set(), predlist = {}):
         """Setup using defaults, provided values, or from the triplestore.
         
@@ -614,6 +1346,12 @@ class Subject(object):
         although it is not recommended to use 'label' since that already has
         another meaning.
         
+        Retrieval is deferred until 'preds' is first accessed. Until then, the
+        Subject is registered with the SubjectLoader of the current request,
+        so that every pending Subject is retrieved by the same query, and a
+        Subject that is constructed twice in one request is only retrieved
+        once.
+        
         Args:
             graphlist (set): Named graphs to which a subject may belong.
             id (str): Unique value to assign to this subject for queries.
@@ -624,10 +1362,172 @@ class Subject(object):
         self.type = type
         self.graphs = {''}
         self.graphs.update(graphlist)
-        self.preds = predlist
-        if self.type != 'label' and not self.preds:
-            results = g.sparql.query_subject(id, type, graphlist)
-            self.preds = self._init_values(results)
+        self._graphlist = frozenset(graphlist)
+        self._preds = predlist
+        if self.type != 'label' and not predlist:
+            self._preds = None
+            get_loader().register(id, type, self._graphlist)
+
+    @property
+    def preds(self):
+        """dict: Predicates and objects, retrieved on first access."""
+        if self._preds is None:
+            self._preds = get_loader().get(self.id, self.type,
+                                           self._graphlist)
+        return self._preds
+
+    @preds.setter
+    def preds(self, predlist):
+        self._preds = predlist
+
+    @classmethod
+    def load_many(cls, idlist, graphlist = set()):
+        """Return a Subject for each of several URIs, retrieved at once.
+        
+        Every URI that was not yet retrieved in this request is retrieved by
+        the SubjectLoader with one 'CONSTRUCT' query, so any number of
+        Subjects costs one round trip to the endpoint.
+        
+        Args:
+            graphlist (set): Named graphs to which the subjects may belong.
+            idlist (list): URIs that identify the subjects.
+        
+        Returns:
+            list of Subjects, in the order of their URIs.
+        """
+        graphs = frozenset(graphlist)
+        loader = get_loader()
+        for id in idlist:
+            loader.register(id, 'uri', graphs)
+        loader.load(graphs)
+        return [cls(id, graphlist=graphlist,
+                    predlist=loader.get(id, 'uri', graphs))
+                for id in idlist]
+
+    @classmethod
+    def _recall(cls, key, seq):
+        """Return a remembered existence answer if it is still current.
+        
+        Answers are remembered along with the number of the last change log
+        entry of the graphs they were scoped to, which every process that
+        shares the log sees alike. They are forgotten once any of those graphs
+        has changed or EXISTS_CACHE_TTL seconds have passed, whichever comes
+        first. The time limit covers writes that bypass every SPARQLER.
+        
+        Args:
+            key (tuple): Subject id, graph list, and predicate of the check.
+            seq (int): Number of the last log entry of the graphs.
+        
+        Returns:
+            True or False if an answer is remembered, None otherwise.
+        """
+        with cls._known_lock:
+            if key in cls._known:
+                found, known_seq, stamp = cls._known[key]
+                if (known_seq == seq and
+                        time() - stamp < app.config['EXISTS_CACHE_TTL']):
+                    cls._known.move_to_end(key)
+                    return found
+                del cls._known[key]
+        return None
+
+    @classmethod
+    def _remember(cls, key, seq, found):
+        """Keep an existence answer for later checks of the same subject.
+        
+        Args:
+            found (bool): Whether the subject was found in the triplestore.
+            key (tuple): Subject id, graph list, and predicate of the check.
+            seq (int): Number of the last log entry of the graphs when the
+                check was made.
+        """
+        with cls._known_lock:
+            cls._known[key] = (found, seq, time())
+            while len(cls._known) > app.config['EXISTS_CACHE_SIZE']:
+                cls._known.popitem(last=False)
+
+    @classmethod
+    def exists_many(cls, idlist, graphlist = set(), predicate = None):
+        """Return the URIs of those subjects that exist in the triplestore.
+        
+        A subject exists if it is the subject of at least one triple or, if a
+        predicate is provided, of at least one triple with that predicate.
+        Subjects already retrieved in the current request are answered from
+        the SubjectLoader, and recent answers are remembered between requests.
+        Any remaining URIs are checked with one 'ASK' query if there is only
+        one, or with one 'VALUES' query for all of them otherwise. A subject
+        that is found not to exist is recorded with the SubjectLoader, so that
+        it is not retrieved again when it is created in the same request.
+        
+        Args:
+            graphlist (set): Named graphs to which the subjects may belong.
+            idlist (list): URIs that identify the subjects to check.
+            predicate (str): URI of a predicate that the subjects must have.
+        
+        Returns:
+            set of URIs from idlist that were found in the triplestore.
+        """
+        graphs = frozenset(graphlist)
+        # no graph list means the default scope, which is logged as ''
+        seq = get_changelog().latest(graphlist or {''})[0]
+        loader = get_loader()
+        found = set()
+        unknown = []
+        for id in set(idlist):
+            if (id, graphs) in loader.loaded:
+                predlist = loader.loaded[(id, graphs)]
+                if (predicate in predlist) if predicate else predlist:
+                    found.add(id)
+                continue
+            answer = cls._recall((id, graphs, predicate), seq)
+            if answer is None:
+                unknown.append(id)
+            elif answer:
+                found.add(id)
+        if not unknown:
+            return found
+        rdfobject = {'type': 'label', 'value': 'o'}
+        if predicate:
+            predlist = {predicate: {'type': 'uri', 'value': [rdfobject]}}
+        else:
+            predlist = {'p': {'type': 'label', 'value': [rdfobject]}}
+        if len(unknown) == 1:
+            subject = {unknown[0]: {'type': 'uri', 'value': predlist}}
+            answer = g.sparql.ask(graphlist, subject)
+            if answer is None:
+                return found
+            hits = set(unknown) if answer else set()
+        else:
+            subject = {'s': {'type': 'label', 'value': predlist}}
+            values = {'s': [{'type': 'uri', 'value': id} for id in unknown]}
+            results = g.sparql.query_general(graphlist, {'s'}, subject,
+                                             valuelist=values)
+            if not results:
+                return found
+            hits = {binding['s']['value']
+                    for binding in results['results']['bindings']}
+        for id in unknown:
+            cls._remember((id, graphs, predicate), seq, id in hits)
+            if id not in hits and not predicate:
+                loader.remember(id, graphs, {})
+        return found | hits
+
+    @classmethod
+    def exists(cls, id, graphlist = set(), predicate = None):
+        """Return True if the subject having id exists in the triplestore.
+        
+        This is a shortcut for exists_many() with a single URI, which avoids
+        retrieving every triple of the subject to answer a yes/no question.
+        
+        Args:
+            graphlist (set): Named graphs to which the subject may belong.
+            id (str): URI that identifies the subject to check.
+            predicate (str): URI of a predicate that the subject must have.
+        
+        Returns:
+            True if the subject was found, False otherwise.
+        """
+        return id in cls.exists_many([id], graphlist, predicate)
 
     def _init_values(self, results):
         """Returns all triples about this subject retrieved from a triplestore.
@@ -644,23 +1544,156 @@ class Subject(object):
         Returns:
             A graph containing descriptive predicates and associated objects.
         """
-        predlist = {}
         if 'results' in results:
-            try:
-                bindings = results['results']['bindings']
-                for binding in bindings:
-                    predicate = binding['p']['value']
-                    rdfobject = binding['o']
-                    type = binding['p']['type']
-                    value = {'type': type, 'value': [rdfobject]}
-                    if predicate not in predlist:
-                        predlist[predicate] = value
-                    elif rdfobject not in predlist[predicate]['value']:
-                        predlist[predicate]['value'].append(rdfobject)
-            except KeyError as e:
-                print(__name__, str(e))
-                return None
-        return predlist
+            return _preds_from_bindings(results['results']['bindings'])
+        return {}
+
+    def neighborhood(self, depth = 1, direction = 'both', predicates = None,
+                     max_nodes = None):
+        """Return the subgraph within a number of links of this subject.
+        
+        The graph is expanded breadth-first. Every subject that was reached at
+        one level and not visited before becomes part of the frontier for the
+        next, and the whole frontier is expanded by a single query, so a depth
+        of three costs at most three round trips to the endpoint. Expansion
+        stops early once max_nodes subjects have been visited, which defaults
+        to NEIGHBORHOOD_MAX_NODES from the configuration. No more than that
+        many links are read per level, so that a hub does not flood the
+        result.
+        
+        Args:
+            depth (int): Greatest number of links between any node and this.
+            direction (str): 'out', 'in', or 'both' ways to follow links.
+            max_nodes (int): Greatest number of nodes to visit.
+            predicates (list): URIs or prefixed names of the only predicates
+                to follow, or None to follow every predicate.
+        
+        Returns:
+            dict with 'nodes', an OrderedDict of the depth of each visited
+            URI, in the order that they were reached, and 'edges', a list of
+            (subject, predicate, object) URI tuples between visited nodes.
+        """
+        if max_nodes is None:
+            max_nodes = app.config['NEIGHBORHOOD_MAX_NODES']
+        predlist = [expand(pred) for pred in predicates or []]
+        start = expand(self.id) if self.type == 'pfx' else self.id
+        nodes = OrderedDict([(start, 0)])
+        edges = []
+        seen_edges = set()
+        frontier = [start]
+        for level in range(1, depth + 1):
+            if not frontier or len(nodes) >= max_nodes:
+                break
+            results = g.sparql.query_edges(frontier, self._graphlist,
+                                           direction, predlist,
+                                           limit=max_nodes)
+            if results is None:
+                break
+            frontier = []
+            for binding in results['results']['bindings']:
+                node = binding['n']['value']
+                neighbor = binding['m']['value']
+                if neighbor not in nodes:
+                    if len(nodes) >= max_nodes:
+                        continue
+                    nodes[neighbor] = level
+                    frontier.append(neighbor)
+                edge = (node, binding['p']['value'], neighbor)
+                if binding['dir']['value'] == 'in':
+                    edge = (neighbor, binding['p']['value'], node)
+                if edge not in seen_edges:
+                    seen_edges.add(edge)
+                    edges.append(edge)
+        return {'nodes': nodes, 'edges': edges}
+
+    def _link_pattern(self, predicate, direction):
+        """Return the query body for links of one direction of this subject.
+        
+        Outgoing links bind their objects to the 'o' label and incoming links
+        bind their subjects to the 's' label, so that the other end of a link
+        is always bound to the label that names its position.
+        
+        Args:
+            direction (str): 'out' for links from or 'in' for links to this.
+            predicate (dict): Predicate term, as a 'uri' or a 'label'.
+        
+        Returns:
+            Tuple of the subject list and the label for the other end.
+        """
+        if direction == 'in':
+            this = {'type': self.type, 'value': self.id}
+            preds = {predicate['value']: {'type': predicate['type'],
+                                          'value': [this]}}
+            return {'s': {'type': 'label', 'value': preds}}, 's'
+        other = {'type': 'label', 'value': 'o'}
+        preds = {predicate['value']: {'type': predicate['type'],
+                                      'value': [other]}}
+        return {self.id: {'type': self.type, 'value': preds}}, 'o'
+
+    def count_links(self, direction = 'out', sparql = None):
+        """Return the number of links of each predicate of this subject.
+        
+        The links are counted by one aggregate query, grouped by predicate, so
+        no objects are transferred from the endpoint. This bounds the cost of
+        describing a subject with thousands of links by the number of distinct
+        predicates it has, rather than by the links themselves.
+        
+        Args:
+            direction (str): 'out' for links from or 'in' for links to this.
+            sparql (SPARQLER): Connection to use in place of g.sparql. An
+                AsyncSPARQLER makes this return a coroutine.
+        
+        Returns:
+            OrderedDict of link counts, keyed by predicate URI in sorted order.
+        """
+        predicate = {'type': 'label', 'value': 'p'}
+        subject, other = self._link_pattern(predicate, direction)
+        count = {'type': 'function', 'value': 'COUNT',
+                 'args': [{'type': 'label', 'value': other}]}
+        sparql = sparql or g.sparql
+        result = sparql.query_general(graphlist=self._graphlist,
+                                      labellist={'p'},
+                                      subjectlist=subject,
+                                      orderlist=[predicate],
+                                      exprlist={'count': count},
+                                      grouplist=['p'])
+
+        def read(result):
+            counts = OrderedDict()
+            if result:
+                for row in result['results']['bindings']:
+                    counts[row['p']['value']] = int(row['count']['value'])
+            return counts
+
+        return then(result, read)
+
+    def get_links(self, predicate, direction = 'out', limit = None,
+                  offset = None):
+        """Return one page of the subjects linked to this by one predicate.
+        
+        The results are sorted by the endpoint, so that consecutive pages
+        neither skip nor repeat any link.
+        
+        Args:
+            direction (str): 'out' for links from or 'in' for links to this.
+            limit (int): Maximum number of links to return, if provided.
+            offset (int): Number of links to skip, if provided.
+            predicate (str): URI of the predicate that forms the links.
+        
+        Returns:
+            list of RDF objects, in the JSON format of SPARQL query results.
+        """
+        term = {'type': 'uri', 'value': predicate}
+        subject, other = self._link_pattern(term, direction)
+        result = g.sparql.query_general(graphlist=self._graphlist,
+                                        labellist={other},
+                                        subjectlist=subject,
+                                        limit=limit, offset=offset,
+                                        orderlist=[{'type': 'label',
+                                                    'value': other}])
+        if not result:
+            return []
+        return [row[other] for row in result['results']['bindings']]
 
     def add_graphs(self, graphlist):
         """Append new graphs to the list of graphs to query for this subject.
@@ -844,6 +1877,34 @@ class User(Subject):
             return user
         return None
 
+    @classmethod
+    def exists_many(cls, usernames):
+        """Return those usernames that belong to registered users.
+        
+        Constructing a User marks its id as an skmf:User, so a User is only
+        considered registered once it has a password hash. All usernames are
+        checked in a single query, unless their answers are already known.
+        
+        Args:
+            usernames (list): Unique user ids, same as name portion of 'id'.
+        
+        Returns:
+            set of usernames from the list that were found.
+        """
+        namespace = app.config['NAMESPACE']
+        ids = {'{}#{}'.format(namespace, name): name for name in usernames}
+        found = super().exists_many(list(ids), {'users'}, User.hashkey)
+        return {ids[id] for id in found}
+
+    @classmethod
+    def exists(cls, username):
+        """Return True if a registered user has the username, else False.
+        
+        Args:
+            username (str): Unique user id, same as name portion of 'id'.
+        """
+        return username in cls.exists_many([username])
+
     def is_authenticated(self):
         """Return 'True' if the user is authenticated, 'False' otherwise."""
         return self.authenticated
@@ -3,20 +3,857 @@
 Perform operations on a SPARQL endpoint, such as inserts, queries, and updates.
 Higher-level modules should call this module to interface with the SPARQL end-
 point rather than attempting to form and execute their own queries. The SPARQL
-endpoint must be available and writable. If it is not, an exception will be
-raised, but only once a query is attempted. An attempt is made to keep queries
-as generalized as possible so that they may be dynamically formed rather than
-using static query strings with variable parameters.
+endpoint must be available and writable. If it is not, a read returns None, or
+the last good result of the same query, and an update returns False. An
+attempt is made to keep queries as generalized as possible so that they may be
+dynamically formed rather than using static query strings with variable
+parameters.
+
+An AsyncSPARQLER forms the same queries, but sends them over a shared pool of
+connections as coroutines, so that many requests can be in flight at once. It
+is only available when the optional aiohttp package is installed. Reads may be
+spread across several replicas of the triplestore, listed in SPARQL_REPLICAS,
+while every update is sent to the primary endpoint.
+
+A CircuitBreaker watches the outcome of every request. Once too many fail or
+are slow, it opens, and requests fail at once, with reads served from their
+last good result where one is kept, until a single probe finds the endpoint
+healthy again.
+
+Whole named graphs are loaded, replaced, exported, and dropped over the SPARQL
+1.1 Graph Store HTTP Protocol, in N-Triples, when the endpoint answers at
+SPARQL_GRAPH_STORE. Otherwise, the same operations fall back to SPARQL Update
+and a SELECT of every triple in the graph. A 'CONSTRUCT' query is answered in
+N-Triples as well, which is parsed a line at a time into RDF terms.
+
+Every read must answer within a deadline, which is the sooner of the end of
+the time budget of the Flask request and SPARQL_QUERY_TIMEOUT. A read that
+has not answered by the rolling 95th percentile of read latency is sent once
+more to another replica, and whichever answers first is used.
 
 Classes:
+    AsyncSPARQLER: A SPARQLER whose requests are sent as coroutines.
+    CircuitBreaker: Stop sending requests to an endpoint that is failing.
+    GroupCommitter: Send the updates of concurrent threads as one request.
+    LatencyTracker: Rolling window of read latencies and their percentiles.
+    Planner: Order the triple patterns of a query body by selectivity.
+    ReplicaPool: Balance read queries across replicas of the endpoint.
     SPARQLER: An extension of SPARQLWrapper to handle special cases for SKMF.
+
+Functions:
+    expand: Return the full URI of a prefixed name.
+    format_path: Check and format the text of a SPARQL property path.
+    format_term: Return one RDF term in N-Triples syntax.
+    gather: Wait for the results of several requests sent at once.
+    get_committer: Return the GroupCommitter shared by this process.
+    get_executor: Return the thread pool that sends hedged reads.
+    get_loop: Return the event loop that runs every asynchronous request.
+    get_pool: Return the ReplicaPool shared by this process, if any.
+    get_prefixes: Return the namespaces of the configured prefixes.
+    ntriples: Return each of some triples as a line of N-Triples.
+    parse_ntriples: Return the triples held by a document in N-Triples.
+    then: Apply a function to a result, whether or not it is pending.
 """
 
-from SPARQLWrapper import JSON, POST, SPARQLWrapper
+import asyncio
+import re
+import socket
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from copy import copy, deepcopy
+from threading import Condition, Event, Lock, Thread
+from time import sleep, time
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from uuid import uuid4
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from SPARQLWrapper import JSON, N3, POST, SPARQLWrapper
 from SPARQLWrapper.SPARQLExceptions import EndPointInternalError, \
                                            EndPointNotFound, QueryBadFormed
 
 from skmf import app
+from skmf.changelog import get_changelog
+
+PREFIX_PATTERN = re.compile(r'PREFIX\s+([\w.-]*):\s*<([^>]*)>')
+"""Pattern: Matches one prefix declaration of a SPARQL query."""
+
+PATH_TOKEN = re.compile(r'\s*(<[^<>"{}|^`\\\s]*>|[A-Za-z][\w.-]*:[\w.-]*|'
+                        r'a(?![\w:])|[/|^*+?()!])')
+"""Pattern: Matches one IRI, prefixed name, or operator of a property path."""
+
+RDF_TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+"""str: URI of the rdf:type predicate, abbreviated 'a' in SPARQL."""
+
+NTRIPLES = 'application/n-triples'
+"""str: Media type of N-Triples, used by the Graph Store Protocol."""
+
+NT_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n',
+                            '\r': '\\r'})
+"""dict: Characters that must be escaped in an N-Triples literal."""
+
+NT_UNESCAPE = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+"""Pattern: Matches one escape sequence of an N-Triples term."""
+
+NT_CHARACTERS = {'t': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f'}
+"""dict: Characters written as a letter after a backslash in N-Triples."""
+
+_prefix_cache = {}
+_loop = []
+_loop_lock = Lock()
+_pool = []
+_pool_lock = Lock()
+_executor = []
+_executor_lock = Lock()
+_committer = []
+_committer_lock = Lock()
+
+
+def get_prefixes():
+    """Return the namespaces of the prefixes that are sent with every query.
+    
+    The 'PREFIXES' configuration value is parsed once and the result is kept
+    for as long as that value remains the same.
+    
+    Returns:
+        dict of namespace URIs, keyed by prefix.
+    """
+    declarations = app.config['PREFIXES']
+    if declarations not in _prefix_cache:
+        _prefix_cache.clear()
+        _prefix_cache[declarations] = dict(
+            PREFIX_PATTERN.findall(declarations))
+    return _prefix_cache[declarations]
+
+
+def expand(name):
+    """Return the full URI of a prefixed name, or the name if it has none.
+    
+    The SPARQL keyword 'a' is expanded to rdf:type. A name whose prefix is not
+    among the configured prefixes is returned unchanged.
+    
+    Args:
+        name (str): Prefixed name, such as 'rdfs:label'.
+    
+    Returns:
+        String of the full URI that the name abbreviates.
+    """
+    if name == 'a':
+        return RDF_TYPE
+    prefix, colon, local = name.partition(':')
+    namespaces = get_prefixes()
+    if colon and prefix in namespaces:
+        return namespaces[prefix] + local
+    return name
+
+
+def format_term(term):
+    """Return one RDF term in N-Triples syntax.
+    
+    Args:
+        term (dict): RDF term in the JSON format of SPARQL query results. A
+            'pfx' term is expanded to its full URI.
+    
+    Returns:
+        String of the term as it is written in N-Triples.
+    """
+    if term['type'] == 'uri':
+        return '<{}>'.format(term['value'])
+    if term['type'] == 'pfx':
+        return '<{}>'.format(expand(term['value']))
+    if term['type'] == 'bnode':
+        return '_:{}'.format(term['value'])
+    literal = '"{}"'.format(term['value'].translate(NT_ESCAPES))
+    if term.get('xml:lang'):
+        return '{}@{}'.format(literal, term['xml:lang'])
+    if term.get('datatype'):
+        return '{}^^<{}>'.format(literal, term['datatype'])
+    return literal
+
+
+def format_path(path):
+    """Check and format the text of a SPARQL property path.
+    
+    A path is made of IRIs, which must be enclosed in '<' and '>', prefixed
+    names with a configured prefix, the keyword 'a', and the path operators
+    for sequence '/', alternative '|', inverse '^', negation '!', and
+    repetition '*', '+', and '?', grouped with parentheses. For example,
+    'rdfs:subClassOf+' matches every superclass of a subject, however
+    distant, in a single query. Anything else in the path is rejected, so
+    that text from a user cannot alter the rest of the query.
+    
+    Args:
+        path (str): Property path as entered by a user.
+    
+    Returns:
+        String of the property path, or None if it is not valid.
+    """
+    tokens = []
+    depth = 0
+    position = 0
+    path = path.strip()
+    prefixes = get_prefixes()
+    while position < len(path):
+        match = PATH_TOKEN.match(path, position)
+        if not match:
+            print(__name__, 'invalid property path', path)
+            return None
+        token = match.group(1)
+        position = match.end()
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif ':' in token and not token.startswith('<'):
+            if token.partition(':')[0] not in prefixes:
+                print(__name__, 'unknown prefix in path', path)
+                return None
+        if depth < 0:
+            print(__name__, 'unbalanced property path', path)
+            return None
+        tokens.append(token)
+    if depth or not tokens:
+        print(__name__, 'unbalanced property path', path)
+        return None
+    return ''.join(tokens)
+
+
+def ntriples(triples):
+    """Return each of some triples as a line of N-Triples, one at a time.
+    
+    Args:
+        triples (iterable): (subject, predicate, object) tuples of RDF terms
+            in the JSON format of SPARQL query results.
+    
+    Returns:
+        Generator of strings, each one complete line ending with a newline.
+    """
+    for subject, predicate, rdfobject in triples:
+        yield '{} {} {} .\n'.format(format_term(subject),
+                                    format_term(predicate),
+                                    format_term(rdfobject))
+
+
+def _unescape(match):
+    """Return the character written by one N-Triples escape sequence."""
+    short, long, character = match.groups()
+    if character is not None:
+        return NT_CHARACTERS.get(character, character)
+    return chr(int(short or long, 16))
+
+
+def _parse_term(token):
+    """Return one N-Triples term in the JSON format of SPARQL results.
+    
+    Args:
+        token (str): An IRI, blank node, or literal, as written in N-Triples.
+    
+    Returns:
+        dict with the 'type' and 'value' of the term, and the 'xml:lang' or
+        'datatype' of a literal that has one.
+    """
+    if token[0] == '<':
+        value = token[1:-1]
+        if '\\' in value:
+            value = NT_UNESCAPE.sub(_unescape, value)
+        return {'type': 'uri', 'value': value}
+    if token[0] == '_':
+        return {'type': 'bnode', 'value': token[2:]}
+    end = token.rindex('"')
+    value = token[1:end]
+    if '\\' in value:
+        value = NT_UNESCAPE.sub(_unescape, value)
+    term = {'type': 'literal', 'value': value}
+    if token.startswith('@', end + 1):
+        term['xml:lang'] = token[end + 2:]
+    elif token.startswith('^^', end + 1):
+        term['datatype'] = token[end + 4:-1]
+    return term
+
+
+def parse_ntriples(document):
+    """Return the triples held by a document in N-Triples.
+    
+    Each line holds one triple, so the subject and predicate, which never
+    hold spaces, are split from the front of the line and the object is what
+    remains before the final period. Escape sequences are only decoded in
+    terms that hold a backslash. Lines are only split at line feeds, since a
+    literal may hold other line separators, such as U+2028, unescaped.
+    
+    Args:
+        document (str): Lines of N-Triples, as str or UTF-8 encoded bytes.
+    
+    Returns:
+        list of (subject, predicate, object) tuples of RDF terms in the JSON
+        format of SPARQL query results, or None if a line is malformed.
+    """
+    if isinstance(document, bytes):
+        document = document.decode('utf-8')
+    triples = []
+    try:
+        for line in document.split('\n'):
+            line = line.strip(' \t\r')
+            if not line or line[0] == '#':
+                continue
+            subject, predicate, rest = line.split(None, 2)
+            triples.append((_parse_term(subject), _parse_term(predicate),
+                            _parse_term(rest[:-1].rstrip(' \t'))))
+    except (IndexError, ValueError) as e:
+        print(__name__, 'malformed N-Triples', str(e))
+        return None
+    return triples
+
+
+def get_loop():
+    """Return the event loop that runs every asynchronous request.
+    
+    The loop runs forever in a daemon thread that is started on first use, so
+    that the coroutines of every Flask worker share one connection pool.
+    
+    Returns:
+        asyncio event loop that is shared by this process.
+    """
+    with _loop_lock:
+        if not _loop:
+            loop = asyncio.new_event_loop()
+            Thread(target=loop.run_forever, name='skmf-async',
+                   daemon=True).start()
+            _loop.append(loop)
+        return _loop[0]
+
+
+async def _gather(pending):
+    """Return the results of several coroutines, run concurrently."""
+    return await asyncio.gather(*pending)
+
+
+def gather(*results):
+    """Wait for the results of several requests that were sent at once.
+    
+    Each argument is the return value of a query method. Coroutines returned
+    by an AsyncSPARQLER are run concurrently on the shared loop, while results
+    returned by a SPARQLER are already complete and are passed through, so a
+    view may be written once for either kind of connection.
+    
+    Args:
+        results (list): Coroutines or completed results, in any mix.
+    
+    Returns:
+        list of completed results, in the order of the arguments.
+    """
+    pending = [result for result in results if asyncio.iscoroutine(result)]
+    if not pending:
+        return list(results)
+    done = iter(asyncio.run_coroutine_threadsafe(_gather(pending),
+                                                 get_loop()).result())
+    return [next(done) if asyncio.iscoroutine(result) else result
+            for result in results]
+
+
+async def _then(result, convert):
+    """Return the converted result of a coroutine, once it is complete."""
+    return convert(await result)
+
+
+def then(result, convert):
+    """Apply a function to a result, whether or not it is still pending.
+    
+    Args:
+        convert (function): Function to apply to the completed result.
+        result: Coroutine or completed result of a query method.
+    
+    Returns:
+        Converted result, or a coroutine that returns it once complete.
+    """
+    if asyncio.iscoroutine(result):
+        return _then(result, convert)
+    return convert(result)
+
+
+class Planner(object):
+    """Order the triple patterns of a query body by estimated selectivity.
+    
+    Endpoints with weak optimizers evaluate patterns in the order they are
+    written, so a leading pattern with no bound positions becomes a scan of
+    the whole store. The planner breaks each body into single triple patterns
+    and orders them greedily. At each step, the pattern with the lowest
+    estimated number of matches is chosen from among those that share a
+    placeholder with the patterns already chosen, so that every pattern but
+    the first is joined to known bindings. The estimate starts from the
+    number of triples of the predicate and is reduced for each position that
+    is bound by a constant or by an earlier pattern.
+    
+    Predicate cardinalities are kept at the class level, since a new Planner
+    is created along with every SPARQLER, and they may be filled in by any
+    source of statistics. A predicate without statistics is assumed to have
+    'default' triples, and a placeholder predicate is assumed to match every
+    triple in the store.
+    
+    Attributes:
+        cardinalities (dict): Number of triples for each predicate URI.
+        default (int): Assumed number of triples for an unknown predicate.
+        object_factor (int): Reduction in matches for a bound object.
+        subject_factor (int): Reduction in matches for a bound subject.
+    """
+
+    cardinalities = {}
+    default = 1000
+    object_factor = 10
+    subject_factor = 100
+
+    def _flatten(self, subjectlist):
+        """Return every triple pattern of a body as a separate subject list.
+        
+        Args:
+            subjectlist (dict): Structured data that define a query body.
+        
+        Returns:
+            list of subject lists that each hold a single triple pattern.
+        """
+        patterns = []
+        for subject in subjectlist:
+            stype = subjectlist[subject]['type']
+            predlist = subjectlist[subject]['value']
+            for predicate in predlist:
+                ptype = predlist[predicate]['type']
+                for rdfobject in predlist[predicate]['value']:
+                    preds = {predicate: {'type': ptype,
+                                         'value': [rdfobject]}}
+                    patterns.append({subject: {'type': stype,
+                                               'value': preds}})
+        return patterns
+
+    def variables(self, subjectlist):
+        """Return every placeholder label that appears in a query body.
+        
+        Args:
+            subjectlist (dict): Structured data that define a query body.
+        
+        Returns:
+            set of placeholder labels.
+        """
+        labels = set()
+        for subject in subjectlist:
+            if subjectlist[subject]['type'] == 'label':
+                labels.add(subject)
+            predlist = subjectlist[subject]['value']
+            for predicate in predlist:
+                if predlist[predicate]['type'] == 'label':
+                    labels.add(predicate)
+                for rdfobject in predlist[predicate]['value']:
+                    if rdfobject.get('type') == 'label':
+                        labels.add(rdfobject['value'])
+        return labels
+
+    def estimate(self, pattern, boundlist = set()):
+        """Return the estimated number of matches for one triple pattern.
+        
+        Args:
+            boundlist (set): Placeholder labels bound by earlier patterns.
+            pattern (dict): Subject list that holds a single triple pattern.
+        
+        Returns:
+            float estimate of the number of triples the pattern matches.
+        """
+        subject = next(iter(pattern))
+        predlist = pattern[subject]['value']
+        predicate = next(iter(predlist))
+        ptype = predlist[predicate]['type']
+        rdfobject = predlist[predicate]['value'][0]
+        if ptype == 'label' and predicate not in boundlist:
+            cost = sum(self.cardinalities.values()) or self.default * 100
+        elif ptype in ('uri', 'pfx'):
+            cost = self.cardinalities.get(expand(predicate), self.default)
+        else:
+            cost = self.default
+        if pattern[subject]['type'] != 'label' or subject in boundlist:
+            cost /= self.subject_factor
+        if (rdfobject.get('type') != 'label' or
+                rdfobject.get('value') in boundlist):
+            cost /= self.object_factor
+        return cost
+
+    def plan(self, subjectlist, boundlist = set()):
+        """Return the triple patterns of a body in the order to evaluate them.
+        
+        Args:
+            boundlist (set): Placeholder labels bound before the body, such
+                as by 'VALUES' or by the body that encloses an 'OPTIONAL'.
+            subjectlist (dict): Structured data that define a query body.
+        
+        Returns:
+            list of tuples of a subject list that holds a single triple
+            pattern and the estimated number of matches for that pattern.
+        """
+        remaining = self._flatten(subjectlist)
+        bound = set(boundlist)
+        ordered = []
+        while remaining:
+            connected = [pattern for pattern in remaining
+                         if self.variables(pattern) & bound]
+            candidates = connected or remaining
+            costs = [self.estimate(pattern, bound) for pattern in candidates]
+            best = costs.index(min(costs))
+            pattern = candidates[best]
+            remaining.remove(pattern)
+            ordered.append((pattern, costs[best]))
+            bound.update(self.variables(pattern))
+        return ordered
+
+
+def get_executor():
+    """Return the thread pool that sends hedged reads, creating it once.
+    
+    Returns:
+        ThreadPoolExecutor with SPARQL_HEDGE_WORKERS threads.
+    """
+    with _executor_lock:
+        if not _executor:
+            _executor.append(ThreadPoolExecutor(
+                max_workers=app.config['SPARQL_HEDGE_WORKERS']))
+        return _executor[0]
+
+
+class CircuitBreaker(object):
+    """Stop sending requests to an endpoint that is failing.
+    
+    The outcomes of recent requests are kept in a rolling window. A request
+    is bad if it failed, or if it took longer than SPARQL_BREAKER_SLOW
+    seconds. Once at least SPARQL_BREAKER_MIN_CALLS outcomes are known and
+    the share of bad ones reaches SPARQL_BREAKER_THRESHOLD, the breaker opens
+    and allows no requests. After SPARQL_BREAKER_COOLDOWN seconds it is half
+    open and allows a single probe, which closes it if good and opens it again
+    if bad. A probe that never reports is replaced after another cooldown.
+    
+    Attributes:
+        opened (float): Time at which the breaker last opened.
+        state (str): 'closed', 'open', or 'half-open'.
+    """
+
+    def __init__(self, size = 50):
+        """Start closed, with no outcomes.
+        
+        Args:
+            size (int): Number of recent outcomes to keep.
+        """
+        self.state = 'closed'
+        self.opened = 0
+        self._outcomes = deque(maxlen=size)
+        self._probed = 0
+        self._lock = Lock()
+
+    def allow(self):
+        """Return whether a request may be sent now."""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            cooldown = app.config['SPARQL_BREAKER_COOLDOWN']
+            now = time()
+            if now - max(self.opened, self._probed) < cooldown:
+                return False
+            self.state = 'half-open'
+            self._probed = now
+            return True
+
+    def record(self, good, seconds):
+        """Add the outcome of one request and open or close the breaker.
+        
+        Args:
+            good (bool): Whether the endpoint answered the request.
+            seconds (float): Time that the request took.
+        """
+        good = good and seconds <= app.config['SPARQL_BREAKER_SLOW']
+        minimum = app.config['SPARQL_BREAKER_MIN_CALLS']
+        with self._lock:
+            if self.state == 'half-open':
+                if good:
+                    self.state = 'closed'
+                    self._outcomes.clear()
+                else:
+                    self._open()
+            elif self.state == 'closed':
+                self._outcomes.append(good)
+                if len(self._outcomes) < minimum:
+                    return
+                bad = self._outcomes.count(False) / len(self._outcomes)
+                if bad >= app.config['SPARQL_BREAKER_THRESHOLD']:
+                    self._open()
+
+    def _open(self):
+        """Open the breaker, which must be done while holding the lock."""
+        print(__name__, 'circuit opened')
+        self.state = 'open'
+        self.opened = time()
+        self._outcomes.clear()
+
+
+class GroupCommitter(object):
+    """Send the updates of concurrent threads as one update request.
+    
+    The first thread to hand over an update waits up to SPARQL_GROUP_WINDOW
+    seconds, or until SPARQL_GROUP_SIZE updates are waiting, and then sends
+    every waiting update in a single request, with the operations separated
+    by ';' as SPARQL 1.1 Update allows. If the combined request fails, each
+    update is sent again on its own, so that every thread learns whether its
+    own update was accepted. 'INSERT DATA' and 'DELETE DATA' may be repeated
+    without changing the result, so an update that was partly applied before
+    the combined request failed is safe to send again.
+    
+    Attributes:
+        batches (int): Number of requests sent for waiting updates.
+        size (int): Number of waiting updates that ends the window early.
+        updates (int): Number of updates that were handed over.
+        window (float): Most seconds to wait for more updates.
+    """
+
+    def __init__(self, window, size):
+        """Start with no waiting updates.
+        
+        Args:
+            size (int): Number of waiting updates that ends the window early.
+            window (float): Most seconds to wait for more updates.
+        """
+        self.window = window
+        self.size = size
+        self.batches = 0
+        self.updates = 0
+        self._waiting = []
+        self._ready = Condition()
+
+    def commit(self, sparql, queryString):
+        """Send one update along with any others that arrive meanwhile.
+        
+        Args:
+            queryString (str): Complete SPARQL update, including prefixes.
+            sparql (SPARQLER): Connection used if this thread sends the batch.
+        
+        Returns:
+            True if the endpoint accepted the update, False otherwise.
+        """
+        entry = {'update': queryString, 'done': Event(), 'accepted': False}
+        with self._ready:
+            self.updates += 1
+            self._waiting.append(entry)
+            leader = len(self._waiting) == 1
+            if len(self._waiting) >= self.size:
+                self._ready.notify_all()
+            if leader:
+                self._ready.wait_for(
+                    lambda: len(self._waiting) >= self.size, self.window)
+                batch, self._waiting = self._waiting, []
+                self.batches += 1
+        if leader:
+            self._send(sparql, batch)
+        else:
+            entry['done'].wait()
+        return entry['accepted']
+
+    def _send(self, sparql, batch):
+        """Send a batch of updates and tell each thread its own outcome.
+        
+        Args:
+            batch (list): Waiting updates, each a dict with the 'update'
+                string, a 'done' Event, and whether it was 'accepted'.
+            sparql (SPARQLER): Connection over which to send the batch.
+        """
+        try:
+            if len(batch) > 1:
+                print(__name__, 'group commit', len(batch))
+                combined = ' ;\n'.join(entry['update'] for entry in batch)
+                if sparql._send_update(combined):
+                    for entry in batch:
+                        entry['accepted'] = True
+                    return
+            for entry in batch:
+                entry['accepted'] = sparql._send_update(entry['update'])
+        finally:
+            for entry in batch:
+                entry['done'].set()
+
+
+def get_committer():
+    """Return the GroupCommitter shared by this process, creating it once.
+    
+    Returns:
+        GroupCommitter with the configured window and size.
+    """
+    with _committer_lock:
+        if not _committer:
+            _committer.append(GroupCommitter(
+                app.config['SPARQL_GROUP_WINDOW'],
+                app.config['SPARQL_GROUP_SIZE']))
+        return _committer[0]
+
+
+class LatencyTracker(object):
+    """Rolling window of read latencies and their percentiles.
+    
+    Only the most recent latencies are kept, so that the percentiles follow
+    the current behavior of the endpoints.
+    
+    Attributes:
+        min_samples (int): Fewest latencies from which percentiles are given.
+    """
+
+    min_samples = 20
+
+    def __init__(self, size = 1000):
+        """Start with an empty window.
+        
+        Args:
+            size (int): Number of recent latencies to keep.
+        """
+        self._samples = deque(maxlen=size)
+        self._lock = Lock()
+
+    def record(self, seconds):
+        """Add the latency of one read to the window.
+        
+        Args:
+            seconds (float): Time from sending a read to its answer.
+        """
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent):
+        """Return a percentile of the latencies in the window.
+        
+        Args:
+            percent (int): Percentile to return, from 0 to 100.
+        
+        Returns:
+            float latency in seconds, or None if too few were recorded.
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, len(samples) * percent // 100)
+        return samples[index]
+
+    def __len__(self):
+        """Return the number of latencies in the window."""
+        return len(self._samples)
+
+
+class ReplicaPool(object):
+    """Balance read queries across several replicas of the query endpoint.
+    
+    Each read is sent to the healthy replica with the fewest requests from
+    this process still in flight, and ties are broken in turn, so that a slow
+    replica receives less of the load. A replica that cannot be reached is
+    marked down and skipped. While any replica is down, a background thread
+    sends it a trivial 'ASK' query every SPARQL_HEALTH_INTERVAL seconds, and
+    marks it healthy again once it answers.
+    
+    Attributes:
+        endpoints (list): URLs of the query endpoints of every replica.
+        healthy (dict): Whether each replica is accepting queries.
+        interval (int): Seconds between health checks of failed replicas.
+        outstanding (dict): Number of queries in flight to each replica.
+    """
+
+    def __init__(self, endpoints, interval):
+        """Mark every replica healthy and idle.
+        
+        Args:
+            endpoints (list): URLs of the query endpoints of every replica.
+            interval (int): Seconds between health checks of failed replicas.
+        """
+        self.endpoints = list(endpoints)
+        self.interval = interval
+        self.healthy = {endpoint: True for endpoint in self.endpoints}
+        self.outstanding = {endpoint: 0 for endpoint in self.endpoints}
+        self._lock = Lock()
+        self._turn = 0
+        self._checker = None
+
+    def acquire(self, tried = []):
+        """Return the replica that should receive the next read query.
+        
+        Args:
+            tried (list): Replicas that already failed to answer this query.
+        
+        Returns:
+            str URL of the chosen replica, or None if none is available.
+        """
+        with self._lock:
+            self._turn = (self._turn + 1) % len(self.endpoints)
+            order = self.endpoints[self._turn:] + self.endpoints[:self._turn]
+            candidates = [endpoint for endpoint in order
+                          if self.healthy[endpoint] and endpoint not in tried]
+            if not candidates:
+                return None
+            endpoint = min(candidates, key=self.outstanding.get)
+            self.outstanding[endpoint] += 1
+            return endpoint
+
+    def release(self, endpoint, failed = False):
+        """Record that a read query sent to a replica has finished.
+        
+        Args:
+            endpoint (str): URL returned by acquire() for the query.
+            failed (bool): Whether the replica could not be reached.
+        """
+        with self._lock:
+            self.outstanding[endpoint] -= 1
+            if failed:
+                self.healthy[endpoint] = False
+                if self._checker is None or not self._checker.is_alive():
+                    self._checker = Thread(target=self._run_checks,
+                                           name='skmf-health', daemon=True)
+                    self._checker.start()
+
+    def check(self):
+        """Send a trivial query to every replica that is marked down."""
+        with self._lock:
+            down = [endpoint for endpoint in self.endpoints
+                    if not self.healthy[endpoint]]
+        for endpoint in down:
+            probe = SPARQLWrapper(endpoint, returnFormat=JSON)
+            probe.setQuery('ASK {}')
+            probe.setTimeout(self.interval)
+            try:
+                probe.queryAndConvert()
+            except (OSError, EndPointNotFound, EndPointInternalError,
+                    QueryBadFormed) as e:
+                print(__name__, endpoint, str(e))
+                continue
+            with self._lock:
+                self.healthy[endpoint] = True
+
+    def _run_checks(self):
+        """Check the replicas that are down until every one has recovered."""
+        while True:
+            sleep(self.interval)
+            self.check()
+            with self._lock:
+                if all(self.healthy.values()):
+                    return
+
+
+def get_pool():
+    """Return the ReplicaPool shared by this process, creating it once.
+    
+    A new pool is created whenever SPARQL_REPLICAS has changed.
+    
+    Returns:
+        ReplicaPool of the endpoints in SPARQL_REPLICAS, or None if no
+        replicas are configured.
+    """
+    replicas = list(app.config['SPARQL_REPLICAS'])
+    if not replicas:
+        return None
+    with _pool_lock:
+        if not _pool or _pool[0].endpoints != replicas:
+            _pool[:] = [ReplicaPool(replicas,
+                                    app.config['SPARQL_HEALTH_INTERVAL'])]
+        return _pool[0]
 
 
 class SPARQLER(SPARQLWrapper):
@@ -26,8 +863,82 @@ class SPARQLER(SPARQLWrapper):
     new query and update methods try to be as generic and dynamic as possible
     to allow for the creation of queries from an unknown set of conditions.
     Many SPARQL features, such as functions, are not yet implemented.
+    
+    Every UPDATE that the endpoint accepts advances the change generation of
+    the named graph it touched. Generations are kept at the class level, since
+    a new SPARQLER is created for each Flask request, and only count changes
+    made through this process. The boot token distinguishes the generations of
+    one process from those of another, or of an earlier run.
+    
+    When SPARQL_PLANNER is set in the configuration, the triple patterns of
+    every query body are ordered by a Planner before they are formatted. The
+    order that was chosen is printed along with each query and kept in the
+    'last_plan' attribute for debugging.
+    
+    When replicas are configured, each read query is sent to one of them by
+    the shared ReplicaPool, and is sent to the next if a replica cannot be
+    reached. A replica may lag behind the primary, so for SPARQL_STICKY
+    seconds after an accepted UPDATE, every read is sent to the primary query
+    endpoint instead, so that a writer always reads its own changes.
+    
+    A read whose query is identical to one already in flight in this process
+    is not sent again. It waits for the same result instead, and the number
+    of reads that were coalesced in this way is kept in 'coalesced'.
+    
+    Every request passes through the shared CircuitBreaker. The last good
+    result of recent reads is kept, keyed by query, so that while the breaker
+    is open or the endpoint fails, a read can return that result instead, and
+    mark the connection 'stale'.
+    
+    Every read is given up once its deadline passes. When SPARQL_HEDGE is set
+    and a read to a replica has not answered by the rolling 95th percentile of
+    single attempts, a duplicate is sent to another replica and the first
+    answer wins. The latency of the first attempt alone is kept in 'attempts'
+    and the latency that callers saw is kept in 'answered', so the effect of
+    hedging on tail latency can be compared.
+    
+    When a Backend is set in 'backend', every query and update is handed to
+    it as structured data instead, and no request is sent to the endpoint.
+    
+    Attributes:
+        answered (LatencyTracker): Latencies of reads as seen by callers.
+        attempts (LatencyTracker): Latencies of the first attempt of reads.
+        backend (Backend): Answers queries and updates in place of the
+            endpoint, or None to send them to the endpoint.
+        boot (str): Random token that identifies this run of the process.
+        breaker (CircuitBreaker): Guards the endpoint for every connection.
+        coalesced (int): Number of reads that waited for an identical read
+            already in flight instead of sending their own.
+        deadline (float): Time by which every read must have answered, or
+            None if the request has no time budget.
+        generations (dict): Count of accepted UPDATEs for each named graph.
+        hedges (int): Number of reads that were sent to a second replica.
+        last_plan (list): Patterns and estimated costs of the last planned
+            query, in the order they were written.
+        modified (dict): Time of the last accepted UPDATE for each graph.
+        planner (Planner): Orders the triple patterns of query bodies.
+        primary (str): URL of the query endpoint of the primary triplestore.
+        stale (bool): Whether any read returned its last good result.
+        started (float): Time at which this process loaded the module.
+        sticky_until (float): Time until which reads go to the primary.
     """
 
+    answered = LatencyTracker()
+    attempts = LatencyTracker()
+    boot = uuid4().hex
+    breaker = CircuitBreaker()
+    coalesced = 0
+    generations = {}
+    hedges = 0
+    modified = {}
+    started = time()
+    _generation_lock = Lock()
+    _flights = {}
+    _flights_lock = Lock()
+    _graph_stores = {}
+    _last_good = OrderedDict()
+    _last_good_lock = Lock()
+
     def __init__(self, endpoint, updateEndpoint=None,
                  returnFormat=JSON, defaultGraph=None):
         """Create a SPARQLWrapper object, ensuring the JSON return format.
@@ -40,6 +951,13 @@ class SPARQLER(SPARQLWrapper):
         """
         super().__init__(endpoint=endpoint, updateEndpoint=updateEndpoint,
                          returnFormat=returnFormat, defaultGraph=defaultGraph)
+        self.backend = None
+        self.planner = Planner()
+        self.last_plan = []
+        self.primary = endpoint
+        self.sticky_until = 0
+        self.deadline = None
+        self.stale = False
 
     def _set_graphs(self, graphlist = set()):
         """Return a string for the full 'FROM' section of a SPARQL query.
@@ -55,56 +973,103 @@ class SPARQLER(SPARQLWrapper):
         Returns:
             String of 'FROM' lines for a SPARQL query.
         """
-        namespace = app.config['NAMESPACE']
         graphs = []
         for graph in graphlist:
-            if graph == '':
-                graphuri = namespace
-            else:
-                graphuri = '{}/{}'.format(namespace, graph)
-            graphs.append('FROM <{}>'.format(graphuri))
+            graphs.append('FROM <{}>'.format(self._graph_uri(graph)))
         return '\n        '.join(graphs)
 
-    def _set_labels(self, labellist = set()):
+    def _graph_uri(self, name):
+        """Return the URI of a graph, given its name.
+        
+        Args:
+            name (str): Name of the graph, as accepted by _set_graphs().
+        
+        Returns:
+            String of the full URI of the graph.
+        """
+        namespace = app.config['NAMESPACE']
+        if not name:
+            return namespace
+        return '{}/{}'.format(namespace, name)
+
+    def _set_labels(self, labellist = set(), exprlist = {}):
         """Return the header string for a SPARQL query.
         
         If no labels are provided, the wildcard '*' is assumed. Otherwise, each
         label is prepended with '?' and the list is separated by spaces before
-        it is returned.
+        it is returned. Each entry of the expression list adds a computed label
+        to the header, in the form '(<expression> AS ?<label>)'.
         
         Args:
+            exprlist (dict): Expressions to compute, keyed by result label.
             labellist (list): Header labels for query placeholders.
         
         Returns:
             String of header labels for a SPARQL query.
         """
-        if not labellist:
+        if not labellist and not exprlist:
             labels = '*'
         else:
             labels = []
             for label in labellist:
                 labels.append('?{}'.format(label))
+            for label in exprlist:
+                expression = self._format_expression(exprlist[label])
+                labels.append('({} AS ?{})'.format(expression, label))
         return ' '.join(labels)
 
-    def _format_body(self, subjectlist = {}):
+    def _format_body(self, subjectlist = {}, boundlist = None):
         """Format text for the body of a SPARQL query from the given subjects.
         
         Most of the work is done by a nested method. At this level, a period is
         placed at the end of each line and a newline is added to all but the
-        last body line.
+        last body line. If a list of bound labels is provided and the
+        SPARQL_PLANNER option is set, the body is a pattern to match rather
+        than data to write, so each triple pattern is written on its own line
+        in the order chosen by the planner.
+        
+        Args:
+            boundlist (set): Placeholder labels bound before the body, or None
+                to keep the order of the subject list.
+            subjectlist (dict): Triples that form the content of a query.
+        
+        Returns:
+            String containing the body for a SPARQL query, or None if any part
+            of it cannot be formatted.
+        """
+        if boundlist is not None and app.config['SPARQL_PLANNER']:
+            body = []
+            for pattern, cost in self.planner.plan(subjectlist, boundlist):
+                sentences = self._format_sentences(pattern)
+                if sentences is None:
+                    return None
+                body.append(sentences[0])
+                self.last_plan.append((sentences[0], cost))
+            print(__name__, 'plan', body)
+        else:
+            body = self._format_sentences(subjectlist)
+            if body is None:
+                return None
+        return '\n          '.join(body)
+
+    def _format_sentences(self, subjectlist):
+        """Format one sentence of a query body for each of the given subjects.
         
         Args:
             subjectlist (dict): Triples that form the content of a query.
         
         Returns:
-            String containing the body for a SPARQL query.
+            list of strings, each a complete sentence ending with a period,
+            or None if any subject cannot be formatted.
         """
         body = []
         for subject in subjectlist:
             sentence = self._format_subject(subject, subjectlist[subject])
+            if sentence is None:
+                return None
             # period marks the end of a single subject match
             body.append('{} .'.format(sentence))
-        return '\n          '.join(body)
+        return body
 
     def _format_subject(self, subject, predlist = {}):
         """Format all text for one subject of a SPARQL query.
@@ -129,6 +1094,8 @@ class SPARQLER(SPARQLWrapper):
             for predicate in predlist['value']:
                 clause = self._format_predicate(predicate,
                                                 predlist['value'][predicate])
+                if clause is None:
+                    return None
                 body.append(clause)
         except KeyError as e:
             print(__name__, str(e))
@@ -142,19 +1109,21 @@ class SPARQLER(SPARQLWrapper):
     def _format_predicate(self, predicate, objectlist = {}):
         """Format all text for one predicate of a SPARQL query.
         
-        The predicate may be represented as an URI, a label, or a prefixed
-        name. A prefixed name does not require any formatting, but it does
-        depend on the presence of the corresponding prefix in the final query
-        string. The object list must contain the 'type' key to indicate which
-        formatting option is used. The 'value' key should point to the actual
-        data to pass to the next formatting method.
+        The predicate may be represented as an URI, a label, a prefixed name,
+        or a property path. A prefixed name does not require any formatting,
+        but it does depend on the presence of the corresponding prefix in the
+        final query string. A property path is checked by format_path(). The
+        object list must contain the 'type' key to indicate which formatting
+        option is used. The 'value' key should point to the actual data to pass
+        to the next formatting method.
         
         Args:
             objectlist (dict): Objects associated with a subject and predicate.
             predicate (str): URI, label, or prefixed name of a predicate.
         
         Returns:
-            String of a SPARQL statement from just after the subject.
+            String of a SPARQL statement from just after the subject, or None
+            if the predicate is a property path that is not valid.
         """
         body = []
         padding = ' ,\n              '
@@ -170,6 +1139,11 @@ class SPARQLER(SPARQLWrapper):
             return '<{}> {}'.format(predicate, padding.join(body))
         elif objectlist['type'] == 'label':
             return '?{} {}'.format(predicate, padding.join(body))
+        elif objectlist['type'] == 'path':
+            path = format_path(predicate)
+            if path is None:
+                return None
+            return '{} {}'.format(path, padding.join(body))
         return '{} {}'.format(predicate, padding.join(body))
 
     def _format_object(self, rdfobject = {}):
@@ -209,7 +1183,7 @@ class SPARQLER(SPARQLWrapper):
             return None
         return ''.join(body)
 
-    def _format_optional(self, optlist = []):
+    def _format_optional(self, optlist = [], boundlist = None):
         """Format a query body section prefixed with the keyword 'OPTIONAL'.
         
         The use of 'OPTIONAL' allows extra information to be pulled from a
@@ -219,59 +1193,633 @@ class SPARQLER(SPARQLWrapper):
         the query, so long as that property is present.
         
         Args:
+            boundlist (set): Placeholder labels bound by the enclosing body, or
+                None to keep the order of each optional body.
             optlist (list): dicts forming full query bodies.
         
         Returns:
-            String of a SPARQL 'OPTIONAL' statement.
+            String of a SPARQL 'OPTIONAL' statement, or None if any optional
+            body cannot be formatted.
         """
         padding = '\n          '
         optionals = []
         for optional in optlist:
-            body = self._format_body(optional)
+            body = self._format_body(optional, boundlist)
+            if body is None:
+                return None
             optionals.append('OPTIONAL {{ {body} }}'.format(body=body))
         return padding.join(optionals)
 
-    def query_general(self, graphlist = {''}, labellist = set(),
-                      subjectlist = {}, optlist = []):
-        """Return the results of an arbitrarily complex 'SELECT' query.
+    def _format_expression(self, expression = {}):
+        """Format the text for one expression of a SPARQL query.
         
-        A boilerplate is provided for a SPARQL 'SELECT' query. The formatting
-        is performed by helper methods, one for each of the main sections.
-        EVENTUALLY, this method will be generalized enough to allow most SPARQL
-        query types.
+        An expression is a dict in the same format as an RDF object, with two
+        additional types. A 'function' applies the function named by 'value',
+        such as 'isIRI', 'langMatches', 'regex', or 'COALESCE', to the list of
+        expressions in 'args'. An aggregate function, such as 'COUNT', may
+        also set 'distinct' to True to ignore duplicate arguments. An
+        'operator' joins the expressions in 'args' with the operator in
+        'value', such as '=', '<', '&&', or '||', or prefixes a single argument
+        with it, as for '!'. Any other type is formatted as an RDF object, so
+        labels, URIs, and literals may appear as arguments.
         
         Args:
-            graphlist (set): Named graphs in which to scope the query.
-            labellist (set): Header labels for the query results.
-            optlist (list): dicts forming full query bodies.
-            subjectlist (dict): Structured data that define the query.
+            expression (dict): Structured data that define the expression.
         
         Returns:
-            JSON object containing SPARQL query results.
+            String of a SPARQL expression.
         """
-        prefix = app.config['PREFIXES']
-        graphs = self._set_graphs(graphlist)
-        labels = self._set_labels(labellist)
-        body = self._format_body(subjectlist)
-        optional = self._format_optional(optlist)
-        queryString = """
-        {prefix}
-        SELECT DISTINCT {labels}
-        {graphs}
-        WHERE {{
-          {body}
+        try:
+            if expression['type'] == 'function':
+                args = [self._format_expression(arg)
+                        for arg in expression['args']]
+                distinct = 'DISTINCT ' if expression.get('distinct') else ''
+                return '{}({}{})'.format(expression['value'], distinct,
+                                         ', '.join(args))
+            elif expression['type'] == 'operator':
+                args = [self._format_expression(arg)
+                        for arg in expression['args']]
+                if len(args) == 1:
+                    return '({}{})'.format(expression['value'], args[0])
+                operator = ' {} '.format(expression['value'])
+                return '({})'.format(operator.join(args))
+        except KeyError as e:
+            print(__name__, str(e))
+            return None
+        return self._format_object(expression)
+
+    def _format_filters(self, filterlist = []):
+        """Format the 'FILTER' constraints of a SPARQL query body.
+        
+        Each entry of the filter list is an expression, as accepted by
+        _format_expression(), that must hold for a result to be returned.
+        
+        Args:
+            filterlist (list): Expressions that restrict the query results.
+        
+        Returns:
+            String of 'FILTER' lines for the body of a SPARQL query.
+        """
+        padding = '\n          '
+        filters = []
+        for expression in filterlist:
+            filters.append('FILTER ({})'.format(
+                self._format_expression(expression)))
+        return padding.join(filters)
+
+    def _format_values(self, valuelist = {}):
+        """Format inline 'VALUES' data that binds placeholders in a query.
+        
+        Each placeholder label in the value list is paired with the list of RDF
+        objects it may be bound to, in the same format that is accepted by
+        _format_object(). One 'VALUES' block is produced for each label, so a
+        single query can be answered for many known subjects at once.
+        
+        Args:
+            valuelist (dict): Lists of RDF objects, keyed by placeholder label.
+        
+        Returns:
+            String of 'VALUES' blocks for the body of a SPARQL query.
+        """
+        padding = '\n          '
+        blocks = []
+        for label in valuelist:
+            words = []
+            for rdfobject in valuelist[label]:
+                words.append(self._format_object(rdfobject))
+            blocks.append('VALUES ?{} {{ {} }}'.format(label, ' '.join(words)))
+        return padding.join(blocks)
+
+    def _set_modifiers(self, limit = None, offset = None, orderlist = [],
+                       grouplist = []):
+        """Return the solution modifiers that follow the 'WHERE' section.
+        
+        'GROUP BY', 'ORDER BY', 'LIMIT', and 'OFFSET' are currently supported.
+        Each one is left out of the query if it is not provided, in which case
+        the endpoint is expected to return every result, starting with the
+        first, in no particular order. Each entry of the order list is an
+        expression, as accepted by _format_expression(), with an optional
+        'order' key that holds either 'ASC' or 'DESC'.
+        
+        Args:
+            grouplist (list): Labels by which to group results for aggregates.
+            limit (int): Maximum number of results to return.
+            offset (int): Number of results to skip before the first returned.
+            orderlist (list): Expressions by which to sort the results.
+        
+        Returns:
+            String of solution modifiers for a SPARQL query.
+        """
+        modifiers = []
+        if grouplist:
+            groups = ['?{}'.format(label) for label in grouplist]
+            modifiers.append('GROUP BY {}'.format(' '.join(groups)))
+        if orderlist:
+            keys = []
+            for key in orderlist:
+                expression = self._format_expression(key)
+                if key.get('order') in ('ASC', 'DESC'):
+                    expression = '{}({})'.format(key['order'], expression)
+                keys.append(expression)
+            modifiers.append('ORDER BY {}'.format(' '.join(keys)))
+        if limit is not None:
+            modifiers.append('LIMIT {:d}'.format(limit))
+        if offset:
+            modifiers.append('OFFSET {:d}'.format(offset))
+        return ' '.join(modifiers)
+
+    def _format_select(self, graphs = '', labellist = set(), subjectlist = {},
+                       optlist = [], limit = None, offset = None,
+                       valuelist = {}, filterlist = [], orderlist = [],
+                       exprlist = {}, grouplist = []):
+        """Format a complete 'SELECT' query, apart from its prefixes.
+        
+        This is shared by query_general() and by queries that nest a 'SELECT'
+        within another query, in which case the 'FROM' section must be left
+        empty, since only the outermost query may hold one.
+        
+        Args:
+            exprlist (dict): Expressions to compute, keyed by result label.
+            filterlist (list): Expressions that restrict the query results.
+            graphs (str): 'FROM' section, as returned by _set_graphs().
+            grouplist (list): Labels by which to group results for aggregates.
+            labellist (set): Header labels for the query results.
+            limit (int): Maximum number of results to return, if provided.
+            offset (int): Number of results to skip, if provided.
+            optlist (list): dicts forming full query bodies.
+            orderlist (list): Expressions by which to sort the results.
+            subjectlist (dict): Structured data that define the query.
+            valuelist (dict): RDF objects to bind to placeholder labels.
+        
+        Returns:
+            String of a SPARQL 'SELECT' query without prefixes, or None if its
+            body cannot be formatted.
+        """
+        self.last_plan = []
+        labels = self._set_labels(labellist, exprlist)
+        values = self._format_values(valuelist)
+        bound = set(valuelist)
+        body = self._format_body(subjectlist, bound)
+        bound.update(self.planner.variables(subjectlist))
+        optional = self._format_optional(optlist, bound)
+        if body is None or optional is None:
+            return None
+        filters = self._format_filters(filterlist)
+        modifiers = self._set_modifiers(limit, offset, orderlist, grouplist)
+        return """
+        SELECT DISTINCT {labels}
+        {graphs}
+        WHERE {{
+          {values}
+          {body}
           {optional}
+          {filters}
         }}
-        """.format(prefix=prefix, labels=labels, graphs=graphs, body=body, optional=optional)
+        {modifiers}
+        """.format(labels=labels, graphs=graphs, values=values, body=body,
+                   optional=optional, filters=filters, modifiers=modifiers)
+
+    def _run_query(self, queryString, convert = None):
+        """Send a query to the endpoint and return its converted results.
+        
+        Args:
+            convert (function): Applied to the results before they are
+                returned, if provided.
+            queryString (str): Complete SPARQL query, including prefixes.
+        
+        Returns:
+            JSON object containing SPARQL query results, or None on error.
+        """
         self.setQuery(queryString)
         print(queryString)
+        # a connection that must read its own writes may not share a replica
+        key = (queryString, time() < self.sticky_until)
+        with SPARQLER._flights_lock:
+            flight = SPARQLER._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = {'done': Event(), 'result': None, 'stale': False,
+                          'followers': 0}
+                SPARQLER._flights[key] = flight
+            else:
+                flight['followers'] += 1
+                SPARQLER.coalesced += 1
+        if leader:
+            try:
+                flight['result'], flight['stale'] = self._send_query(
+                    queryString)
+            finally:
+                with SPARQLER._flights_lock:
+                    del SPARQLER._flights[key]
+                flight['done'].set()
+            result = flight['result']
+            # no follower can join once the flight is gone
+            if flight['followers']:
+                result = deepcopy(result)
+        else:
+            print(__name__, 'coalesced')
+            if not flight['done'].wait(max(0, self._time_left())):
+                print(__name__, 'deadline passed')
+                return None
+            # each caller may change its results, so followers get a copy
+            result = deepcopy(flight['result'])
+        if result is None:
+            return None
+        self.stale = self.stale or flight['stale']
+        return convert(result) if convert else result
+
+    def _send_query(self, queryString):
+        """Send the current query, unless the circuit breaker is open.
+        
+        A read that fails is answered with its last good result, if one is
+        kept, but a read whose deadline passed is answered with None, and is
+        not counted against the endpoint.
+        
+        Args:
+            queryString (str): Complete SPARQL query, including prefixes.
+        
+        Returns:
+            Tuple of the JSON object containing SPARQL query results, or None
+            on error, and whether that is the last good result of the query
+            rather than a new one.
+        """
+        if not SPARQLER.breaker.allow():
+            print(__name__, 'circuit open')
+            return self._stale_result(queryString)
+        started = time()
+        try:
+            result = self._fetch()
+        except QueryBadFormed as e:
+            print(__name__, str(e))
+            SPARQLER.breaker.record(True, time() - started)
+            return None, False
+        except socket.timeout as e:
+            # the request ran out of time, which says nothing of the endpoint
+            print(__name__, str(e))
+            return None, False
+        except (OSError, EndPointNotFound, EndPointInternalError) as e:
+            print(__name__, str(e))
+            SPARQLER.breaker.record(False, time() - started)
+            return self._stale_result(queryString)
+        self._good_result(queryString, result, time() - started)
+        return result, False
+
+    def _fetch(self):
+        """Send the current query to each endpoint in turn until one answers.
+        
+        Returns:
+            JSON object containing SPARQL query results.
+        
+        Raises:
+            socket.timeout: if the deadline passed before any answer.
+            OSError: or a SPARQLWrapper exception, if the last endpoint that
+                was tried failed to answer.
+        """
+        tried = []
+        error = None
+        while True:
+            timeout = self._time_left()
+            if timeout <= 0:
+                raise socket.timeout('deadline passed')
+            endpoint, pool = self._choose_endpoint(tried)
+            if endpoint is None:
+                raise error
+            try:
+                return self._read(endpoint, pool, tried, timeout)
+            except socket.timeout:
+                raise
+            except (OSError, EndPointNotFound) as e:
+                if pool is None:
+                    raise
+                print(__name__, endpoint, str(e))
+                tried.append(endpoint)
+                error = e
+
+    def _good_result(self, queryString, result, seconds):
+        """Record a read that was answered and keep its result.
+        
+        Args:
+            queryString (str): Complete SPARQL query, including prefixes.
+            result (dict): JSON object containing SPARQL query results.
+            seconds (float): Time that the read took to answer.
+        """
+        SPARQLER.breaker.record(True, seconds)
+        SPARQLER.answered.record(seconds)
+        # the caller may change its results, so the cache keeps a copy
+        result = deepcopy(result)
+        with SPARQLER._last_good_lock:
+            SPARQLER._last_good[queryString] = result
+            SPARQLER._last_good.move_to_end(queryString)
+            while (len(SPARQLER._last_good) >
+                   app.config['SPARQL_STALE_CACHE_SIZE']):
+                SPARQLER._last_good.popitem(last=False)
+
+    def _stale_result(self, queryString):
+        """Return the last good result of a read that could not be sent.
+        
+        Args:
+            queryString (str): Complete SPARQL query, including prefixes.
+        
+        Returns:
+            Tuple of the JSON object containing SPARQL query results, or None
+            if no good result of the query was kept, and whether a result was
+            found.
+        """
+        with SPARQLER._last_good_lock:
+            result = SPARQLER._last_good.get(queryString)
+        return deepcopy(result), result is not None
+
+    def _time_left(self):
+        """Return the seconds left for the next read to answer.
+        
+        Returns:
+            float seconds until the sooner of the request deadline and the
+            end of SPARQL_QUERY_TIMEOUT.
+        """
+        timeout = app.config['SPARQL_QUERY_TIMEOUT']
+        if self.deadline is not None:
+            timeout = min(timeout, self.deadline - time())
+        return timeout
+
+    def _attempt(self, endpoint, pool, timeout, first = True):
+        """Send the current query to one endpoint and wait for its answer.
+        
+        The query is sent from a copy of this connection, so that a hedged
+        duplicate may be sent from another thread at the same time.
+        
+        Args:
+            endpoint (str): URL of the query endpoint to send the query to.
+            first (bool): Whether this is the first attempt of the read.
+            pool (ReplicaPool): Pool that chose the endpoint, or None.
+            timeout (float): Seconds to wait for the answer.
+        
+        Returns:
+            JSON object containing SPARQL query results.
+        """
+        request = copy(self)
+        request.endpoint = endpoint
+        request.timeout = timeout
+        started = time()
+        failed = False
+        try:
+            result = request.queryAndConvert()
+        except socket.timeout:
+            raise
+        except (OSError, EndPointNotFound):
+            failed = True
+            raise
+        finally:
+            if pool is not None:
+                pool.release(endpoint, failed)
+        if first:
+            SPARQLER.attempts.record(time() - started)
+        return result
+
+    def _read(self, endpoint, pool, tried, timeout):
+        """Send a read to one endpoint, and to another if it is slow.
+        
+        A duplicate is only sent when SPARQL_HEDGE is set, the endpoint was
+        chosen by a pool that has another healthy replica, and enough reads
+        were recorded to know the 95th percentile of their latency.
+        
+        Args:
+            endpoint (str): URL of the query endpoint chosen for the read.
+            pool (ReplicaPool): Pool that chose the endpoint, or None.
+            timeout (float): Seconds to wait for an answer.
+            tried (list): Endpoints that already failed to answer this query.
+        
+        Returns:
+            JSON object containing SPARQL query results.
+        """
+        delay = SPARQLER.attempts.percentile(95)
+        if (pool is None or delay is None or delay >= timeout or
+                not app.config['SPARQL_HEDGE']):
+            return self._attempt(endpoint, pool, timeout)
+        deadline = time() + timeout
+        executor = get_executor()
+        futures = [executor.submit(self._attempt, endpoint, pool, timeout)]
+        done, pending = wait(futures, delay)
+        if not done:
+            other = pool.acquire(tried + [endpoint])
+            if other is not None:
+                SPARQLER.hedges += 1
+                print(__name__, 'hedge', endpoint, other)
+                futures.append(executor.submit(self._attempt, other, pool,
+                                               deadline - time(), False))
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, max(0, deadline - time()),
+                                 FIRST_COMPLETED)
+            if not done:
+                raise socket.timeout('hedged read timed out')
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    @classmethod
+    def latency_report(cls):
+        """Return percentiles of read latency, with and without hedging.
+        
+        Returns:
+            dict holding the number of 'hedges' sent, the number of reads
+            that were 'coalesced', and the 'attempts' and 'answered'
+            latencies, each a dict of seconds keyed by 'p50', 'p95', and
+            'p99', along with the number of 'samples'.
+        """
+        report = {'hedges': cls.hedges, 'coalesced': cls.coalesced}
+        for name in ('attempts', 'answered'):
+            tracker = getattr(cls, name)
+            report[name] = {'p{:d}'.format(percent):
+                            tracker.percentile(percent)
+                            for percent in (50, 95, 99)}
+            report[name]['samples'] = len(tracker)
+        return report
+
+    def _choose_endpoint(self, tried = []):
+        """Return the query endpoint that should receive the next read.
+        
+        A replica is chosen by the shared ReplicaPool, unless none is
+        configured or this connection has written recently, in which case the
+        primary query endpoint is used. The primary is also used once every
+        replica has failed.
+        
+        Args:
+            tried (list): Endpoints that already failed to answer this query.
+        
+        Returns:
+            Tuple of the endpoint URL, or None if every endpoint has failed,
+            and the ReplicaPool that must be told when the query finishes, or
+            None if the endpoint was not chosen by a pool.
+        """
+        pool = get_pool()
+        if pool is not None and time() >= self.sticky_until:
+            endpoint = pool.acquire(tried)
+            if endpoint is not None:
+                return endpoint, pool
+        if self.primary in tried:
+            return None, None
+        return self.primary, None
+
+    def _count_result(self, result):
+        """Return the count held by the results of a counting query.
+        
+        Args:
+            result (dict): JSON object containing SPARQL query results.
+        
+        Returns:
+            int count of query results, or None on error.
+        """
+        try:
+            return int(result['results']['bindings'][0]['count']['value'])
+        except (IndexError, KeyError, TypeError, ValueError) as e:
+            print(__name__, str(e))
+            return None
+
+    def _boolean_result(self, result):
+        """Return the answer held by the results of an 'ASK' query.
+        
+        Args:
+            result (dict): JSON object containing SPARQL query results.
+        
+        Returns:
+            True or False as answered by the endpoint, or None on error.
+        """
         try:
-            return self.queryAndConvert()
-        except (EndPointNotFound, QueryBadFormed, EndPointInternalError) as e:
+            return result['boolean']
+        except (KeyError, TypeError) as e:
             print(__name__, str(e))
             return None
 
-    def query_subject(self, id, type = 'uri', graphlist = {''}):
+    def query_general(self, graphlist = {''}, labellist = set(),
+                      subjectlist = {}, optlist = [],
+                      limit = None, offset = None, valuelist = {},
+                      filterlist = [], orderlist = [], exprlist = {},
+                      grouplist = []):
+        """Return the results of an arbitrarily complex 'SELECT' query.
+        
+        A boilerplate is provided for a SPARQL 'SELECT' query. The formatting
+        is performed by helper methods, one for each of the main sections.
+        EVENTUALLY, this method will be generalized enough to allow most SPARQL
+        query types. Filters, computed labels, and sort order are evaluated by
+        the endpoint, so results need no further processing by the caller.
+        Aggregates, such as 'COUNT', are computed labels whose results are
+        grouped by the labels in the group list.
+        
+        Args:
+            exprlist (dict): Expressions to compute, keyed by result label.
+            filterlist (list): Expressions that restrict the query results.
+            graphlist (set): Named graphs in which to scope the query.
+            grouplist (list): Labels by which to group results for aggregates.
+            labellist (set): Header labels for the query results.
+            limit (int): Maximum number of results to return, if provided.
+            offset (int): Number of results to skip, if provided.
+            optlist (list): dicts forming full query bodies.
+            orderlist (list): Expressions by which to sort the results.
+            subjectlist (dict): Structured data that define the query.
+            valuelist (dict): RDF objects to bind to placeholder labels.
+        
+        Returns:
+            JSON object containing SPARQL query results, or None on error.
+        """
+        if self.backend is not None:
+            return self.backend.select(graphlist, labellist, subjectlist,
+                                       optlist, limit, offset, valuelist,
+                                       filterlist, orderlist, exprlist,
+                                       grouplist)
+        prefix = app.config['PREFIXES']
+        graphs = self._set_graphs(graphlist)
+        select = self._format_select(graphs, labellist, subjectlist, optlist,
+                                     limit, offset, valuelist, filterlist,
+                                     orderlist, exprlist, grouplist)
+        if select is None:
+            return None
+        queryString = """
+        {prefix}
+        {select}
+        """.format(prefix=prefix, select=select)
+        return self._run_query(queryString)
+
+    def query_count(self, graphlist = {''}, labellist = set(),
+                    subjectlist = {}, optlist = [], valuelist = {},
+                    filterlist = []):
+        """Return the number of results that a 'SELECT' query would return.
+        
+        The query is formed as it would be by query_general() and nested in a
+        'SELECT' that only counts its results, so the results themselves are
+        never transferred from the endpoint.
+        
+        Args:
+            filterlist (list): Expressions that restrict the query results.
+            graphlist (set): Named graphs in which to scope the query.
+            labellist (set): Header labels for the query results.
+            optlist (list): dicts forming full query bodies.
+            subjectlist (dict): Structured data that define the query.
+            valuelist (dict): RDF objects to bind to placeholder labels.
+        
+        Returns:
+            int count of query results, or None on error.
+        """
+        if self.backend is not None:
+            return self.backend.count(graphlist, labellist, subjectlist,
+                                      optlist, valuelist, filterlist)
+        prefix = app.config['PREFIXES']
+        graphs = self._set_graphs(graphlist)
+        select = self._format_select(labellist=labellist,
+                                     subjectlist=subjectlist, optlist=optlist,
+                                     valuelist=valuelist,
+                                     filterlist=filterlist)
+        if select is None:
+            return None
+        queryString = """
+        {prefix}
+        SELECT (COUNT(*) AS ?count)
+        {graphs}
+        WHERE {{
+          {{ {select} }}
+        }}
+        """.format(prefix=prefix, graphs=graphs, select=select)
+        return self._run_query(queryString, self._count_result)
+
+    def ask(self, graphlist = {''}, subjectlist = {}, valuelist = {}):
+        """Return whether an 'ASK' query finds any match in the triplestore.
+        
+        The body of the query is formed in the same way as for a 'SELECT', but
+        the endpoint only answers whether a solution exists, so no triples are
+        transferred. This is the preferred way to test for existence.
+        
+        Args:
+            graphlist (set): Named graphs in which to scope the query.
+            subjectlist (dict): Structured data that define the query.
+            valuelist (dict): RDF objects to bind to placeholder labels.
+        
+        Returns:
+            True or False as answered by the endpoint, or None on error.
+        """
+        if self.backend is not None:
+            return self.backend.ask(graphlist, subjectlist, valuelist)
+        prefix = app.config['PREFIXES']
+        graphs = self._set_graphs(graphlist)
+        self.last_plan = []
+        values = self._format_values(valuelist)
+        body = self._format_body(subjectlist, set(valuelist))
+        if body is None:
+            return None
+        queryString = """
+        {prefix}
+        ASK
+        {graphs}
+        WHERE {{
+          {values}
+          {body}
+        }}
+        """.format(prefix=prefix, graphs=graphs, values=values, body=body)
+        return self._run_query(queryString, self._boolean_result)
+
+    def query_subject(self, id, type = 'uri', graphlist = {''},
+                      limit = None, offset = None, orderlist = []):
         """Return all predicates and objects of the subject having id.
         
         Primarily used to initialize a Subject from the 'resource' module. The
@@ -282,6 +1830,10 @@ class SPARQLER(SPARQLWrapper):
         Args:
             graphlist (set): Named graphs in which to scope the query.
             id (str): URI or prefixed name to identify the query subject.
+            limit (int): Maximum number of predicate-object pairs to return.
+            offset (int): Number of predicate-object pairs to skip.
+            orderlist (list): Expressions by which to sort the pairs, which
+                is needed for pages of them to be stable.
             type (str): Should be 'uri' or 'pfx' for prefixed name.
         
         Returns:
@@ -291,7 +1843,225 @@ class SPARQLER(SPARQLWrapper):
         predicate = {'p': {'type': 'label', 'value': [rdfobject]}}
         subject = {id: {'type': type, 'value': predicate}}
         labels = {'p', 'o'}
-        return self.query_general(graphlist, labels, subject)
+        return self.query_general(graphlist, labels, subject,
+                                  limit=limit, offset=offset,
+                                  orderlist=orderlist)
+
+    def query_subjects(self, idlist, graphlist = {''}):
+        """Return all predicates and objects of several subjects at once.
+        
+        The subjects are bound through a single 'VALUES' block, so that any
+        number of them is retrieved in one round trip to the endpoint. The 's'
+        label of each result identifies the subject to which its predicate and
+        object belong.
+        
+        Args:
+            graphlist (set): Named graphs in which to scope the query.
+            idlist (list): URIs that identify the query subjects.
+        
+        Returns:
+            Result of SPARQL query for subjects, predicates, and objects.
+        """
+        rdfobject = {'type': 'label', 'value': 'o'}
+        predicate = {'p': {'type': 'label', 'value': [rdfobject]}}
+        subject = {'s': {'type': 'label', 'value': predicate}}
+        labels = {'s', 'p', 'o'}
+        values = {'s': [{'type': 'uri', 'value': id} for id in idlist]}
+        return self.query_general(graphlist, labels, subject,
+                                  valuelist=values)
+
+    def construct(self, graphlist = {''}, templatelist = {}, subjectlist = {},
+                  valuelist = {}, limit = None, offset = None):
+        """Return the triples formed by a 'CONSTRUCT' query.
+        
+        The endpoint is asked to answer in N-Triples, which is parsed into
+        triples of RDF terms, so no table of results is formed and decoded.
+        The read is sent in the same way as any other query, so replicas,
+        deadlines, coalescing, and stale results all apply.
+        
+        Args:
+            graphlist (set): Named graphs in which to scope the query.
+            limit (int): Maximum number of solutions to use, if provided.
+            offset (int): Number of solutions to skip, if provided.
+            subjectlist (dict): Structured data that define the pattern.
+            templatelist (dict): Structured data that define the triples to
+                form from each solution, or nothing to form the pattern.
+            valuelist (dict): RDF objects to bind to placeholder labels.
+        
+        Returns:
+            list of (subject, predicate, object) tuples of RDF terms in the
+            JSON format of SPARQL query results, or None on error.
+        """
+        if self.backend is not None:
+            return self.backend.construct(graphlist, templatelist,
+                                          subjectlist, valuelist, limit,
+                                          offset)
+        prefix = app.config['PREFIXES']
+        graphs = self._set_graphs(graphlist)
+        template = self._format_body(templatelist or subjectlist)
+        values = self._format_values(valuelist)
+        body = self._format_body(subjectlist, set(valuelist))
+        if template is None or body is None:
+            return None
+        modifiers = self._set_modifiers(limit, offset, [], [])
+        queryString = """
+        {prefix}
+        CONSTRUCT {{
+          {template}
+        }}
+        {graphs}
+        WHERE {{
+          {values}
+          {body}
+        }}
+        {modifiers}
+        """.format(prefix=prefix, template=template, graphs=graphs,
+                   values=values, body=body, modifiers=modifiers)
+        rdf = copy(self)
+        rdf.setReturnFormat(N3)
+        rdf.customHttpHeaders = dict(self.customHttpHeaders)
+        rdf.addCustomHttpHeader('Accept', NTRIPLES + ', text/plain;q=0.9')
+
+        def read(triples):
+            self.stale = self.stale or rdf.stale
+            return triples
+
+        return then(rdf._run_query(queryString, parse_ntriples), read)
+
+    def construct_subjects(self, idlist, graphlist = {''}):
+        """Return every triple of several subjects with one 'CONSTRUCT'.
+        
+        Args:
+            graphlist (set): Named graphs in which to scope the query.
+            idlist (list): URIs that identify the subjects.
+        
+        Returns:
+            list of triples, as returned by construct(), or None on error.
+        """
+        rdfobject = {'type': 'label', 'value': 'o'}
+        predicate = {'p': {'type': 'label', 'value': [rdfobject]}}
+        subject = {'s': {'type': 'label', 'value': predicate}}
+        values = {'s': [{'type': 'uri', 'value': id} for id in idlist]}
+        return self.construct(graphlist, subjectlist=subject,
+                              valuelist=values)
+
+    def query_edges(self, idlist, graphlist = {''}, direction = 'both',
+                    predlist = [], limit = None):
+        """Return the links between several subjects and their neighbors.
+        
+        The subjects are bound to the 'n' label through a single 'VALUES'
+        block, and every subject that they link to, or that links to them, is
+        bound to the 'm' label along with the linking predicate 'p'. Outgoing
+        and incoming links are joined with 'UNION' in the same query, and the
+        'dir' label of each result holds either 'out' or 'in'. Only neighbors
+        that are URIs are returned, since literals and blank nodes cannot be
+        followed any further.
+        
+        Args:
+            direction (str): 'out', 'in', or 'both' ways to follow links.
+            graphlist (set): Named graphs in which to scope the query.
+            idlist (list): URIs that identify the query subjects.
+            limit (int): Maximum number of links to return, if provided.
+            predlist (list): URIs of the only predicates to follow, if any.
+        
+        Returns:
+            Result of SPARQL query for subjects, predicates, and neighbors.
+        """
+        if self.backend is not None:
+            return self.backend.edges(idlist, graphlist, direction, predlist,
+                                      limit)
+        prefix = app.config['PREFIXES']
+        graphs = self._set_graphs(graphlist)
+        node = {'type': 'label', 'value': 'n'}
+        neighbor = {'type': 'label', 'value': 'm'}
+        branches = []
+        if direction in ('out', 'both'):
+            predicate = {'p': {'type': 'label', 'value': [neighbor]}}
+            body = self._format_body({'n': {'type': 'label',
+                                            'value': predicate}})
+            branches.append('{{ {} BIND("out" AS ?dir) }}'.format(body))
+        if direction in ('in', 'both'):
+            predicate = {'p': {'type': 'label', 'value': [node]}}
+            body = self._format_body({'m': {'type': 'label',
+                                            'value': predicate}})
+            branches.append('{{ {} BIND("in" AS ?dir) }}'.format(body))
+        valuelist = {'n': [{'type': 'uri', 'value': id} for id in idlist]}
+        if predlist:
+            valuelist['p'] = [{'type': 'uri', 'value': id}
+                              for id in predlist]
+        values = self._format_values(valuelist)
+        filters = self._format_filters([{'type': 'function', 'value': 'isIRI',
+                                         'args': [neighbor]}])
+        modifiers = self._set_modifiers(limit)
+        queryString = """
+        {prefix}
+        SELECT DISTINCT ?n ?p ?m ?dir
+        {graphs}
+        WHERE {{
+          {values}
+          {body}
+          {filters}
+        }}
+        {modifiers}
+        """.format(prefix=prefix, graphs=graphs, values=values,
+                   body=' UNION '.join(branches), filters=filters,
+                   modifiers=modifiers)
+        return self._run_query(queryString)
+
+    def _advance_generation(self, graph):
+        """Record that an UPDATE was accepted for the named graph.
+        
+        Args:
+            graph (str): Short name of the graph, '' for the default graph.
+        """
+        with SPARQLER._generation_lock:
+            generation = SPARQLER.generations.get(graph, 0)
+            SPARQLER.generations[graph] = generation + 1
+            SPARQLER.modified[graph] = time()
+
+    def get_generations(self, graphlist = set()):
+        """Return the change generations of some named graphs.
+        
+        A query that names no graphs is scoped by the endpoint, which may
+        include every graph, so an empty list selects the generations of all
+        graphs that have been changed. The result is sorted by graph name, so
+        that equal states always produce equal results.
+        
+        Args:
+            graphlist (set): Short names of named graphs in the triplestore.
+        
+        Returns:
+            Tuple of (graph, generation) pairs, led by the boot token.
+        """
+        with SPARQLER._generation_lock:
+            if graphlist:
+                names = graphlist
+            else:
+                names = SPARQLER.generations.keys()
+            pairs = [(name, SPARQLER.generations.get(name, 0))
+                     for name in names]
+        return (SPARQLER.boot,) + tuple(sorted(pairs))
+
+    def get_modified(self, graphlist = set()):
+        """Return the time of the last accepted UPDATE to some named graphs.
+        
+        Graphs that were not changed since the process started are treated as
+        modified at start time. As with get_generations(), an empty list
+        selects every graph.
+        
+        Args:
+            graphlist (set): Short names of named graphs in the triplestore.
+        
+        Returns:
+            Time of the latest change, in seconds since the epoch.
+        """
+        with SPARQLER._generation_lock:
+            if graphlist:
+                times = [SPARQLER.modified.get(name, SPARQLER.started)
+                         for name in graphlist]
+            else:
+                times = list(SPARQLER.modified.values())
+        return max(times + [SPARQLER.started])
 
     def _update(self, action, graphlist = set(), subjectlist = {}):
         """Perform UPDATE actions against a SPARQL endpoint.
@@ -299,7 +2069,11 @@ class SPARQLER(SPARQLWrapper):
         A boilerplate is provided for an 'UPDATE' statement. The formatting is
         performed by helper methods, one for each of the main sections.
         EVENTUALLY, this method will be generalized enough to allow most SPARQL
-        update actions.
+        update actions. Every triple in each graph that accepts the UPDATE is
+        recorded in the change log, so that standing queries can learn what
+        has changed. When SPARQL_GROUP_COMMIT is set, the UPDATE is handed to
+        the shared GroupCommitter, which may send it along with the UPDATEs of
+        other threads. With a backend, the update is applied by it instead.
         
         Args:
             action (str): The update action, either 'INSERT' or 'DELETE'.
@@ -309,16 +2083,70 @@ class SPARQLER(SPARQLWrapper):
         Returns:
             True if the endpoint accepted the UPDATE, False otherwise.
         """
-        prefix = app.config['PREFIXES']
-        namespace = app.config['NAMESPACE']
-        graphs = graphlist
-        body = self._format_body(subjectlist)
-        for graph in graphs:
-            if not graph:
-                graph = namespace
+        body = None
+        for name in graphlist:
+            if self.backend is not None:
+                if not self.backend.update(action, name, subjectlist):
+                    return False
+                self._record_update(action, name, subjectlist)
+                continue
+            if body is None:
+                body = self._format_body(subjectlist)
+                if body is None:
+                    return False
+            queryString = self._format_update(action, name, body)
+            print(queryString)
+            if app.config['SPARQL_GROUP_COMMIT']:
+                accepted = get_committer().commit(self, queryString)
             else:
-                graph = '{}/{}'.format(namespace, graph)
-            queryString = """
+                accepted = self._send_update(queryString)
+            if not accepted:
+                return False
+            self._record_update(action, name, subjectlist)
+        return True
+
+    def _send_update(self, queryString):
+        """Send one update request, unless the circuit breaker is open.
+        
+        Args:
+            queryString (str): Complete SPARQL update, including prefixes.
+        
+        Returns:
+            True if the endpoint accepted the update, False otherwise.
+        """
+        if not SPARQLER.breaker.allow():
+            print(__name__, 'circuit open')
+            return False
+        self.setQuery(queryString)
+        self.setMethod(POST)
+        started = time()
+        try:
+            self.query()
+        except QueryBadFormed as e:
+            print(__name__, str(e))
+            SPARQLER.breaker.record(True, time() - started)
+            return False
+        except (OSError, EndPointNotFound, EndPointInternalError) as e:
+            print(__name__, str(e))
+            SPARQLER.breaker.record(False, time() - started)
+            return False
+        SPARQLER.breaker.record(True, time() - started)
+        return True
+
+    def _format_update(self, action, name, body):
+        """Format a complete 'DATA' update of a single named graph.
+        
+        Args:
+            action (str): The update action, either 'INSERT' or 'DELETE'.
+            body (str): Triples to write, as returned by _format_body().
+            name (str): Name of the graph, as accepted by _set_graphs().
+        
+        Returns:
+            String of a SPARQL update, including prefixes.
+        """
+        prefix = app.config['PREFIXES']
+        graph = self._graph_uri(name)
+        return """
             {prefix}
             {action} DATA {{
               GRAPH <{graph}> {{
@@ -326,16 +2154,47 @@ class SPARQLER(SPARQLWrapper):
               }}
             }}
             """.format(prefix=prefix, action=action, graph=graph, body=body)
-            print(queryString)
-            self.setQuery(queryString)
-            self.setMethod(POST)
-            try:
-                self.query()
-            except (EndPointNotFound, QueryBadFormed,
-                    EndPointInternalError) as e:
-                print(__name__, str(e))
-                return False
-        return True
+
+    def _record_update(self, action, name, subjectlist):
+        """Record an UPDATE that the endpoint accepted for one graph.
+        
+        Reads from this connection are sent to the primary for the next
+        SPARQL_STICKY seconds.
+        
+        Args:
+            action (str): The update action, either 'INSERT' or 'DELETE'.
+            name (str): Name of the graph, as accepted by _set_graphs().
+            subjectlist (dict): Structured data that define the update.
+        """
+        self._advance_generation(name)
+        get_changelog().append(action, name, self._triples(subjectlist))
+        self.sticky_until = time() + app.config['SPARQL_STICKY']
+
+    def _triples(self, subjectlist = {}):
+        """Return every triple of an update as a separate tuple.
+        
+        Prefixed names are expanded to full URIs, so that the triples can be
+        compared with query results, which always hold full URIs.
+        
+        Args:
+            subjectlist (dict): Structured data that define the update.
+        
+        Returns:
+            list of (subject, predicate, object) tuples, where the object is
+            an RDF object in the JSON format of SPARQL query results.
+        """
+        triples = []
+        for subject in subjectlist:
+            predlist = subjectlist[subject]['value']
+            for predicate in predlist:
+                for rdfobject in predlist[predicate]['value']:
+                    rdfobject = dict(rdfobject)
+                    if rdfobject['type'] == 'pfx':
+                        rdfobject['type'] = 'uri'
+                        rdfobject['value'] = expand(rdfobject['value'])
+                    triples.append((expand(subject), expand(predicate),
+                                    rdfobject))
+        return triples
 
     def insert(self, graphlist, subjectlist = {}):
         """Perform an INSERT of some RDF triples into a triplestore.
@@ -372,3 +2231,498 @@ class SPARQLER(SPARQLWrapper):
         """
         return self._update(action='DELETE', graphlist=graphlist, 
                             subjectlist=subjectlist)
+
+    def _graph_request(self, method, name = None, body = None):
+        """Send one request of the Graph Store Protocol to the primary.
+        
+        Args:
+            body (iterable): Chunks of N-Triples, as bytes, to send with the
+                request, if any. The body is sent with chunked encoding, so
+                it is never held in memory at once.
+            method (str): 'HEAD', 'GET', 'PUT', 'POST', or 'DELETE'.
+            name (str): Name of the graph, as accepted by _set_graphs(), or
+                None for the default graph of the endpoint.
+        
+        Returns:
+            The open HTTP response, or None on error.
+        """
+        url = app.config['SPARQL_ENDPOINT'] + app.config['SPARQL_GRAPH_STORE']
+        if name is None:
+            url += '?default'
+        else:
+            url += '?' + urlencode({'graph': self._graph_uri(name)})
+        headers = {'Accept': NTRIPLES + ', text/plain'}
+        if body is not None:
+            headers['Content-Type'] = NTRIPLES
+        if not SPARQLER.breaker.allow():
+            print(__name__, 'circuit open')
+            return None
+        request = Request(url, data=body, headers=headers, method=method)
+        started = time()
+        try:
+            response = urlopen(request,
+                               timeout=app.config['SPARQL_GRAPH_TIMEOUT'])
+        except HTTPError as e:
+            print(__name__, method, url, str(e))
+            SPARQLER.breaker.record(e.code < 500, time() - started)
+            return None
+        except OSError as e:
+            print(__name__, method, url, str(e))
+            SPARQLER.breaker.record(False, time() - started)
+            return None
+        SPARQLER.breaker.record(True, time() - started)
+        return response
+
+    def has_graph_store(self):
+        """Return whether the endpoint serves the Graph Store Protocol.
+        
+        The default graph is requested with 'HEAD' at SPARQL_GRAPH_STORE, and
+        the endpoint is taken to serve the protocol if it answers. The answer
+        is remembered for the process, though a failed check is made again
+        after SPARQL_HEALTH_INTERVAL seconds.
+        
+        Returns:
+            True if whole graphs may be sent with the protocol.
+        """
+        if self.backend is not None or not app.config['SPARQL_GRAPH_STORE']:
+            return False
+        url = app.config['SPARQL_ENDPOINT'] + app.config['SPARQL_GRAPH_STORE']
+        available, checked = SPARQLER._graph_stores.get(url, (False, 0))
+        if (not available and
+                time() - checked > app.config['SPARQL_HEALTH_INTERVAL']):
+            response = self._graph_request('HEAD')
+            available = response is not None
+            if available:
+                response.close()
+            SPARQLER._graph_stores[url] = (available, time())
+        return available
+
+    def _record_graph(self, name):
+        """Record that the content of a whole graph may have changed.
+        
+        A single entry with an empty triple is logged with the 'GRAPH'
+        action, which tells every reader of the log to compute its results
+        for the graph again.
+        
+        Args:
+            name (str): Name of the graph, as accepted by _set_graphs().
+        """
+        self._advance_generation(name)
+        get_changelog().append('GRAPH', name, [('', '', {})])
+        self.sticky_until = time() + app.config['SPARQL_STICKY']
+
+    def load_graph(self, name, triples, replace = False):
+        """Add many triples to one graph, or replace its content with them.
+        
+        With the Graph Store Protocol, the triples are streamed to the
+        endpoint in N-Triples with 'POST', or 'PUT' to replace the graph.
+        Otherwise, they are written as N-Triples within one 'INSERT DATA',
+        after 'CLEAR GRAPH' to replace the graph.
+        
+        Args:
+            name (str): Name of the graph, as accepted by _set_graphs().
+            replace (bool): Whether to remove every other triple of the graph.
+            triples (iterable): (subject, predicate, object) tuples of RDF
+                terms in the JSON format of SPARQL query results.
+        
+        Returns:
+            True if the endpoint accepted the triples, False otherwise.
+        """
+        if self.backend is not None:
+            if not self.backend.load(name, triples, replace):
+                return False
+        elif self.has_graph_store():
+            method = 'PUT' if replace else 'POST'
+            response = self._graph_request(method, name,
+                                           self._graph_body(triples))
+            if response is None:
+                return False
+            response.close()
+        else:
+            queryString = self._format_update('INSERT', name,
+                                              ''.join(ntriples(triples)))
+            if replace:
+                queryString = 'CLEAR SILENT GRAPH <{}> ;\n{}'.format(
+                    self._graph_uri(name), queryString)
+            if not self._send_update(queryString):
+                return False
+        self._record_graph(name)
+        return True
+
+    def _graph_body(self, triples):
+        """Return the N-Triples of some triples in chunks of bytes.
+        
+        Args:
+            triples (iterable): Triples, as given to load_graph().
+        
+        Returns:
+            Generator of bytes, each chunk holding many whole lines.
+        """
+        chunk = []
+        size = 0
+        for line in ntriples(triples):
+            chunk.append(line)
+            size += len(line)
+            if size >= 65536:
+                yield ''.join(chunk).encode('utf-8')
+                chunk = []
+                size = 0
+        if chunk:
+            yield ''.join(chunk).encode('utf-8')
+
+    def export_graph(self, name):
+        """Return every triple of one graph as lines of N-Triples.
+        
+        With the Graph Store Protocol, the graph is streamed from the
+        endpoint. Otherwise, every triple of the graph is selected.
+        
+        Args:
+            name (str): Name of the graph, as accepted by _set_graphs().
+        
+        Returns:
+            Iterator of strings, each a line of N-Triples, or None on error.
+        """
+        if self.has_graph_store():
+            response = self._graph_request('GET', name)
+            if response is None:
+                return None
+            return self._graph_lines(response)
+        anything = {'type': 'label', 'value': 'o'}
+        triples = {'s': {'type': 'label', 'value':
+                   {'p': {'type': 'label', 'value': [anything]}}}}
+        result = self.query_general(graphlist={name},
+                                    labellist={'s', 'p', 'o'},
+                                    subjectlist=triples)
+        if result is None:
+            return None
+        return ntriples((row['s'], row['p'], row['o'])
+                        for row in result['results']['bindings'])
+
+    def _graph_lines(self, response):
+        """Return the lines of a graph as they arrive, then close it.
+        
+        Args:
+            response (HTTPResponse): Open response to a 'GET' of a graph.
+        
+        Returns:
+            Generator of strings, each a line of N-Triples.
+        """
+        with response:
+            for line in response:
+                yield line.decode('utf-8')
+
+    def delete_graph(self, name):
+        """Remove one graph and every triple in it.
+        
+        Args:
+            name (str): Name of the graph, as accepted by _set_graphs().
+        
+        Returns:
+            True if the endpoint removed the graph, False otherwise.
+        """
+        if self.backend is not None:
+            if not self.backend.drop(name):
+                return False
+        elif self.has_graph_store():
+            response = self._graph_request('DELETE', name)
+            if response is None:
+                return False
+            response.close()
+        else:
+            queryString = 'DROP SILENT GRAPH <{}>'.format(
+                self._graph_uri(name))
+            if not self._send_update(queryString):
+                return False
+        self._record_graph(name)
+        return True
+
+
+class AsyncSPARQLER(SPARQLER):
+    """A SPARQLER whose requests are sent as coroutines over a shared pool.
+    
+    Queries and updates are formed exactly as they are by a SPARQLER, when
+    the method is called, but every method that would send a request returns
+    a coroutine instead of its result. The coroutines must run on the loop
+    returned by get_loop(), which is most easily done by passing them to
+    gather(). Every instance shares one aiohttp session, whose connector keeps
+    up to SPARQL_ASYNC_CONNECTIONS connections open to the endpoint, so that a
+    single worker can have hundreds of requests in flight at once.
+    
+    Attributes:
+        session (aiohttp.ClientSession): Connection pool that is shared by
+            every instance, created on the shared loop when first needed.
+    """
+
+    session = None
+    _flights = {}
+
+    @classmethod
+    def _get_session(cls):
+        """Return the shared session, creating it on the running loop."""
+        if cls.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=app.config['SPARQL_ASYNC_CONNECTIONS'])
+            cls.session = aiohttp.ClientSession(connector=connector)
+        return cls.session
+
+    async def _run_query(self, queryString, convert = None):
+        """Send a query to the endpoint and return its converted results.
+        
+        Args:
+            convert (function): Applied to the results before they are
+                returned, if provided.
+            queryString (str): Complete SPARQL query, including prefixes.
+        
+        Returns:
+            JSON object containing SPARQL query results, or None on error.
+        """
+        print(queryString)
+        key = (queryString, time() < self.sticky_until)
+        flight = AsyncSPARQLER._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = {'future': asyncio.ensure_future(
+                          self._send_query(queryString)),
+                      'followers': 0}
+            AsyncSPARQLER._flights[key] = flight
+            flight['future'].add_done_callback(
+                lambda done: AsyncSPARQLER._flights.pop(key, None))
+        else:
+            print(__name__, 'coalesced')
+            flight['followers'] += 1
+            with SPARQLER._flights_lock:
+                SPARQLER.coalesced += 1
+        try:
+            result, stale = await asyncio.wait_for(
+                asyncio.shield(flight['future']), max(0, self._time_left()))
+        except asyncio.TimeoutError:
+            print(__name__, 'deadline passed')
+            return None
+        if leader and AsyncSPARQLER._flights.get(key) is flight:
+            # no follower can join once the flight is gone
+            del AsyncSPARQLER._flights[key]
+        if result is None:
+            return None
+        if not leader or flight['followers']:
+            # each caller may change its results, so sharers get a copy
+            result = deepcopy(result)
+        self.stale = self.stale or stale
+        return convert(result) if convert else result
+
+    async def _send_query(self, queryString):
+        """Send a query, unless the circuit breaker is open.
+        
+        Args:
+            queryString (str): Complete SPARQL query, including prefixes.
+        
+        Returns:
+            Tuple of the JSON object containing SPARQL query results, or None
+            on error, and whether that is the last good result of the query
+            rather than a new one.
+        """
+        if not SPARQLER.breaker.allow():
+            print(__name__, 'circuit open')
+            return self._stale_result(queryString)
+        # other coroutines of this connection may be sending their own query
+        request = copy(self)
+        request.setQuery(queryString)
+        started = time()
+        try:
+            result = await request._fetch()
+        except aiohttp.ClientResponseError as e:
+            print(__name__, str(e))
+            # a malformed query says nothing about the health of the endpoint
+            SPARQLER.breaker.record(e.status == 400, time() - started)
+            if e.status == 400:
+                return None, False
+            return self._stale_result(queryString)
+        except asyncio.TimeoutError:
+            # the request ran out of time, which says nothing of the endpoint
+            print(__name__, 'deadline passed')
+            return None, False
+        except (aiohttp.ClientError, ValueError) as e:
+            print(__name__, str(e))
+            SPARQLER.breaker.record(False, time() - started)
+            return self._stale_result(queryString)
+        self._good_result(queryString, result, time() - started)
+        return result, False
+
+    async def _fetch(self):
+        """Send the current query to each endpoint in turn until one answers.
+        
+        Returns:
+            JSON object containing SPARQL query results.
+        
+        Raises:
+            asyncio.TimeoutError: if the deadline passed before any answer.
+            aiohttp.ClientError: if the last endpoint that was tried failed
+                to answer.
+        """
+        tried = []
+        error = None
+        while True:
+            timeout = self._time_left()
+            if timeout <= 0:
+                raise asyncio.TimeoutError()
+            endpoint, pool = self._choose_endpoint(tried)
+            if endpoint is None:
+                raise error
+            try:
+                return await self._read(endpoint, pool, tried, timeout)
+            except asyncio.TimeoutError:
+                raise
+            except aiohttp.ClientConnectionError as e:
+                if pool is None:
+                    raise
+                print(__name__, endpoint, str(e))
+                tried.append(endpoint)
+                error = e
+
+    async def _attempt(self, endpoint, pool, timeout, first = True):
+        """Send the current query to one endpoint and wait for its answer.
+        
+        Args:
+            endpoint (str): URL of the query endpoint to send the query to.
+            first (bool): Whether this is the first attempt of the read.
+            pool (ReplicaPool): Pool that chose the endpoint, or None.
+            timeout (float): Seconds to wait for the answer.
+        
+        Returns:
+            JSON object containing SPARQL query results, or the text of the
+            answer if the return format is N3, as it is for construct().
+        """
+        headers = {'Accept': 'application/sparql-results+json'}
+        if self.returnFormat == N3:
+            headers = {'Accept': self.customHttpHeaders['Accept']}
+        started = time()
+        failed = False
+        try:
+            async with self._get_session().post(
+                    endpoint, data={'query': self.queryString},
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                response.raise_for_status()
+                if self.returnFormat == N3:
+                    result = await response.text()
+                else:
+                    result = await response.json(content_type=None)
+        except asyncio.TimeoutError:
+            raise
+        except aiohttp.ClientConnectionError:
+            failed = True
+            raise
+        finally:
+            if pool is not None:
+                pool.release(endpoint, failed)
+        if first:
+            SPARQLER.attempts.record(time() - started)
+        return result
+
+    async def _read(self, endpoint, pool, tried, timeout):
+        """Send a read to one endpoint, and to another if it is slow.
+        
+        Duplicates are sent under the same conditions as by SPARQLER, and the
+        slower attempt is cancelled once the first answer arrives.
+        
+        Args:
+            endpoint (str): URL of the query endpoint chosen for the read.
+            pool (ReplicaPool): Pool that chose the endpoint, or None.
+            timeout (float): Seconds to wait for an answer.
+            tried (list): Endpoints that already failed to answer this query.
+        
+        Returns:
+            JSON object containing SPARQL query results.
+        """
+        delay = SPARQLER.attempts.percentile(95)
+        if (pool is None or delay is None or delay >= timeout or
+                not app.config['SPARQL_HEDGE']):
+            return await self._attempt(endpoint, pool, timeout)
+        deadline = time() + timeout
+        tasks = {asyncio.ensure_future(
+            self._attempt(endpoint, pool, timeout))}
+        done, pending = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            other = pool.acquire(tried + [endpoint])
+            if other is not None:
+                SPARQLER.hedges += 1
+                print(__name__, 'hedge', endpoint, other)
+                tasks.add(asyncio.ensure_future(
+                    self._attempt(other, pool, deadline - time(), False)))
+        error = None
+        pending = tasks
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0, deadline - time()),
+                    return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def export_graph(self, name):
+        """Return every triple of one graph as lines of N-Triples.
+        
+        The lines are produced by a SPARQLER with the same endpoints and
+        backend, since they are read as they are needed, outside of any loop.
+        
+        Args:
+            name (str): Name of the graph, as accepted by _set_graphs().
+        
+        Returns:
+            Iterator of strings, each a line of N-Triples, or None on error.
+        """
+        sparql = SPARQLER(endpoint = self.endpoint,
+                          updateEndpoint = self.updateEndpoint)
+        sparql.backend = self.backend
+        return sparql.export_graph(name)
+
+    async def _update(self, action, graphlist = set(), subjectlist = {}):
+        """Perform UPDATE actions against a SPARQL endpoint.
+        
+        Each graph is updated in turn, as by SPARQLER, and every accepted
+        UPDATE is recorded in the same way. A connection with a backend
+        writes to it instead, as a SPARQLER does.
+        
+        Args:
+            action (str): The update action, either 'INSERT' or 'DELETE'.
+            graphlist (set): Named graphs in which to perform the update.
+            subjectlist (dict): Structured data that define the update.
+        
+        Returns:
+            True if the endpoint accepted the UPDATE, False otherwise.
+        """
+        if self.backend is not None:
+            return SPARQLER._update(self, action, graphlist, subjectlist)
+        body = self._format_body(subjectlist)
+        if body is None:
+            return False
+        for name in graphlist:
+            queryString = self._format_update(action, name, body)
+            print(queryString)
+            if not SPARQLER.breaker.allow():
+                print(__name__, 'circuit open')
+                return False
+            started = time()
+            try:
+                async with self._get_session().post(
+                        self.updateEndpoint,
+                        data={'update': queryString}) as response:
+                    response.raise_for_status()
+            except aiohttp.ClientResponseError as e:
+                print(__name__, str(e))
+                SPARQLER.breaker.record(e.status == 400, time() - started)
+                return False
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                print(__name__, str(e))
+                SPARQLER.breaker.record(False, time() - started)
+                return False
+            SPARQLER.breaker.record(True, time() - started)
+            self._record_update(action, name, subjectlist)
+        return True
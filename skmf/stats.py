@@ -0,0 +1,252 @@
+"""skmf.stats by Brendan Sweeney, CSS 593, 2015.
+
+Gather statistics about the contents of the triplestore for query planning,
+hints in the user interface, and capacity planning. The number of triples of
+each predicate and the number of instances of each class are counted by
+grouped aggregate queries, one pair for each named graph, and kept in a small
+SQLite database. A background thread repeats the counts for a graph only once
+the change generation of that graph has advanced, or once the counts are older
+than STATS_MAX_AGE seconds, since changes made by other processes are not seen
+in the generations. Predicate counts are handed to the query Planner whenever
+they are refreshed.
+
+Classes:
+    StatsCollector: Background thread that keeps triplestore statistics.
+
+Functions:
+    get_collector: Return the StatsCollector shared by this process.
+    start_collector: Start refreshing statistics in the background.
+"""
+
+import sqlite3
+from threading import Event, Lock, Thread
+from time import time
+
+import skmf
+from skmf import app
+from skmf.sparqler import Planner
+
+_collector = []
+_collector_lock = Lock()
+
+
+class StatsCollector(Thread):
+    """Background thread that counts predicates and classes in each graph.
+    
+    A single SQLite connection is shared by the thread and by any request
+    that reads the statistics, so every use of it holds a lock. The counts of
+    a graph are replaced in one transaction, so a reader never sees a mix of
+    old and new counts.
+    
+    Attributes:
+        interval (int): Seconds to wait between checks for changed graphs.
+    """
+
+    def __init__(self, database, interval):
+        """Open the statistics database and create its tables if needed.
+        
+        Args:
+            database (str): Path of the SQLite database, or ':memory:'.
+            interval (int): Seconds to wait between checks for changes.
+        """
+        super().__init__(name='skmf-stats', daemon=True)
+        self.interval = interval
+        self._db = sqlite3.connect(database, check_same_thread=False)
+        self._db_lock = Lock()
+        self._refresh_lock = Lock()
+        self._halt = Event()
+        with self._db_lock, self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS predicates (
+                    graph TEXT NOT NULL,
+                    predicate TEXT NOT NULL,
+                    triples INTEGER NOT NULL,
+                    PRIMARY KEY (graph, predicate));
+                CREATE TABLE IF NOT EXISTS classes (
+                    graph TEXT NOT NULL,
+                    class TEXT NOT NULL,
+                    instances INTEGER NOT NULL,
+                    PRIMARY KEY (graph, class));
+                CREATE TABLE IF NOT EXISTS graphs (
+                    graph TEXT PRIMARY KEY,
+                    generation TEXT NOT NULL,
+                    refreshed REAL NOT NULL);
+                """)
+
+    def run(self):
+        """Refresh the statistics of changed graphs until stopped.
+        
+        A failed refresh is reported and tried again after the interval, so
+        that the thread keeps collecting statistics.
+        """
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(__name__, 'refresh failed:', e)
+            if self._halt.wait(self.interval):
+                break
+
+    def stop(self):
+        """Ask the thread to stop after its current refresh."""
+        self._halt.set()
+
+    def _count(self, sparql, graph, label, subjectlist, distinct = False):
+        """Return the results of one grouped count over a single graph.
+        
+        Args:
+            distinct (bool): Whether to count each subject only once.
+            graph (str): Name of the graph, as accepted by _set_graphs().
+            label (str): Placeholder label by which the results are grouped.
+            sparql (SPARQLER): Connection to the SPARQL endpoint.
+            subjectlist (dict): Structured data that define the query.
+        
+        Returns:
+            list of (URI, count) tuples, or None on error.
+        """
+        count = {'type': 'function', 'value': 'COUNT', 'distinct': distinct,
+                 'args': [{'type': 'label', 'value': 's'}]}
+        result = sparql.query_general(graphlist={graph}, labellist={label},
+                                      subjectlist=subjectlist,
+                                      exprlist={'count': count},
+                                      grouplist=[label])
+        if result is None:
+            return None
+        rows = []
+        for row in result['results']['bindings']:
+            if label in row:
+                rows.append((row[label]['value'], int(row['count']['value'])))
+        return rows
+
+    def refresh(self, graphlist = None):
+        """Count predicates and classes in every graph that has changed.
+        
+        Args:
+            graphlist (list): Graphs to check, or None for STATS_GRAPHS.
+        
+        Returns:
+            list of the graphs whose statistics were replaced.
+        """
+        if graphlist is None:
+            graphlist = app.config['STATS_GRAPHS']
+        refreshed = []
+        with self._refresh_lock:
+            sparql = skmf.connect_sparql()
+            for graph in graphlist:
+                generation = repr(sparql.get_generations([graph]))
+                with self._db_lock:
+                    row = self._db.execute(
+                        'SELECT generation, refreshed FROM graphs '
+                        'WHERE graph = ?', (graph,)).fetchone()
+                if (row and row[0] == generation and
+                        time() - row[1] < app.config['STATS_MAX_AGE']):
+                    continue
+                anything = {'type': 'label', 'value': 'o'}
+                triples = {'s': {'type': 'label', 'value':
+                           {'p': {'type': 'label', 'value': [anything]}}}}
+                category = {'type': 'label', 'value': 'c'}
+                members = {'s': {'type': 'label', 'value':
+                           {'a': {'type': 'pfx', 'value': [category]}}}}
+                predicates = self._count(sparql, graph, 'p', triples)
+                classes = self._count(sparql, graph, 'c', members, True)
+                if predicates is None or classes is None:
+                    continue
+                with self._db_lock, self._db:
+                    self._db.execute('DELETE FROM predicates WHERE graph = ?',
+                                     (graph,))
+                    self._db.execute('DELETE FROM classes WHERE graph = ?',
+                                     (graph,))
+                    self._db.executemany(
+                        'INSERT INTO predicates VALUES (?, ?, ?)',
+                        [(graph, uri, count) for uri, count in predicates])
+                    self._db.executemany(
+                        'INSERT INTO classes VALUES (?, ?, ?)',
+                        [(graph, uri, count) for uri, count in classes])
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO graphs VALUES (?, ?, ?)',
+                        (graph, generation, time()))
+                refreshed.append(graph)
+            if refreshed:
+                Planner.cardinalities = self.predicate_counts()
+        return refreshed
+
+    def _totals(self, table, column, total, graphlist):
+        """Return the counts of one table, summed over some graphs.
+        
+        Args:
+            column (str): Name of the column that holds the URIs.
+            graphlist (set): Graphs to include, or None for every graph.
+            table (str): Name of the table to read.
+            total (str): Name of the column that holds the counts.
+        
+        Returns:
+            dict of counts, keyed by URI.
+        """
+        query = 'SELECT {}, SUM({}) FROM {}'.format(column, total, table)
+        args = []
+        if graphlist is not None:
+            if not graphlist:
+                return {}
+            args = sorted(graphlist)
+            query += ' WHERE graph IN ({})'.format(', '.join('?' * len(args)))
+        query += ' GROUP BY {}'.format(column)
+        with self._db_lock:
+            return dict(self._db.execute(query, args).fetchall())
+
+    def predicate_counts(self, graphlist = None):
+        """Return the number of triples of each predicate.
+        
+        Args:
+            graphlist (set): Graphs to include, or None for every graph.
+        
+        Returns:
+            dict of triple counts, keyed by predicate URI.
+        """
+        return self._totals('predicates', 'predicate', 'triples', graphlist)
+
+    def class_counts(self, graphlist = None):
+        """Return the number of instances of each class.
+        
+        Args:
+            graphlist (set): Graphs to include, or None for every graph.
+        
+        Returns:
+            dict of instance counts, keyed by class URI.
+        """
+        return self._totals('classes', 'class', 'instances', graphlist)
+
+    def refreshed(self, graphlist = None):
+        """Return the time at which each graph was last counted.
+        
+        Args:
+            graphlist (set): Graphs to include, or None for every graph.
+        
+        Returns:
+            dict of times in seconds since the epoch, keyed by graph name.
+        """
+        with self._db_lock:
+            rows = self._db.execute(
+                'SELECT graph, refreshed FROM graphs').fetchall()
+        return {graph: stamp for graph, stamp in rows
+                if graphlist is None or graph in graphlist}
+
+
+def get_collector():
+    """Return the StatsCollector shared by this process, creating it once.
+    
+    Returns:
+        StatsCollector that holds the statistics for the configured database.
+    """
+    with _collector_lock:
+        if not _collector:
+            _collector.append(StatsCollector(app.config['STATS_DATABASE'],
+                                             app.config['STATS_INTERVAL']))
+        return _collector[0]
+
+
+@app.before_first_request
+def start_collector():
+    """Start the background refresh if STATS_INTERVAL is not zero."""
+    collector = get_collector()
+    if collector.interval and not collector.is_alive():
+        collector.start()
@@ -6,6 +6,7 @@ use of the SPARQL endpoint connection and, by extension, test much of the
 functionality of the SPARQL interface.
 
 Classes:
+    ApiTestCase: Unit tests to verify correct behavior of JSON API views.
     BaseTestCase: Setup class for other TestCase classes.
     FlaskTestCase: Unit tests to verify correct behavior of Flask views.
     SPARQLERTestCase: 
@@ -14,15 +15,31 @@ Classes:
     ResourceUserTestCase: 
 """
 
+import json
+import os
+import shutil
+import tempfile
 import unittest
+from threading import Event, Thread
+from time import time
 
 from flask import url_for
 from flask.ext.bcrypt import Bcrypt
 from flask.ext.login import current_user
 from flask.ext.testing import TestCase
 
-from skmf import app, connect_sparql, g
-from skmf.resource import Query, Subject, User
+from skmf import app, connect_async_sparql, connect_sparql, g
+from skmf.backend import Backend, MemoryBackend, SnapshotBackend, \
+                         export_snapshot, numpy
+from skmf.changelog import ChangeLog, get_changelog
+from skmf.events import get_hub
+from skmf.jobs import JobQueue, get_queue
+from skmf.resource import Query, StandingQuery, Subject, User
+from skmf.sparqler import RDF_TYPE, SPARQLER, AsyncSPARQLER, \
+                          CircuitBreaker, LatencyTracker, Planner, \
+                          ReplicaPool, aiohttp, format_path, format_term, \
+                          gather, get_committer, ntriples, parse_ntriples
+from skmf.stats import get_collector
 import skmf.i18n.en_US as uiLabel
 
 
@@ -217,6 +234,229 @@ class SPARQLERTestCase(BaseTestCase):
         # removal of 'users' graph does hide admin user
         self.assertFalse(result['results']['bindings'])
 
+    def test_sparql_replicas(self):
+        """Verify that reads are balanced and stick to the primary."""
+        pool = ReplicaPool(['http://a/sparql', 'http://b/sparql'], 1)
+        first = pool.acquire()
+        second = pool.acquire()
+        # the idle replica is chosen while the other is busy
+        self.assertNotEqual(first, second)
+        pool.release(first)
+        self.assertEqual(pool.acquire(), first)
+        pool.release(second, failed=True)
+        self.assertFalse(pool.healthy[second])
+        self.assertEqual(pool.acquire(), first)
+        self.assertIsNone(pool.acquire(tried=[first]))
+        app.config['SPARQL_REPLICAS'] = ['http://replica/sparql']
+        try:
+            self.assertEqual(g.sparql._choose_endpoint()[0],
+                             'http://replica/sparql')
+            g.sparql.sticky_until = 0
+            self.assertTrue(g.sparql.insert({'bob'}, constraint))
+            self.assertEqual(g.sparql._choose_endpoint()[0],
+                             g.sparql.primary)
+            self.assertTrue(g.sparql.delete({'bob'}, constraint))
+        finally:
+            app.config['SPARQL_REPLICAS'] = []
+
+    def test_sparql_deadline(self):
+        """Verify that reads give up after the request deadline."""
+        tracker = LatencyTracker(size=100)
+        self.assertIsNone(tracker.percentile(95))
+        for millis in range(100):
+            tracker.record(millis / 1000)
+        self.assertEqual(tracker.percentile(95), 0.095)
+        self.assertEqual(len(tracker), 100)
+        self.assertTrue(g.sparql.query_subject(self.subject))
+        g.sparql.deadline = time() - 1
+        self.assertIsNone(g.sparql.query_subject(self.subject))
+        g.sparql.deadline = None
+        report = g.sparql.latency_report()
+        self.assertTrue(report['answered']['samples'])
+
+    def test_sparql_breaker(self):
+        """Verify that an open breaker fails fast and serves stale reads."""
+        breaker = CircuitBreaker(size=10)
+        for attempt in range(10):
+            self.assertTrue(breaker.allow())
+            breaker.record(False, 0)
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+        expected = g.sparql.query_subject(self.subject)
+        self.assertFalse(g.sparql.stale)
+        shared = SPARQLER.breaker
+        SPARQLER.breaker = breaker
+        try:
+            self.assertEqual(g.sparql.query_subject(self.subject), expected)
+            self.assertTrue(g.sparql.stale)
+            self.assertFalse(g.sparql.insert({'bob'}, constraint))
+        finally:
+            SPARQLER.breaker = shared
+        # a good probe after the cooldown closes the breaker
+        breaker.opened = 0
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertFalse(breaker.allow())
+        breaker.record(True, 0)
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_sparql_coalesce(self):
+        """Verify that a read waits for an identical read in flight."""
+        g.sparql.query_subject(self.subject)
+        key = (g.sparql.queryString, False)
+        empty = {'head': {'vars': []}, 'results': {'bindings': []}}
+        flight = {'done': Event(), 'result': empty, 'stale': False,
+                  'followers': 0}
+        flight['done'].set()
+        coalesced = SPARQLER.coalesced
+        SPARQLER._flights[key] = flight
+        try:
+            result = g.sparql.query_subject(self.subject)
+        finally:
+            del SPARQLER._flights[key]
+        # the result of the flight was shared, so nothing was sent
+        self.assertFalse(result['results']['bindings'])
+        self.assertEqual(SPARQLER.coalesced, coalesced + 1)
+        self.assertEqual(flight['followers'], 1)
+        # the follower changes its own copy, not the shared result
+        result['results']['bindings'].append({})
+        self.assertFalse(empty['results']['bindings'])
+        self.assertTrue(g.sparql.query_subject(self.subject)['results'])
+
+    def test_sparql_group_commit(self):
+        """Verify that concurrent updates are sent as one request."""
+        committer = get_committer()
+        window = committer.window
+        batches = committer.batches
+        updates = committer.updates
+        accepted = []
+        def insert():
+            accepted.append(connect_sparql().insert({''}, constraint))
+        app.config['SPARQL_GROUP_COMMIT'] = True
+        committer.window = 0.5
+        try:
+            threads = [Thread(target=insert) for count in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            committer.window = window
+            app.config['SPARQL_GROUP_COMMIT'] = False
+        self.assertEqual(accepted, [True, True, True])
+        self.assertEqual(committer.batches, batches + 1)
+        self.assertEqual(committer.updates, updates + 3)
+        self.assertTrue(g.sparql.delete({''}, constraint))
+
+    def test_sparql_graph_store(self):
+        """Verify that a whole graph is loaded, exported, and deleted."""
+        literal = {'type': 'literal', 'value': 'say "hi"\n', 'xml:lang': 'en'}
+        self.assertEqual(format_term(literal), '"say \\"hi\\"\\n"@en')
+        subject = {'type': 'uri', 'value': 'http://localhost/skmf#bulk'}
+        label = {'type': 'uri',
+                 'value': 'http://www.w3.org/2000/01/rdf-schema#label'}
+        triples = [(subject, label, {'type': 'literal', 'value': str(number)})
+                   for number in range(3)]
+        seq = get_changelog().last()
+        self.assertTrue(g.sparql.load_graph('bulk', triples, replace=True))
+        self.assertEqual(get_changelog().since(seq)[0]['action'], 'GRAPH')
+        self.assertTrue(g.sparql.load_graph('bulk', triples[:1],
+                                            replace=True))
+        lines = list(g.sparql.export_graph('bulk'))
+        # the graph was replaced, so only the last triple remains
+        self.assertEqual(len(lines), 1)
+        self.assertIn('"0"', lines[0])
+        self.assertTrue(g.sparql.delete_graph('bulk'))
+
+    def test_sparql_memory_backend(self):
+        """Verify that the memory backend answers without an endpoint."""
+        # a backend that does not write cannot be created
+        partial = type('Partial', (Backend,), {'select': MemoryBackend.select})
+        self.assertRaises(TypeError, partial)
+        sparql = SPARQLER('http://localhost:1/none')
+        sparql.backend = MemoryBackend()
+        # an asynchronous connection writes to the same backend
+        async_sparql = AsyncSPARQLER('http://localhost:1/none')
+        async_sparql.backend = sparql.backend
+        self.assertEqual(gather(async_sparql.insert({''}, constraint)),
+                         [True])
+        self.assertTrue(list(async_sparql.export_graph('')))
+        subject = {'type': 'label', 'value': 's'}
+        label = {'type': 'label', 'value': 'label'}
+        body = {'s': {'type': 'label', 'value':
+                {RDF_TYPE: {'type': 'uri', 'value': [
+                    {'type': 'uri', 'value':
+                     'http://www.w3.org/2000/01/rdf-schema#Class'}]}}}}
+        optional = {'s': {'type': 'label', 'value':
+                    {'rdfs:label': {'type': 'pfx', 'value': [label]}}}}
+        name = {'type': 'function', 'value': 'COALESCE', 'args': [
+            label, {'type': 'function', 'value': 'STR', 'args': [subject]}]}
+        result = sparql.query_general({''}, {'s', 'name'}, body, [optional],
+                                      exprlist={'name': name})
+        names = [row['name']['value']
+                 for row in result['results']['bindings']]
+        self.assertEqual(names, ['UserID', 'UserID'])
+        count = {'type': 'function', 'value': 'COUNT', 'distinct': True,
+                 'args': [{'type': 'label', 'value': 'o'}]}
+        everything = {'s': {'type': 'label', 'value':
+                      {'p': {'type': 'label', 'value': [
+                          {'type': 'label', 'value': 'o'}]}}}}
+        result = sparql.query_general({''}, {'p'}, everything,
+                                      exprlist={'count': count},
+                                      grouplist=['p'])
+        self.assertEqual(len(result['results']['bindings']),
+                         sparql.query_count({''}, {'p'}, everything))
+        self.assertTrue(sparql.delete({''}, constraint))
+        self.assertFalse(sparql.ask({''}, everything))
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_sparql_snapshot_backend(self):
+        """Verify that a snapshot answers as the store it was saved from."""
+        memory = SPARQLER('http://localhost:1/none')
+        memory.backend = MemoryBackend()
+        self.assertTrue(memory.insert({''}, constraint))
+        path = tempfile.mkdtemp()
+        try:
+            self.assertTrue(export_snapshot(memory, path, {''}))
+            sparql = SPARQLER('http://localhost:1/none')
+            sparql.backend = SnapshotBackend(path)
+            def rows(result):
+                return sorted(json.dumps(row, sort_keys=True)
+                              for row in result['results']['bindings'])
+            for id in constraint:
+                self.assertEqual(rows(sparql.query_subject(id)),
+                                 rows(memory.query_subject(id)))
+            self.assertEqual(rows(sparql.query_edges(list(constraint))),
+                             rows(memory.query_edges(list(constraint))))
+            self.assertFalse(sparql.delete({''}, constraint))
+            # a refused drop is neither reported nor logged
+            seq = get_changelog().last()
+            self.assertFalse(sparql.delete_graph(''))
+            self.assertEqual(get_changelog().last(), seq)
+        finally:
+            shutil.rmtree(path)
+
+    @unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+    def test_sparql_async(self):
+        """Verify that concurrent queries match their synchronous results."""
+        sparql = connect_async_sparql()
+        self.assertIsNotNone(sparql)
+        rdfs_class = {'type': 'uri', 'value': self.rdfs_class}
+        is_class = {self.subject: {'type': 'uri', 'value':
+                    {'a': {'type': 'pfx', 'value': [rdfs_class]}}}}
+        subject, count, found = gather(
+            sparql.query_subject(self.subject),
+            sparql.query_count(subjectlist=constraint),
+            sparql.ask(subjectlist=is_class))
+        expected = g.sparql.query_subject(self.subject)
+        self.assertEqual(len(subject['results']['bindings']),
+                         len(expected['results']['bindings']))
+        self.assertEqual(count, g.sparql.query_count(subjectlist=constraint))
+        self.assertTrue(found)
+        # completed results pass through unchanged
+        self.assertEqual(gather(1, sparql.query_count(), None)[::2],
+                         [1, None])
+
     def test_sparql_query_general(self):
         """Verify that general query results are correct and complete."""
         labels = {'s', 'p', 'o'}
@@ -274,6 +514,67 @@ class SPARQLERTestCase(BaseTestCase):
         # making the label portion optional allows results to be returned
         self.assertTrue(result_mixed['results']['bindings'])
 
+    def test_sparql_planner(self):
+        """Verify that planned queries match first on their bound patterns."""
+        subjects = {'s':
+                       {'type': 'label',
+                        'value':
+                            {'p':
+                                {'type': 'label',
+                                 'value':
+                                     [{'type': 'label',
+                                       'value': 'o'}]}}},
+                    'o':
+                       {'type': 'label',
+                        'value':
+                            {'a':
+                                {'type': 'pfx',
+                                 'value':
+                                     [{'type': 'pfx',
+                                       'value': 'rdfs:Class'}]}}}}
+        labels = {'s', 'p', 'o'}
+        expected = g.sparql.query_general(labellist=labels,
+                                          subjectlist=subjects)
+        app.config['SPARQL_PLANNER'] = True
+        try:
+            result = g.sparql.query_general(labellist=labels,
+                                            subjectlist=subjects)
+        finally:
+            app.config['SPARQL_PLANNER'] = False
+        # the pattern with a bound object is matched before the open one
+        self.assertEqual(g.sparql.last_plan[0][0], '?o a rdfs:Class .')
+        self.assertEqual(len(g.sparql.last_plan), 2)
+        # reordering does not change the results
+        self.assertCountEqual(result['results']['bindings'],
+                              expected['results']['bindings'])
+
+    def test_sparql_property_path(self):
+        """Verify that property paths are checked and traverse the graph."""
+        self.assertEqual(format_path('a/rdfs:subClassOf*'),
+                         'a/rdfs:subClassOf*')
+        # unknown prefixes, unbalanced groups, and stray text are rejected
+        self.assertIsNone(format_path('bob:blah+'))
+        self.assertIsNone(format_path('(rdfs:label'))
+        self.assertIsNone(format_path('rdfs:label } ?x'))
+        path_subject = {'skmf:User':
+                           {'type': 'pfx',
+                            'value':
+                                {'a/rdfs:subClassOf*':
+                                    {'type': 'path',
+                                     'value':
+                                         [{'type': 'label',
+                                           'value': 'o'}]}}}}
+        result = g.sparql.query_general(subjectlist=path_subject)
+        # zero-length path keeps the direct type of skmf:User in the results
+        values = [binding['o']['value']
+                  for binding in result['results']['bindings']]
+        self.assertIn(self.rdfs_class, values)
+        # a rejected path leaves no query to send
+        bad_subject = {'skmf:User': {'type': 'pfx', 'value':
+                       {'((rdfs:label': path_subject['skmf:User']['value']
+                                                    ['a/rdfs:subClassOf*']}}}
+        self.assertIsNone(g.sparql.query_general(subjectlist=bad_subject))
+
     def test_sparql_insert_delete(self):
         """Verify that INSERT and DELETE are correct and complementary."""
         new_subject = {'skmf:blah':
@@ -345,6 +646,114 @@ class ResourceQueryTestCase(BaseTestCase):
         query.submit_delete()
         query.remove_constraints(subjectlist=constraint)
 
+    def test_resource_query_choices(self):
+        """Verify that choices are filtered, deduplicated, and sorted."""
+        query = Query(labellist = set(), subjectlist = {}, optlist = [])
+        choices = query.get_choices(['rdfs:Class', 'owl:Class'])
+        self.assertTrue(choices)
+        # the endpoint removes duplicates and sorts by name
+        self.assertEqual(len(choices), len(set(choices)))
+        names = [choice[1] for choice in choices]
+        self.assertEqual(names, sorted(names))
+        # blank nodes are filtered out by the endpoint
+        for uri, name in choices:
+            self.assertFalse(uri.startswith('_:'))
+        self.assertIn(('http://localhost/skmf#User', 'User'), choices)
+
+    def test_resource_query_count(self):
+        """Verify that aggregate counts match the results they measure."""
+        query = Query(labellist = set(), subjectlist = {}, optlist = [])
+        counts = query.count_categories(['rdfs:Class', 'owl:Class'])
+        choices = query.get_choices(['rdfs:Class'])
+        # every named class is counted once, like in the dropdown list
+        self.assertEqual(counts['rdfs:Class'],
+                         len({uri for uri, name in choices}))
+        self.assertIn('owl:Class', counts)
+        entry = {'subject': {'type': 'label', 'value': 'resource'},
+                 'predicate': {'type': 'pfx', 'value': 'a'},
+                 'object': {'type': 'pfx', 'value': 'rdfs:Class'}}
+        results = query.get_entries([entry])
+        self.assertEqual(query.count(), len(results))
+
+    def test_resource_query_statistics(self):
+        """Verify that statistics are counted and refreshed after changes."""
+        rdfs_class = 'http://www.w3.org/2000/01/rdf-schema#Class'
+        collector = get_collector()
+        collector.refresh([''])
+        # nothing has changed, so nothing is counted again
+        self.assertEqual(collector.refresh(['']), [])
+        statistics = Query().get_statistics()
+        self.assertGreater(statistics['predicates'][RDF_TYPE], 0)
+        self.assertGreater(statistics['classes'][rdfs_class], 0)
+        self.assertEqual(Planner.cardinalities[RDF_TYPE],
+                         statistics['predicates'][RDF_TYPE])
+        new_subject = {'skmf:blah':
+                       {'type': 'pfx',
+                        'value':
+                            {'skmf:bleh':
+                                {'type': 'pfx',
+                                 'value':
+                                     [{'type': 'pfx',
+                                       'value': 'skmf:bluh'}]}}}}
+        g.sparql.insert(graphlist={''}, subjectlist=new_subject)
+        # the write advanced the generation of the default graph
+        self.assertEqual(collector.refresh(['']), [''])
+        predicates = Query().get_statistics()['predicates']
+        self.assertEqual(predicates['http://localhost/skmf#bleh'], 1)
+        g.sparql.delete(graphlist={''}, subjectlist=new_subject)
+        collector.refresh([''])
+
+    def test_resource_query_standing(self):
+        """Verify that standing results follow the changes in the log."""
+        blah = 'http://localhost/skmf#blah'
+        new_class = {'skmf:blah':
+                     {'type': 'pfx',
+                      'value':
+                          {'a':
+                              {'type': 'pfx',
+                               'value':
+                                   [{'type': 'pfx',
+                                     'value': 'rdfs:Class'}]}}}}
+        query = Query(labellist = set(), subjectlist = {}, optlist = [])
+        self.assertNotIn((blah, 'blah'), query.get_choices(['rdfs:Class']))
+        seq = get_changelog().last()
+        g.sparql.insert(graphlist={''}, subjectlist=new_class)
+        changes = get_changelog().since(seq)
+        # prefixed names are logged as full URIs
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]['subject'], blah)
+        self.assertEqual(changes[0]['predicate'], RDF_TYPE)
+        choices = query.get_choices(['rdfs:Class'])
+        # the new class is merged into the standing choices, still sorted
+        self.assertIn((blah, 'blah'), choices)
+        names = [choice[1] for choice in choices]
+        self.assertEqual(names, sorted(names))
+        g.sparql.delete(graphlist={''}, subjectlist=new_class)
+        self.assertNotIn((blah, 'blah'), query.get_choices(['rdfs:Class']))
+
+    def test_changelog_retention(self):
+        """Verify that old entries are deleted once no reader needs them."""
+        changelog = ChangeLog(':memory:', 1e-9)
+        triple = ('http://a/s', 'http://a/p',
+                  {'type': 'literal', 'value': 'o'})
+        readers = ChangeLog.readers
+        ChangeLog.readers = [lambda: 1]
+        try:
+            for _ in range(3):
+                changelog.append('INSERT', '', [triple])
+            # entries that follow the one seen by a reader are kept
+            self.assertEqual([change['seq'] for change in changelog.since(1)],
+                             [2, 3])
+            self.assertIsNone(changelog.since(0))
+            ChangeLog.readers = []
+            changelog.prune()
+        finally:
+            ChangeLog.readers = readers
+        # the last entry is always kept, so numbering never starts over
+        self.assertEqual(changelog.latest()[0], 3)
+        self.assertIsNone(changelog.since(1))
+        self.assertEqual([change['seq'] for change in changelog.since(2)], [3])
+
 
 class ResourceSubjectTestCase(BaseTestCase):
     """Unit tests to verify correct behavior of RDF Subjects and methods.
@@ -395,6 +804,98 @@ class ResourceSubjectTestCase(BaseTestCase):
         # 'clone' should no longer pull removed data from triplestore
         self.assertNotIn(self.labelkey, clone.preds)
 
+    def test_resource_subject_batch(self):
+        """Verify that pending subjects are retrieved together and shared."""
+        subject = Subject(self.id)
+        miss = Subject(self.missing)
+        # nothing is retrieved until predicates are needed
+        self.assertIsNone(subject._preds)
+        self.assertIn(self.labelkey, subject.preds)
+        # 'miss' was retrieved in the same batch as 'subject'
+        self.assertIsNotNone(miss._preds)
+        self.assertFalse(miss.preds)
+        clone = Subject(self.id)
+        # a second Subject for the same URI shares the retrieved predicates
+        self.assertIs(clone.preds, subject.preds)
+
+    def test_resource_subject_load_many(self):
+        """Verify that several subjects are constructed in one query."""
+        document = ('<http://a> <http://b> "x \\"y\\"\\u00e9"@en .\n'
+                    '# comment\n'
+                    '_:n <http://b> "1"^^<http://c> .\n')
+        literal, typed = [triple[2] for triple in parse_ntriples(document)]
+        self.assertEqual(literal, {'type': 'literal', 'value': 'x "y"\u00e9',
+                                   'xml:lang': 'en'})
+        self.assertEqual(typed['datatype'], 'http://c')
+        self.assertIsNone(parse_ntriples('<http://a>\n'))
+        # other line separators may appear unescaped within a literal
+        triple = ({'type': 'uri', 'value': 'http://a'},
+                  {'type': 'uri', 'value': 'http://b'},
+                  {'type': 'literal', 'value': 'x\u2028y\x0cz\x85'})
+        self.assertEqual(parse_ntriples(''.join(ntriples([triple]))),
+                         [triple])
+        subject, miss = Subject.load_many([self.id, self.missing])
+        self.assertIn(self.labelkey, subject.preds)
+        self.assertFalse(miss.preds)
+        selected = g.sparql.query_subject(self.id)['results']['bindings']
+        self.assertEqual(set(subject.preds),
+                         {binding['p']['value'] for binding in selected})
+
+    def test_resource_subject_exists(self):
+        """Verify that existence checks match the triplestore."""
+        self.assertTrue(Subject.exists(self.id))
+        self.assertFalse(Subject.exists(self.missing))
+        self.assertEqual(Subject.exists_many([self.id, self.missing]),
+                         {self.id})
+        # a missing subject is known to be empty without another query
+        self.assertFalse(Subject(self.missing).preds)
+        # a change logged by any process makes remembered answers stale
+        key = (self.missing, frozenset(), None)
+        seq = get_changelog().latest({''})[0]
+        self.assertFalse(Subject._recall(key, seq))
+        # another worker's write reaches only the shared log
+        get_changelog().append('INSERT', '', [(self.missing, RDF_TYPE,
+                                               {'type': 'uri',
+                                                'value': self.id})])
+        self.assertIsNone(
+            Subject._recall(key, get_changelog().latest({''})[0]))
+
+    def test_resource_subject_neighborhood(self):
+        """Verify that neighborhoods are expanded breadth-first and bounded."""
+        rdfs_class = 'http://www.w3.org/2000/01/rdf-schema#Class'
+        subgraph = Subject(self.id).neighborhood(depth=1, direction='out')
+        # skmf:User is one link away from its class, rdfs:Class
+        self.assertEqual(subgraph['nodes'][self.id], 0)
+        self.assertEqual(subgraph['nodes'][rdfs_class], 1)
+        self.assertIn((self.id, RDF_TYPE, rdfs_class), subgraph['edges'])
+        subgraph = Subject(rdfs_class).neighborhood(depth=2, direction='in',
+                                                    predicates=['a'])
+        # skmf:User is reached through an incoming rdf:type link
+        self.assertEqual(subgraph['nodes'][self.id], 1)
+        for edge in subgraph['edges']:
+            self.assertEqual(edge[1], RDF_TYPE)
+        subgraph = Subject(rdfs_class).neighborhood(depth=3, max_nodes=2)
+        # expansion stops once enough subjects have been visited
+        self.assertEqual(len(subgraph['nodes']), 2)
+
+    def test_resource_subject_links(self):
+        """Verify that link counts agree with the pages of links they count."""
+        rdfs_class = 'http://www.w3.org/2000/01/rdf-schema#Class'
+        subject = Subject(self.id)
+        outgoing = subject.count_links('out')
+        self.assertEqual(outgoing[RDF_TYPE], 1)
+        self.assertEqual(subject.get_links(RDF_TYPE),
+                         [{'type': 'uri', 'value': rdfs_class}])
+        hub = Subject(rdfs_class)
+        incoming = hub.count_links('in')
+        # every class is an incoming link of rdfs:Class, including skmf:User
+        first = hub.get_links(RDF_TYPE, 'in', limit=1)
+        rest = hub.get_links(RDF_TYPE, 'in', offset=1)
+        self.assertEqual(len(first), 1)
+        self.assertEqual(len(first) + len(rest), incoming[RDF_TYPE])
+        self.assertNotIn(first[0], rest)
+        self.assertIn({'type': 'uri', 'value': self.id}, first + rest)
+
 
 class ResourceUserTestCase(BaseTestCase):
     """Unit tests to verify correct behavior of SKMF Users and methods.
@@ -420,6 +921,192 @@ class ResourceUserTestCase(BaseTestCase):
         self.assertEqual(user.get_hash(), self.hashpass)
         self.assertEqual(user.get_name(), self.realname)
 
+    def test_resource_user_exists(self):
+        """Verify that only registered users are reported to exist."""
+        self.assertTrue(User.exists(self.username))
+        self.assertFalse(User.exists('bob'))
+        self.assertEqual(User.exists_many([self.username, 'bob']),
+                         {self.username})
+
+
+class ApiTestCase(BaseTestCase):
+    """Unit tests to verify correct behavior of the JSON query interface.
+    
+    Validate paging, conditional requests, and input checking of API views.
+    """
+    
+    iri = 'http://localhost/skmf#User'
+    entries = [{'subject': {'type': 'uri', 'value': iri},
+                'predicate': {'type': 'label', 'value': 'p'},
+                'object': {'type': 'label', 'value': 'o'}}]
+
+    def test_api_subject(self):
+        """Verify that subject triples are paged and conditionally served."""
+        response = self.client.get(url_for('api_subject', iri=self.iri,
+                                           limit=1))
+        self.assert200(response)
+        page = json.loads(response.data.decode('utf-8'))
+        # skmf:User has more than one triple, so a second page is linked
+        self.assertEqual(len(page['results']), 1)
+        self.assertTrue(page['next'])
+        etag = response.headers['ETag']
+        response = self.client.get(url_for('api_subject', iri=self.iri,
+                                           limit=1),
+                                   headers={'If-None-Match': etag})
+        self.assertStatus(response, 304)
+        second = json.loads(self.client.get(page['next']).data.decode('utf-8'))
+        self.assertNotEqual(second['results'], page['results'])
+        self.assert400(self.client.get(url_for('api_subject', iri='<bad>')))
+        self.assert400(self.client.get(url_for('api_subject', iri=self.iri,
+                                               graph='x> FROM <y')))
+        self.assert403(self.client.get(url_for('api_subject', iri=self.iri,
+                                               graph='users')))
+
+    def test_api_query(self):
+        """Verify that posted triples are queried and checked."""
+        response = self.client.post(url_for('api_query'),
+                                    data=json.dumps(self.entries),
+                                    content_type='application/json')
+        self.assert200(response)
+        page = json.loads(response.data.decode('utf-8'))
+        self.assertIn('p', page['head']['vars'])
+        self.assertTrue(page['results'])
+        bad_entries = [{'subject': {'type': 'label', 'value': 's } .'},
+                        'predicate': {'type': 'label', 'value': 'p'},
+                        'object': {'type': 'label', 'value': 'o'}}]
+        response = self.client.post(url_for('api_query'),
+                                    data=json.dumps(bad_entries),
+                                    content_type='application/json')
+        self.assert400(response)
+        bad_entries[0]['subject']['value'] = 's'
+        bad_entries[0]['predicate'] = {'type': 'path', 'value': '((rdfs:x'}
+        response = self.client.post(url_for('api_query'),
+                                    data=json.dumps(bad_entries),
+                                    content_type='application/json')
+        self.assert400(response)
+
+    def test_api_query_events(self):
+        """Verify that a saved query streams a snapshot of its results."""
+        response = self.client.post(url_for('api_query_save'),
+                                    data=json.dumps(self.entries),
+                                    content_type='application/json')
+        self.assertNotEqual(response.status_code, 200)
+        with self.client:
+            self.login('admin', 'default')
+            response = self.client.post(url_for('api_query_save'),
+                                        data=json.dumps(self.entries),
+                                        content_type='application/json')
+            self.assert200(response)
+            saved = json.loads(response.data.decode('utf-8'))
+            again = self.client.post(url_for('api_query_save'),
+                                     data=json.dumps(self.entries),
+                                     content_type='application/json')
+            self.assertEqual(json.loads(again.data.decode('utf-8'))['id'],
+                             saved['id'])
+            response = self.client.get(saved['events'], buffered=False)
+            self.assert200(response)
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            chunk = next(response.iter_encoded()).decode('utf-8')
+            response.close()
+            self.assertTrue(chunk.startswith('event: snapshot\n'))
+            data = json.loads(chunk.split('data: ', 1)[1])
+            self.assertTrue(data['results'])
+            self.assert404(self.client.get(url_for('api_query_events',
+                                                   query_id='unknown')))
+            hub = get_hub()
+            limit = hub.limit
+            hub.limit = 0
+            try:
+                self.assertEqual(
+                    self.client.get(saved['events']).status_code, 503)
+            finally:
+                hub.limit = limit
+            self.logout()
+        # streams need a login too
+        self.assertNotEqual(self.client.get(saved['events']).status_code,
+                            200)
+        # a subscriber that falls behind is dropped and told so
+        name = ('saved', saved['id'])
+        queue, snapshot = hub.subscribe(name, g.sparql)
+        with hub._lock:
+            hub._drop(name, queue)
+        self.assertIsNone(queue.get_nowait())
+        hub.unsubscribe(name, queue)
+        max_queries = app.config['STANDING_MAX_QUERIES']
+        app.config['STANDING_MAX_QUERIES'] = 1
+        try:
+            StandingQuery.register(('unused', 0), StandingQuery())
+            self.assertIsNone(StandingQuery.lookup(('saved', saved['id'])))
+        finally:
+            app.config['STANDING_MAX_QUERIES'] = max_queries
+
+    def test_api_job(self):
+        """Verify that a bulk edit is written in batches by a queued job."""
+        comment = {'type': 'pfx', 'value': 'rdfs:comment'}
+        triples = [{'subject': {'type': 'pfx', 'value': 'skmf:job'},
+                    'predicate': comment,
+                    'object': {'type': 'literal', 'value': str(number)}}
+                   for number in range(5)]
+        job = {'action': 'INSERT', 'triples': triples}
+        response = self.client.post(url_for('api_job_submit'),
+                                    data=json.dumps(job),
+                                    content_type='application/json')
+        self.assertNotEqual(response.status_code, 202)
+        queue = get_queue()
+        batch_size = queue.batch_size
+        with self.client:
+            self.login('admin', 'default')
+            response = self.client.post(url_for('api_job_submit'),
+                                        data=json.dumps(job),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 202)
+            submitted = json.loads(response.data.decode('utf-8'))
+            status = json.loads(self.client.get(
+                submitted['status']).data.decode('utf-8'))
+            self.assertEqual(status['status'], 'queued')
+            queue.batch_size = 2
+            try:
+                self.assertIn(submitted['id'], queue.work())
+            finally:
+                queue.batch_size = batch_size
+            status = json.loads(self.client.get(
+                submitted['status']).data.decode('utf-8'))
+            self.assertEqual(status['status'], 'done')
+            self.assertEqual((status['done'], status['progress']), (5, 1.0))
+            self.assert403(self.client.post(
+                url_for('api_job_submit', graph='users'),
+                data=json.dumps(job), content_type='application/json'))
+            self.assert400(self.client.post(
+                url_for('api_job_submit', graph='x> } ; DROP ALL ; #'),
+                data=json.dumps(job), content_type='application/json'))
+            job['action'] = 'REPLACE'
+            self.assert400(self.client.post(url_for('api_job_submit'),
+                                            data=json.dumps(job),
+                                            content_type='application/json'))
+            self.logout()
+        cleanup = queue.submit('DELETE', {''}, triples)
+        queue.work()
+        self.assertEqual(queue.status(cleanup)['status'], 'done')
+        self.assert404(self.client.get(url_for('api_job', job_id=0)))
+
+    def test_job_lease(self):
+        """Verify that queues sharing a database claim each job only once."""
+        directory = tempfile.mkdtemp()
+        try:
+            database = os.path.join(directory, 'jobs.db')
+            first = JobQueue(database, 0, 100, 0, lease=60)
+            second = JobQueue(database, 0, 100, 0, lease=60)
+            job_id = first.submit('INSERT', {''}, [])
+            self.assertEqual(first._claim(), job_id)
+            self.assertIsNone(second._claim())
+            self.assertEqual(second.work(), [])
+            first._set(job_id, lease=0)
+            self.assertEqual(second._claim(), job_id)
+            self.assertFalse(first._renew(job_id, 0))
+            self.assertTrue(second._renew(job_id, 0))
+        finally:
+            shutil.rmtree(directory)
+
 
 class FlaskTestCase(BaseTestCase):
     """Unit tests to verify the correct behavior of Flask views and templates.
@@ -490,5 +1177,113 @@ class FlaskTestCase(BaseTestCase):
             self.assertTemplateUsed('users.html')
             self.assertContext('title', uiLabel.viewUserTitle)
 
+    def test_show_subject_conditional(self):
+        """Verify that subject pages are revalidated against graph changes."""
+        subject = 'http://localhost/skmf#User'
+        response = self.client.get(url_for('show_subject', subject=subject))
+        self.assert200(response)
+        etag = response.headers['ETag']
+        response = self.client.get(url_for('show_subject', subject=subject),
+                                   headers={'If-None-Match': etag})
+        # nothing has been written, so the page has not changed
+        self.assertStatus(response, 304)
+        new_subject = {'skmf:blah':
+                       {'type': 'pfx',
+                        'value':
+                            {'skmf:bleh':
+                                {'type': 'pfx',
+                                 'value':
+                                     [{'type': 'pfx',
+                                       'value': 'skmf:bluh'}]}}}}
+        g.sparql.insert(graphlist={'scratch'}, subjectlist=new_subject)
+        g.sparql.delete(graphlist={'scratch'}, subjectlist=new_subject)
+        response = self.client.get(url_for('show_subject', subject=subject),
+                                   headers={'If-None-Match': etag})
+        # writes to graphs that the page does not show keep it valid
+        self.assertStatus(response, 304)
+        self.assertNotIn('Last-Modified', response.headers)
+        g.sparql.insert(graphlist={''}, subjectlist=new_subject)
+        g.sparql.delete(graphlist={''}, subjectlist=new_subject)
+        response = self.client.get(url_for('show_subject', subject=subject),
+                                   headers={'If-None-Match': etag})
+        # any write to the default graph invalidates the old ETag
+        self.assert200(response)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assert400(self.client.get(url_for('show_subject',
+                                               subject='<bad>')))
+
+    def test_show_links(self):
+        """Verify that links are listed one page at a time."""
+        subject = 'http://www.w3.org/2000/01/rdf-schema#Class'
+        response = self.client.get(url_for('show_subject', subject=subject))
+        self.assertTemplateUsed('show_subject.html')
+        self.assertIn(RDF_TYPE, self.get_context_variable('incoming'))
+        response = self.client.get(url_for('show_links', subject=subject,
+                                           predicate=RDF_TYPE,
+                                           direction='in'))
+        self.assert200(response)
+        links = self.get_context_variable('links')
+        self.assertTrue(links)
+        self.assertLessEqual(len(links), app.config['SUBJECT_PAGE_SIZE'])
+        response = self.client.get(url_for('show_links', subject=subject,
+                                           predicate=RDF_TYPE,
+                                           direction='sideways'))
+        self.assert400(response)
+
+    def test_show_stats(self):
+        """Verify that the statistics page renders the collected counts."""
+        get_collector().refresh([''])
+        self.assert200(self.client.get(url_for('show_stats')))
+        self.assertTemplateUsed('stats.html')
+        predicates = dict(self.get_context_variable('predicates'))
+        self.assertIn(RDF_TYPE, predicates)
+        self.assertIn('p99', self.get_context_variable('latency')['answered'])
+
+    def test_neighborhood(self):
+        """Verify that the neighborhood page renders and checks arguments."""
+        subject = 'http://localhost/skmf#User'
+        response = self.client.get(url_for('neighborhood', subject=subject,
+                                           depth=2))
+        self.assert200(response)
+        self.assertIn(b'http://www.w3.org/2000/01/rdf-schema#Class',
+                      response.data)
+        response = self.client.get(url_for('neighborhood', subject=subject,
+                                           depth=0))
+        self.assert400(response)
+        response = self.client.get(url_for('neighborhood',
+                                           subject='> } DROP ALL'))
+        self.assert400(response)
+
+    def test_export_entries(self):
+        """Verify that query results are streamed in the requested format."""
+        data = dict(resource='http://localhost/skmf#User',
+                    free_conn='p', free_target='o')
+        response = self.client.post(url_for('export_entries', format='csv'),
+                                    data=data)
+        self.assert200(response)
+        self.assertEqual(response.mimetype, 'text/csv')
+        lines = response.data.decode('utf-8').splitlines()
+        # header holds each placeholder followed by its rdfs:label column
+        self.assertEqual(lines[0], 'o,o_label,p,p_label')
+        self.assertTrue(len(lines) > 1)
+        response = self.client.post(url_for('export_entries',
+                                            format='ndjson'), data=data)
+        self.assert200(response)
+        for line in response.data.decode('utf-8').splitlines():
+            self.assertIn('p', json.loads(line))
+        response = self.client.post(url_for('export_entries', format='xml'),
+                                    data=data)
+        self.assert400(response)
+        data['resource'] = 'http://localhost/skmf#Unknown'
+        response = self.client.post(url_for('export_entries', format='csv'),
+                                    data=data)
+        self.assert400(response)
+        # a failed query answers None instead of raising
+        query = Query(labellist = set(), subjectlist = {}, optlist = [])
+        failed = [{'subject': {'type': 'label', 'value': 's'},
+                   'predicate': {'type': 'path', 'value': '((rdfs:label'},
+                   'object': {'type': 'label', 'value': 'o'}}]
+        self.assertIsNone(query.get_entries(failed))
+
 if __name__ == '__main__':
     unittest.main()
@@ -16,35 +16,208 @@ Functions:
     add_conn: Insert one RDF triple through the SPARQL endpoint.
     add_tag: Create a new tag to store with the SPARQL endpoint.
     add_user: Create a new user to store with the SPARQL endpoint.
+    export_entries: Stream query results as a CSV or NDJSON download.
     load_user: Retrieve a user from the triplestore for login authentication.
     login: Authenticate and create a session for a valid user.
     logout: Clear the session for a logged in user.
+    neighborhood: Display the subgraph surrounding a single RDF subject.
     page_not_found: Handle user attempts to access an invalid path.
     resources: View and manage resources in the datastore.
+    show_links: Display one page of the links of a single RDF subject.
+    show_stats: Display the number of triples and instances in the store.
     show_subject: Display all triples for a single RDF subject.
     welcome: Display a basic landing page.
 """
 
+import csv
+import hashlib
+import io
+import json
+import re
+from collections import OrderedDict
+from threading import Lock
 from time import sleep
 
-from flask import render_template, request, redirect, url_for, flash
+from flask import Response, abort, flash, g, make_response, redirect, \
+                  render_template, request, session, stream_with_context, \
+                  url_for
 from flask.ext.bcrypt import Bcrypt
 from flask.ext.login import LoginManager, login_required, login_user, \
                             logout_user, current_user
+from werkzeug.http import is_resource_modified
 
 from skmf import app, forms
+from skmf.api import TERM_PATTERNS
+from skmf.changelog import get_changelog
+from skmf.events import save_query
 from skmf.resource import Query, Subject, User
+from skmf.sparqler import SPARQLER, format_path, gather
 import skmf.i18n.en_US as uiLabel
 
 bcrypt = Bcrypt(app)
 """Password hash management for secure user sessions and persistence."""
 
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+"""dict: Media types of the formats supported for streamed result exports."""
+
+RESOURCE_CATEGORIES = ['skmf:Resource']
+"""list: Categories whose instances are offered as query resources."""
+
+CONNECTION_CATEGORIES = ['rdf:Property', 'owl:ObjectProperty',
+                         'owl:DatatypeProperty']
+"""list: Categories whose instances are offered as query connections."""
+
+TARGET_CATEGORIES = ['rdfs:Class', 'owl:Class']
+"""list: Categories whose instances are offered as query targets."""
+
+PATH_OPERATORS = re.compile(r'[:/|^*+?()!<]')
+"""Pattern: Matches text that marks a free-form connection as a path."""
+
+page_cache = OrderedDict()
+"""OrderedDict: Rendered subject pages by ETag, least recently used first."""
+
+page_cache_lock = Lock()
+"""Lock: Guard for page_cache, which is shared by concurrent requests."""
+
 login_manager = LoginManager()
 """User session manager and token handler."""
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 
+def _choice_lists(query):
+    """Return the dropdown choices for resources, connections, and targets.
+    
+    Each list is filtered, deduplicated, and sorted by the endpoint, which
+    answers one query per list. The rdf:type connection is always offered,
+    under the name 'A', in its sorted position among the other connections.
+    
+    Args:
+        query (Query): Query scoped to the graphs that hold the choices.
+    
+    Returns:
+        Tuple of lists of (URI, name) tuples for the three kinds of choice.
+    """
+    res_sorted = query.get_choices(RESOURCE_CATEGORIES)
+    conn_sorted = query.get_choices(CONNECTION_CATEGORIES)
+    targ_sorted = query.get_choices(TARGET_CATEGORIES)
+    type_choice = ('http://www.w3.org/1999/02/22-rdf-syntax-ns#type', 'A')
+    if type_choice not in conn_sorted:
+        position = next((index for index, choice in enumerate(conn_sorted)
+                         if choice[1] > type_choice[1]), len(conn_sorted))
+        conn_sorted.insert(position, type_choice)
+    return res_sorted, conn_sorted, targ_sorted
+
+
+def _fill_choices(field, choices, title):
+    """Set the choices of a dropdown list, led by its title and separators.
+    
+    The title choice has an empty value, which the forms treat as no
+    selection. The separator choices are rejected by the form validators.
+    
+    Args:
+        choices (list): Sorted (URI, name) tuples to offer in the list.
+        field (SelectField): Dropdown list to populate.
+        title (str): Text to show when nothing is selected.
+    """
+    field.choices = [('', title), ('-', '---'), (' ', '')] + choices
+
+
+def _fill_query_form(query_form, res_sorted, conn_sorted, targ_sorted):
+    """Set the choices of every dropdown list of a FindEntryForm.
+    
+    Args:
+        conn_sorted (list): Sorted (URI, name) tuples of connections.
+        query_form (FindEntryForm): Form to populate.
+        res_sorted (list): Sorted (URI, name) tuples of resources.
+        targ_sorted (list): Sorted (URI, name) tuples of targets.
+    """
+    _fill_choices(query_form.resource, res_sorted, 'Resource')
+    _fill_choices(query_form.connection, conn_sorted, 'Connection')
+    _fill_choices(query_form.target, targ_sorted, 'Target')
+    _fill_choices(query_form.resource_2, res_sorted, 'Resource')
+    _fill_choices(query_form.connection_2, conn_sorted, 'Connection')
+    _fill_choices(query_form.target_2, targ_sorted, 'Target')
+
+
+def _form_triples(query_form):
+    """Return the list of query triples described by a FindEntryForm.
+    
+    Each row of the form provides a subject, predicate, and object. The drop-
+    down list takes priority over the free-form text field for each of them,
+    so a selected value is treated as an URI and a typed value is treated as a
+    placeholder label. A typed connection that holds a prefixed name or a path
+    operator is treated as a property path instead, such as 'rdfs:subClassOf+'
+    to follow a hierarchy of any depth. The result is in the format expected
+    by the 'get_entries' method of Query. Typed text that is neither a valid
+    placeholder label nor a valid property path is refused.
+    
+    Args:
+        query_form (FindEntryForm): Submitted form holding the query rows.
+    
+    Returns:
+        List of dicts with 'subject', 'predicate', and 'object' keys, or None
+        if any typed text is not valid.
+    """
+    rows = [(query_form.resource, query_form.free_res,
+             query_form.connection, query_form.free_conn,
+             query_form.target, query_form.free_target),
+            (query_form.resource_2, query_form.free_res_2,
+             query_form.connection_2, query_form.free_conn_2,
+             query_form.target_2, query_form.free_target_2)]
+    triples = []
+    for res, free_res, conn, free_conn, targ, free_targ in rows:
+        triple = {}
+        for part, field, free in (('subject', res, free_res),
+                                  ('predicate', conn, free_conn),
+                                  ('object', targ, free_targ)):
+            term = {}
+            if field.data:
+                term['type'] = 'uri'
+                term['value'] = field.data
+            elif part == 'predicate' and PATH_OPERATORS.search(free.data):
+                if format_path(free.data) is None:
+                    return None
+                term['type'] = 'path'
+                term['value'] = free.data
+            else:
+                if free.data and not TERM_PATTERNS['label'].match(free.data):
+                    return None
+                term['type'] = 'label'
+                term['value'] = free.data
+            triple[part] = term
+        triples.append(triple)
+    return triples
+
+
+def _format_entry(binding):
+    """Return one query result reshaped for display or export.
+    
+    Every placeholder that is not itself an rdfs:label placeholder becomes a
+    dict holding its 'value'. URIs also carry a 'uri' key and, when the query
+    returned an rdfs:label for the placeholder, a 'tag' key holds that label.
+    
+    Args:
+        binding (dict): One binding from the JSON results of a SPARQL query.
+    
+    Returns:
+        dict of placeholder labels to their display values.
+    """
+    new_entry = {}
+    for label in binding:
+        if '_label' not in label:
+            item = {}
+            value = binding[label]['value']
+            item['value'] = value
+            if binding[label]['type'] == 'uri':
+                item['uri'] = value
+            tag = binding.get('{}_label'.format(label), {})
+            if 'value' in tag:
+                item['tag'] = tag['value']
+            new_entry[label] = item
+    return new_entry
+
+
 @app.route('/')
 @app.route('/index')
 def welcome():
@@ -66,175 +239,62 @@ def resources():
     are capable of providing the same level of dynamic query building as is
     supported by the backend.
     
+    The number of resources in each category is always shown, and the total
+    number of results is shown along with the results of a query. Both are
+    computed by aggregate queries, without transferring extra results. When
+    an asynchronous connection is available, the counts and the query are all
+    sent at once, so the page waits only for the slowest of them.
+    
     Returns:
         Rendered page containing forms and query results, if any.
     """
     entries = None
+    hit_count = None
     print('entering entries')
     # Failure to set explicit parameters leads to broken garbage collection
     query = Query(labellist = set(), subjectlist = {}, optlist = [])
     print('empty query')
-    rdfs_class = query.get_resources('rdfs:Class')
-    owl_class = query.get_resources('owl:Class')
-    owl_obj_prop = query.get_resources('owl:ObjectProperty')
-    owl_dtype_prop = query.get_resources('owl:DatatypeProperty')
-    rdf_property = query.get_resources('rdf:Property')
-    skmf_resource = query.get_resources('skmf:Resource')
+    sparql = g.async_sparql or g.sparql
+    pending = [query.count_categories(RESOURCE_CATEGORIES
+                                      + CONNECTION_CATEGORIES
+                                      + TARGET_CATEGORIES, sparql)]
+    res_sorted, conn_sorted, targ_sorted = _choice_lists(query)
     print('resources gathered')
     query_form = forms.FindEntryForm()
     print('empty FindEntryForm')
-    res_choices = set()
-    for res in skmf_resource:
-        if res['resource']['type'] != 'bnode':
-            res_choices.add((res['resource']['value'],
-                          res['label']['value'] if 'value' in res['label'] else res['resource']['value'].partition('#')[2]))
-    res_sorted = sorted(list(res_choices), key=lambda x: x[1])
-    conn_choices = set()
-    for conn in rdf_property:
-        if conn['resource']['type'] != 'bnode':
-            conn_choices.add((conn['resource']['value'],
-                        conn['label']['value'] if 'value' in conn['label'] else conn['resource']['value'].partition('#')[2]))
-    for conn in owl_obj_prop:
-        if conn['resource']['type'] != 'bnode':
-            conn_choices.add((conn['resource']['value'],
-                        conn['label']['value'] if 'value' in conn['label'] else conn['resource']['value'].partition('#')[2]))
-    for conn in owl_dtype_prop:
-        if conn['resource']['type'] != 'bnode':
-            conn_choices.add((conn['resource']['value'],
-                        conn['label']['value'] if 'value' in conn['label'] else conn['resource']['value'].partition('#')[2]))
-    conn_choices.add(('http://www.w3.org/1999/02/22-rdf-syntax-ns#type', 'A'))
-    conn_sorted = sorted(list(conn_choices), key=lambda x: x[1])
-    targ_choices = set()
-    for targ in rdfs_class:
-        if targ['resource']['type'] != 'bnode':
-            targ_choices.add((targ['resource']['value'],
-                        targ['label']['value'] if 'value' in targ['label'] else targ['resource']['value'].partition('#')[2]))
-    for targ in owl_class:
-        if targ['resource']['type'] != 'bnode':
-            targ_choices.add((targ['resource']['value'],
-                        targ['label']['value'] if 'value' in targ['label'] else targ['resource']['value'].partition('#')[2]))
-    targ_sorted = sorted(list(targ_choices), key=lambda x: x[1])
-    print('resources sorted')
-    query_form.resource.choices = res_sorted[:]
-    query_form.resource.choices.insert(0, (' ', ''))
-    query_form.resource.choices.insert(0, ('-', '---'))
-    query_form.resource.choices.insert(0, ('', 'Resource'))
-    query_form.connection.choices = conn_sorted[:]
-    query_form.connection.choices.insert(0, (' ', ''))
-    query_form.connection.choices.insert(0, ('-', '---'))
-    query_form.connection.choices.insert(0, ('', 'Connection'))
-    query_form.target.choices = targ_sorted[:]
-    query_form.target.choices.insert(0, (' ', ''))
-    query_form.target.choices.insert(0, ('-', '---'))
-    query_form.target.choices.insert(0, ('', 'Target'))
-    query_form.resource_2.choices = res_sorted[:]
-    query_form.resource_2.choices.insert(0, (' ', ''))
-    query_form.resource_2.choices.insert(0, ('-', '---'))
-    query_form.resource_2.choices.insert(0, ('', 'Resource'))
-    query_form.connection_2.choices = conn_sorted[:]
-    query_form.connection_2.choices.insert(0, (' ', ''))
-    query_form.connection_2.choices.insert(0, ('-', '---'))
-    query_form.connection_2.choices.insert(0, ('', 'Connection'))
-    query_form.target_2.choices = targ_sorted[:]
-    query_form.target_2.choices.insert(0, (' ', ''))
-    query_form.target_2.choices.insert(0, ('-', '---'))
-    query_form.target_2.choices.insert(0, ('', 'Target'))
+    _fill_query_form(query_form, res_sorted, conn_sorted, targ_sorted)
     print('FindEntryForm populated')
     insert_form = forms.AddEntryForm()
     print('empty AddEntryForm')
     update_form = forms.AddConnectionForm()
     print('empty AddConnectionForm')
-    update_form.resource.choices = res_sorted[:]
-    update_form.resource.choices.insert(0, (' ', ''))
-    update_form.resource.choices.insert(0, ('-', '---'))
-    update_form.resource.choices.insert(0, ('', 'Resource'))
-    update_form.connection.choices = conn_sorted[:]
-    update_form.connection.choices.insert(0, (' ', ''))
-    update_form.connection.choices.insert(0, ('-', '---'))
-    update_form.connection.choices.insert(0, ('', 'Connection'))
-    update_form.target.choices = targ_sorted[:]
-    update_form.target.choices.insert(0, (' ', ''))
-    update_form.target.choices.insert(0, ('-', '---'))
-    update_form.target.choices.insert(0, ('', 'Target'))
+    _fill_choices(update_form.resource, res_sorted, 'Resource')
+    _fill_choices(update_form.connection, conn_sorted, 'Connection')
+    _fill_choices(update_form.target, targ_sorted, 'Target')
     print('AddConnectionForm populated')
     if query_form.validate_on_submit():
         print('wrong form submitted')
-        if query_form.target.data:
-            rdf_object = {}
-            rdf_object['type'] = 'uri'
-            rdf_object['value'] = query_form.target.data
-        else:
-            rdf_object = {}
-            rdf_object['type'] = 'label'
-            rdf_object['value'] = query_form.free_target.data
-        if query_form.connection.data:
-            rdf_pred = {}
-            rdf_pred['type'] = 'uri'
-            rdf_pred['value'] = query_form.connection.data
-        else:
-            rdf_pred = {}
-            rdf_pred['type'] = 'label'
-            rdf_pred['value'] = query_form.free_conn.data
-        if query_form.resource.data:
-            rdf_subject = {}
-            rdf_subject['type'] = 'uri'
-            rdf_subject['value'] = query_form.resource.data
-        else:
-            rdf_subject = {}
-            rdf_subject['type'] = 'label'
-            rdf_subject['value'] = query_form.free_res.data
-        triples = []
-        triple = {}
-        triple['object'] = rdf_object
-        triple['predicate'] = rdf_pred
-        triple['subject'] = rdf_subject
-        triples.append(triple)
-        if query_form.target_2.data:
-            rdf_object_2 = {}
-            rdf_object_2['type'] = 'uri'
-            rdf_object_2['value'] = query_form.target_2.data
-        else:
-            rdf_object_2 = {}
-            rdf_object_2['type'] = 'label'
-            rdf_object_2['value'] = query_form.free_target_2.data
-        if query_form.connection_2.data:
-            rdf_pred_2 = {}
-            rdf_pred_2['type'] = 'uri'
-            rdf_pred_2['value'] = query_form.connection_2.data
-        else:
-            rdf_pred_2 = {}
-            rdf_pred_2['type'] = 'label'
-            rdf_pred_2['value'] = query_form.free_conn_2.data
-        if query_form.resource_2.data:
-            rdf_subject_2 = {}
-            rdf_subject_2['type'] = 'uri'
-            rdf_subject_2['value'] = query_form.resource_2.data
-        else:
-            rdf_subject_2 = {}
-            rdf_subject_2['type'] = 'label'
-            rdf_subject_2['value'] = query_form.free_res_2.data
-        triple_2 = {}
-        triple_2['object'] = rdf_object_2
-        triple_2['predicate'] = rdf_pred_2
-        triple_2['subject'] = rdf_subject_2
-        triples.append(triple_2)
         entries = []
-        temp = query.get_entries(triples)
+        entrylist = _form_triples(query_form)
+        if entrylist is None:
+            flash(uiLabel.viewQueryInvalid)
+        else:
+            if query_form.save.data and current_user.get_id() is not None:
+                query_id = save_query(entrylist,
+                                      owner=current_user.get_id())
+                flash('{0!s} {1!s}'.format(
+                    uiLabel.viewQuerySaved,
+                    url_for('api_query_events', query_id=query_id)))
+            pending.append(query.get_entries(entrylist, sparql=sparql))
+            pending.append(query.count(sparql))
+    category_counts, *found = gather(*pending)
+    if found:
+        temp, hit_count = found
+        if temp is None:
+            flash(uiLabel.viewQueryFailed)
+            temp = []
         for entry in temp:
-            new_entry = {}
-            for label in entry:
-                if '_label' not in label:
-                    item = {}
-                    value = entry[label]['value']
-                    item['value'] = value
-                    if entry[label]['type'] == 'uri':
-                        uri = value
-                        item['uri'] = uri
-                    if 'value' in entry['{}_label'.format(label)]:
-                        tag = entry['{}_label'.format(label)]['value']
-                        item['tag'] = tag
-                    new_entry[label] = item
-            entries.append(new_entry)
+            entries.append(_format_entry(entry))
 #    if update_form.validate_on_submit():
 #        resource = Subject(update_form.resource.data)
 #        property = update_form.connection.data
@@ -258,7 +318,76 @@ def resources():
 #        resource.add_data(graphlist={''}, predlist=pred_list)
     return render_template('resources.html', title=uiLabel.viewTagTitle,
                            entries=entries, query_form=query_form,
-                           insert_form=insert_form, update_form=update_form)
+                           insert_form=insert_form, update_form=update_form,
+                           hit_count=hit_count,
+                           category_counts=category_counts)
+
+
+@app.route('/export', methods=['POST'])
+def export_entries():
+    """Stream the results of a resource query as CSV or NDJSON.
+    
+    The same FindEntryForm that drives the 'resources' view is read from the
+    request and validated the same way, against the same dropdown choices.
+    Results are written one row at a time through a streaming response
+    instead of being reshaped into a table and rendered by a template. The
+    'format' argument selects 'csv' (default) or 'ndjson'. CSV has a column
+    for each placeholder and another for its rdfs:label, while each NDJSON
+    line matches one entry of the HTML table. An invalid form is refused, and
+    a query that the endpoint fails to answer is reported before streaming
+    begins.
+    
+    Returns:
+        Streamed attachment holding one line per query result.
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        abort(400)
+    # Failure to set explicit parameters leads to broken garbage collection
+    query = Query(labellist = set(), subjectlist = {}, optlist = [])
+    query_form = forms.FindEntryForm()
+    _fill_query_form(query_form, *_choice_lists(query))
+    if not query_form.validate_on_submit():
+        abort(400)
+    entrylist = _form_triples(query_form)
+    if entrylist is None:
+        abort(400)
+    bindings = query.get_entries(entrylist)
+    if bindings is None:
+        abort(502)
+    columns = sorted(label for label in query.labels if '_label' not in label)
+
+    def generate_csv():
+        line = io.StringIO()
+        writer = csv.writer(line)
+        header = []
+        for label in columns:
+            header.extend([label, '{}_label'.format(label)])
+        writer.writerow(header)
+        yield line.getvalue()
+        for binding in bindings:
+            line.seek(0)
+            line.truncate()
+            row = []
+            for label in columns:
+                row.append(binding.get(label, {}).get('value', ''))
+                tag = binding.get('{}_label'.format(label), {})
+                row.append(tag.get('value', ''))
+            writer.writerow(row)
+            yield line.getvalue()
+
+    def generate_ndjson():
+        for binding in bindings:
+            yield '{}\n'.format(json.dumps(_format_entry(binding)))
+
+    if export_format == 'ndjson':
+        rows = generate_ndjson()
+    else:
+        rows = generate_csv()
+    disposition = 'attachment; filename=entries.{}'.format(export_format)
+    return Response(stream_with_context(rows),
+                    mimetype=EXPORT_FORMATS[export_format],
+                    headers={'Content-Disposition': disposition})
 
 
 @app.route('/add', methods=['POST'])
@@ -301,56 +430,11 @@ def add_conn():
     """
     # Failure to set explicit parameters leads to broken garbage collection
     query = Query(labellist = set(), subjectlist = {}, optlist = [])
-    rdfs_class = query.get_resources('rdfs:Class')
-    owl_class = query.get_resources('owl:Class')
-    owl_obj_prop = query.get_resources('owl:ObjectProperty')
-    owl_dtype_prop = query.get_resources('owl:DatatypeProperty')
-    rdf_property = query.get_resources('rdf:Property')
-    skmf_resource = query.get_resources('skmf:Resource')
-    res_choices = set()
-    for res in skmf_resource:
-        if res['resource']['type'] != 'bnode':
-            res_choices.add((res['resource']['value'],
-                          res['label']['value'] if 'value' in res['label'] else res['resource']['value'].partition('#')[2]))
-    res_sorted = sorted(list(res_choices), key=lambda x: x[1])
-    conn_choices = set()
-    for conn in rdf_property:
-        if conn['resource']['type'] != 'bnode':
-            conn_choices.add((conn['resource']['value'],
-                        conn['label']['value'] if 'value' in conn['label'] else conn['resource']['value'].partition('#')[2]))
-    for conn in owl_obj_prop:
-        if conn['resource']['type'] != 'bnode':
-            conn_choices.add((conn['resource']['value'],
-                        conn['label']['value'] if 'value' in conn['label'] else conn['resource']['value'].partition('#')[2]))
-    for conn in owl_dtype_prop:
-        if conn['resource']['type'] != 'bnode':
-            conn_choices.add((conn['resource']['value'],
-                        conn['label']['value'] if 'value' in conn['label'] else conn['resource']['value'].partition('#')[2]))
-    conn_choices.add(('http://www.w3.org/1999/02/22-rdf-syntax-ns#type', 'A'))
-    conn_sorted = sorted(list(conn_choices), key=lambda x: x[1])
-    targ_choices = set()
-    for targ in rdfs_class:
-        if targ['resource']['type'] != 'bnode':
-            targ_choices.add((targ['resource']['value'],
-                        targ['label']['value'] if 'value' in targ['label'] else targ['resource']['value'].partition('#')[2]))
-    for targ in owl_class:
-        if targ['resource']['type'] != 'bnode':
-            targ_choices.add((targ['resource']['value'],
-                        targ['label']['value'] if 'value' in targ['label'] else targ['resource']['value'].partition('#')[2]))
-    targ_sorted = sorted(list(targ_choices), key=lambda x: x[1])
+    res_sorted, conn_sorted, targ_sorted = _choice_lists(query)
     update_form = forms.AddConnectionForm()
-    update_form.resource.choices = res_sorted[:]
-    update_form.resource.choices.insert(0, (' ', ''))
-    update_form.resource.choices.insert(0, ('-', '---'))
-    update_form.resource.choices.insert(0, ('', 'Resource'))
-    update_form.connection.choices = conn_sorted[:]
-    update_form.connection.choices.insert(0, (' ', ''))
-    update_form.connection.choices.insert(0, ('-', '---'))
-    update_form.connection.choices.insert(0, ('', 'Connection'))
-    update_form.target.choices = targ_sorted[:]
-    update_form.target.choices.insert(0, (' ', ''))
-    update_form.target.choices.insert(0, ('-', '---'))
-    update_form.target.choices.insert(0, ('', 'Target'))
+    _fill_choices(update_form.resource, res_sorted, 'Resource')
+    _fill_choices(update_form.connection, conn_sorted, 'Connection')
+    _fill_choices(update_form.target, targ_sorted, 'Target')
     if update_form.validate_on_submit():
         print('update_form validated')
         resource = Subject(update_form.resource.data)
@@ -385,12 +469,162 @@ def show_subject():
     subject. Access to this information may even help the user devise a better
     query.
     
+    Only the number of links for each predicate, both from and to the subject,
+    is shown at first, and the links themselves are listed one page at a time
+    by show_links(). A hub with thousands of links is therefore no more costly
+    to display than any other subject. Both directions are counted at once
+    when an asynchronous connection is available.
+    
+    Most subjects rarely change, so the page is served conditionally. A strong
+    ETag is derived from the subject, the user id kept in the session, and the
+    last change log entry of the graphs that the page shows, which every
+    SPARQLER appends to, in any process that shares its database, so writes
+    to other graphs leave the page valid. No Last-Modified time is sent,
+    since HTTP dates cannot tell apart two writes made in the same second. A
+    request that already holds the current ETag is answered with '304 Not
+    Modified' before the endpoint is queried, or the user is loaded.
+    Otherwise, recently rendered pages are served from a small cache keyed by
+    the same ETag. A page that holds stale results is never cached. Writes
+    that do not pass through a SPARQLER, such as those of other clients of
+    the endpoint, are not seen.
+    
     Returns:
         Rendered page containing all predicates and objects for one subject.
     """
-    subject = Subject(request.args.get('subject'))
-    return render_template('show_subject.html',
-                           title=subject.id, preds=subject.preds)
+    subject_id = request.args.get('subject', '')
+    if not TERM_PATTERNS['uri'].match(subject_id):
+        abort(400)
+    # a Subject reads the default scope of the endpoint, logged as ''
+    seq = get_changelog().latest({''})[0]
+    digest = hashlib.sha1()
+    digest.update(repr((subject_id, session.get('user_id'),
+                        seq)).encode('utf-8'))
+    etag = digest.hexdigest()
+    if not is_resource_modified(request.environ, etag=etag):
+        response = Response(status=304)
+    else:
+        # pending flashed messages make a page unique to one response
+        cacheable = '_flashes' not in session
+        html = None
+        if cacheable:
+            with page_cache_lock:
+                if etag in page_cache:
+                    page_cache.move_to_end(etag)
+                    html = page_cache[etag]
+        if html is None:
+            subject = Subject(subject_id)
+            sparql = g.async_sparql or g.sparql
+            outgoing, incoming = gather(subject.count_links('out', sparql),
+                                        subject.count_links('in', sparql))
+            html = render_template('show_subject.html', title=subject.id,
+                                   outgoing=outgoing, incoming=incoming)
+            if cacheable and not (g.sparql.stale or sparql.stale):
+                with page_cache_lock:
+                    page_cache[etag] = html
+                    while len(page_cache) > app.config['SUBJECT_CACHE_SIZE']:
+                        page_cache.popitem(last=False)
+        response = make_response(html)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+@app.route('/retrieve/links')
+def show_links():
+    """Display one page of the links between a subject and one predicate.
+    
+    The 'direction' argument selects links from the subject, 'out', or links
+    to it, 'in', and 'offset' selects the page. One link more than the page
+    size is retrieved to learn whether a following page exists.
+    
+    Returns:
+        Rendered page listing the subjects at the other end of the links.
+    """
+    subject_id = request.args.get('subject', '')
+    predicate = request.args.get('predicate', '')
+    direction = request.args.get('direction', 'out')
+    try:
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        abort(400)
+    if offset < 0 or direction not in ('out', 'in'):
+        abort(400)
+    if not (TERM_PATTERNS['uri'].match(subject_id) and
+            TERM_PATTERNS['uri'].match(predicate)):
+        abort(400)
+    limit = app.config['SUBJECT_PAGE_SIZE']
+    subject = Subject(subject_id)
+    links = subject.get_links(predicate, direction, limit=limit + 1,
+                              offset=offset)
+    return render_template('show_links.html', title=subject_id,
+                           predicate=predicate, direction=direction,
+                           links=links[:limit], offset=offset,
+                           previous=max(offset - limit, 0),
+                           following=offset + limit, more=len(links) > limit)
+
+
+@app.route('/stats')
+def show_stats():
+    """Display how many triples each predicate and instances each class have.
+    
+    The counts come from the statistics that are gathered in the background,
+    so this page never waits on the endpoint. Graphs to include may be named
+    with repeated 'graph' arguments, otherwise the default graph is shown.
+    Percentiles of read latency in this process are shown as well, both for
+    single attempts and for reads as answered after hedging.
+    
+    Returns:
+        Rendered page with tables of predicate and class counts.
+    """
+    graphlist = set(request.args.getlist('graph')) or {''}
+    query = Query(graphlist = graphlist, labellist = set(),
+                  subjectlist = {}, optlist = [])
+    statistics = query.get_statistics()
+    predicates = sorted(statistics['predicates'].items(),
+                        key=lambda item: (-item[1], item[0]))
+    classes = sorted(statistics['classes'].items(),
+                     key=lambda item: (-item[1], item[0]))
+    return render_template('stats.html', title=uiLabel.viewStatsTitle,
+                           predicates=predicates, classes=classes,
+                           latency=SPARQLER.latency_report())
+
+
+@app.route('/neighborhood')
+def neighborhood():
+    """Display every subject within a few links of a single subject.
+    
+    The subgraph is expanded breadth-first by Subject.neighborhood(), which
+    needs one query per level instead of one per subject, so exploring a few
+    levels out costs a few round trips. The 'depth' argument sets the number
+    of levels, 'direction' may be 'out', 'in', or 'both', and repeated
+    'predicate' arguments restrict the links that are followed.
+    
+    Returns:
+        Rendered page listing the subjects and links of the subgraph.
+    """
+    subject_id = request.args.get('subject', '')
+    direction = request.args.get('direction', 'both')
+    predicates = request.args.getlist('predicate')
+    try:
+        depth = int(request.args.get('depth', 1))
+    except ValueError:
+        abort(400)
+    if depth < 1 or direction not in ('out', 'in', 'both'):
+        abort(400)
+    # identifiers are placed in the query, so they must not break out of it
+    if not TERM_PATTERNS['uri'].match(subject_id):
+        abort(400)
+    for predicate in predicates:
+        if not (TERM_PATTERNS['pfx'].match(predicate) or
+                TERM_PATTERNS['uri'].match(predicate)):
+            abort(400)
+    subject = Subject(subject_id)
+    subgraph = subject.neighborhood(depth, direction, predicates)
+    return render_template('neighborhood.html',
+                           title='{} {}'.format(
+                               uiLabel.viewNeighborhoodTitle, subject_id),
+                           nodes=subgraph['nodes'], edges=subgraph['edges'])
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -460,8 +694,8 @@ def add_user():
         return redirect(url_for('resources'))
     form = forms.CreateUserForm()
     if form.validate_on_submit():
-        user = User(form.username.data)
-        if len(user.preds) <= 1:
+        if not User.exists(form.username.data):
+            user = User(form.username.data)
             user.set_hash(bcrypt.generate_password_hash(form.password.data))
             user.set_active()
         else: